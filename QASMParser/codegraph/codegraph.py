@@ -6,6 +6,7 @@ import copy
 import networkx
 from .drawing import COLOURS
 from .graphbuilder import GraphBuilder
+from .scheduler import Schedule
 
 class Vertex():
     """ Class defining a single tensor node vertex """
@@ -20,6 +21,7 @@ class Vertex():
         self._parent = graph
         self._fixedEdges = None
         self._req = None
+        self._layer = None
         self.lastNode = True
 
     def __deepcopy__(self, memo):
@@ -37,6 +39,7 @@ class Vertex():
     qubitID = property(lambda self: self._qubitID)
     age = property(lambda self: self._age)
     localAge = property(lambda self: self._localAge)
+    layer = property(lambda self: self._layer)
     contracted = property(lambda self: self._contracted)
     edges = property(lambda self: self.graph.edges(self.ID))
     fixedEdges = property(lambda self: self._fixedEdges)
@@ -54,12 +57,15 @@ class CodeGraph(GraphBuilder):
         for i in range(nQubits):
             self._entang.add_node(i)
             self._tensorGraph.add_node(i, node=Vertex(ID=i, qubitID=i, age=1, localAge=1, graph=self.tensorGraph))
+            self.tensorGraph.nodes[i]["node"]._layer = 0
             end = Vertex(ID="end"+str(i), qubitID=i, age=None, localAge=None, graph=self.tensorGraph, operation=None)
             end.lastNode = False
             self.tensorGraph.add_node("end"+str(i), node=end)
         self._lastUpdated = [node.ID for node in self.verts]
         self._nGate = 1
         self._nGateQubit = [1]*nQubits
+        self._opVerts = []
+        self.schedule = None
         self.graph = None
         self._GraphBuilder__parse_code()
 
@@ -106,29 +112,36 @@ class CodeGraph(GraphBuilder):
             self._lastUpdated[qubit] = current
             if qubit != min(self.qubitsInvolved): # Skip if initial qubit (nothing to link to)
                 self._tensorGraph.add_edge(current, lastVertex, weight=1)
-                nodes = (self.tensorGraph.nodes[lastVertex]["node"].qubitID,
-                         self.tensorGraph.nodes[current]["node"].qubitID)
-                if self._entang.has_edge(*nodes):
-                    self._entang[nodes[0]][nodes[1]]["weight"] += 1
+                pair = (self.tensorGraph.nodes[lastVertex]["node"].qubitID,
+                        self.tensorGraph.nodes[current]["node"].qubitID)
+                if self._entang.has_edge(*pair):
+                    self._entang[pair[0]][pair[1]]["weight"] += 1
                 else:
-                    self._entang.add_edge(*nodes, weight=1)
+                    self._entang.add_edge(*pair, weight=1)
             # Link to previous qubit in operation
             lastVertex = current
 
+        self._opVerts.append(nodes)
         return nodes
 
     def _handle_measure(self, **kwargs):
-        nodes = self._process(**kwargs)
-        # for node in nodes:
-        #     node.req = backprop(node)
+        self._process(**kwargs)
         self._set_qubits()
 
     def _finalise(self):
+        # Layer vertices by ASAP scheduling of the operations (initial states are layer 0)
+        self.schedule = Schedule.from_ops([[vert.qubitID for vert in verts] for verts in self._opVerts],
+                                          self.nQubits)
+        for layer, verts in zip(self.schedule.asap, self._opVerts):
+            for vert in verts:
+                vert._layer = int(layer) + 1
+
         # Link final qubit with fictional outlet
         for qubit, node in enumerate(self._lastUpdated):
             end = self.tensorGraph.nodes["end"+str(qubit)]["node"]
             end._age = self.nGate+1
             end._localAge = self.nGateQubit[qubit]+1
+            end._layer = self.schedule.depth+1
             self.tensorGraph.add_edge(node, "end"+str(qubit), key="end")
 
         # Set weight of entanglement nodes to number of gates they hold
@@ -188,7 +201,7 @@ class CodeGraph(GraphBuilder):
         graph.layout()
         for vert in self.allVerts:
             node = graph.get_node(vert.ID)
-            node.attr["pos"] = "{:f},{:f}".format(vert.age*scale, vert.qubitID*scale)
+            node.attr["pos"] = "{:f},{:f}".format(vert.layer*scale, vert.qubitID*scale)
 
         for edge in graph.edges_iter():
             fromNode, toNode = graph.get_node(edge[0]), graph.get_node(edge[1])
@@ -209,16 +222,3 @@ class CodeGraph(GraphBuilder):
             data['len'] = 2
         entangGraph = networkx.nx_agraph.to_agraph(self.entang)
         entangGraph.draw(outFile, prog="neato")
-
-
-def backprop(node, graph):
-    """ Find the causal contributors to node "node" in graph "graph" """
-    nodes = [node]
-    trace = []
-    while nodes:
-        currNode = nodes.pop()
-        predecessors = [neighbour for neighbour in graph.neighbors(currNode)
-                        if neighbour["node"].age <= currNode["node"].age]
-        trace.extend(predecessors)
-        nodes.extend(predecessors)
-    return trace
@@ -4,7 +4,7 @@ Contains the definition of an object for defining graph builders and code parser
 from abc import ABC
 import numpy as np
 from .utility import (slice_inclusive, range_inclusive)
-from ..parser.types import (resolve_arg, CallGate, Opaque, SetAlias, Alias, Loop, CBlock, Measure)
+from ..parser.types import (resolve_arg, CallGate, Opaque, SetAlias, Alias, Loop, CBlock, Measure, ApplyMatrix)
 
 class GraphBuilder(ABC):
     """ Quantum circuit parser
@@ -84,7 +84,7 @@ class GraphBuilder(ABC):
             if isinstance(line, CallGate):
                 if not isinstance(line.callee, Opaque) and (self.maxDepth < 0 or depth < self.maxDepth):
                     # Prepare args and enter function
-                    spargsSend = {arg.name: maths(sparg.val) for arg, sparg in zip(line.callee.spargs, line.spargs)}
+                    spargsSend = {arg.name: maths(sparg) for arg, sparg in zip(line.callee.spargs, line.spargs)}
                     if line.loops is not None:
                         for loopVar in range_inclusive(maths(line.loops.start[0]), maths(line.loops.end[0])):
                             qargsSend = {arg.name: resolve_arg(codeObject, qarg, args, spargs, loopVar)
@@ -101,7 +101,19 @@ class GraphBuilder(ABC):
                 qargs = line.qargs
 
                 if line.loops is not None:
-                    for loopVar in range(maths(line.loops.start[0]), maths(line.loops.end[0])):
+                    for loopVar in range_inclusive(maths(line.loops.start[0]), maths(line.loops.end[0])):
+                        for qarg in qargs:
+                            self._set_qubits(1, resolve_arg(codeObject, qarg, args, spargs, loopVar))
+                        self.__process(lineObj=line)
+                else:
+                    for qarg in qargs:
+                        self._set_qubits(1, resolve_arg(codeObject, qarg, args, spargs))
+                    self.__process(lineObj=line)
+
+            elif isinstance(line, ApplyMatrix):
+                qargs = line.qargs + line.controls
+                if line.loops is not None:
+                    for loopVar in range_inclusive(maths(line.loops.start[0]), maths(line.loops.end[0])):
                         for qarg in qargs:
                             self._set_qubits(1, resolve_arg(codeObject, qarg, args, spargs, loopVar))
                         self.__process(lineObj=line)
@@ -133,7 +145,7 @@ class GraphBuilder(ABC):
 
             elif isinstance(line, Measure):
                 if line.loops is not None:
-                    for loopVar in range(maths(line.loops.start[0]), maths(line.loops.end[0])):
+                    for loopVar in range_inclusive(maths(line.loops.start[0]), maths(line.loops.end[0])):
                         self._set_qubits(1, resolve_arg(codeObject, line.qargs, args, spargs, loopVar))
                         self._handle_measure(lineObj=line)
                 else:
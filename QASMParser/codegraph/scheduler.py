@@ -0,0 +1,124 @@
+"""
+Contains routines to schedule the resolved gate stream into layers of gates which may run in parallel
+"""
+
+import numpy as np
+from .graphbuilder import GraphBuilder
+
+class Schedule:
+    """ ASAP and ALAP layering of a stream of operations
+
+    Qubits acted on by each operation are stored in compressed form, operation i acts on
+    qubits[qubitPtr[i]:qubitPtr[i+1]]
+
+    :param qubits: Flat array of the qubits acted on by each operation in turn
+    :param qubitPtr: Offsets into qubits of each operation (length nOps + 1)
+    :param nQubits: Number of qubits in the circuit
+    """
+    def __init__(self, qubits, qubitPtr, nQubits):
+        self._qubits = np.asarray(qubits, dtype=np.int32)
+        self._qubitPtr = np.asarray(qubitPtr, dtype=np.int64)
+        self._nQubits = nQubits
+        self._asap = np.zeros(self.nOps, dtype=np.int32)
+        self._alap = np.zeros(self.nOps, dtype=np.int32)
+        self._depth = 0
+        self._schedule()
+
+    @classmethod
+    def from_ops(cls, ops, nQubits):
+        """ Build a schedule from a list of the qubits acted on by each operation """
+        qubitPtr = np.zeros(len(ops) + 1, dtype=np.int64)
+        qubitPtr[1:] = np.cumsum([len(op) for op in ops])
+        qubits = np.concatenate(ops) if ops else np.zeros(0, dtype=np.int32)
+        return cls(qubits, qubitPtr, nQubits)
+
+    nOps = property(lambda self: len(self._qubitPtr) - 1)
+    nQubits = property(lambda self: self._nQubits)
+    depth = property(lambda self: self._depth)
+    asap = property(lambda self: self._asap)
+    alap = property(lambda self: self._alap)
+    slack = property(lambda self: self._alap - self._asap)
+    critical = property(lambda self: self.slack == 0)
+    opSizes = property(lambda self: np.diff(self._qubitPtr))
+    qubits = property(lambda self: self._qubits)
+    qubitPtr = property(lambda self: self._qubitPtr)
+
+    def op_qubits(self, op):
+        """ Qubits acted on by operation op """
+        return self._qubits[self._qubitPtr[op]:self._qubitPtr[op+1]]
+
+    def _schedule(self):
+        """ Compute ASAP layers forwards and ALAP layers backwards through the stream """
+        ready = np.zeros(self.nQubits, dtype=np.int32)
+        for op in range(self.nOps):
+            qubits = self.op_qubits(op)
+            layer = ready[qubits].max() if len(qubits) else 0
+            self._asap[op] = layer
+            ready[qubits] = layer + 1
+        self._depth = int(ready.max()) if self.nQubits else 0
+
+        latest = np.full(self.nQubits, self._depth - 1, dtype=np.int32)
+        for op in reversed(range(self.nOps)):
+            qubits = self.op_qubits(op)
+            layer = latest[qubits].min() if len(qubits) else self._depth - 1
+            self._alap[op] = layer
+            latest[qubits] = layer - 1
+
+    def occupancy(self, alap=False):
+        """ Qubit occupancy of each layer
+
+        :param alap: Use ALAP rather than ASAP layers
+        :returns: (depth, nQubits) array, 1 where a qubit is acted on in a layer
+        :rtype: numpy.ndarray
+        """
+        layers = self._alap if alap else self._asap
+        occupancy = np.zeros((self.depth, self.nQubits), dtype=np.int8)
+        occupancy[np.repeat(layers, self.opSizes), self._qubits] = 1
+        return occupancy
+
+    def layer_sizes(self, alap=False):
+        """ Number of operations in each layer """
+        return np.bincount(self._alap if alap else self._asap, minlength=self.depth)
+
+    def layers(self, alap=False):
+        """ Operation indices grouped by layer
+
+        :param alap: Use ALAP rather than ASAP layers
+        :returns: List of arrays of operation indices, one per layer in order
+        :rtype: list
+        """
+        layers = self._alap if alap else self._asap
+        order = np.argsort(layers, kind="stable")
+        return np.split(order, np.cumsum(self.layer_sizes(alap))[:-1])
+
+    def __str__(self):
+        if not self.nOps:
+            return "Schedule: empty circuit"
+        occupancy = self.occupancy()
+        return (f"Schedule: depth {self.depth} layers for {self.nOps} operations on {self.nQubits} qubits, "
+                f"{int(self.critical.sum())} operations on the critical path, "
+                f"mean parallelism {self.nOps / self.depth:.2f} operations per layer, "
+                f"mean qubit occupancy {100 * occupancy.mean():.1f}%")
+
+class Scheduler(GraphBuilder):
+    """ Collect the resolved gate stream of code and schedule it into layers """
+    def __init__(self, code: list, nQubits: int, maxDepth: int = -1):
+        GraphBuilder.__init__(self, code, nQubits, maxDepth)
+        self._ops = []
+        self._lines = []
+        self.schedule = None
+        self._GraphBuilder__parse_code()
+
+    lines = property(lambda self: self._lines)
+
+    def _process(self, **kwargs):
+        """ Record the qubits acted on by an operation """
+        self._ops.append(self.qubitsInvolved.astype(np.int32))
+        self._lines.append(kwargs["lineObj"])
+
+    def _handle_measure(self, **kwargs):
+        self._process(**kwargs)
+        self._set_qubits()
+
+    def _finalise(self):
+        self.schedule = Schedule.from_ops(self._ops, self.nQubits)
@@ -0,0 +1,403 @@
+"""
+Module to fit the code written to a budget of statements by re-rolling runs of calls into loops and unrolling small
+loops
+"""
+import copy
+import re
+from ..parser.types import (Gate, Opaque, CallGate, Measure, Include, Let, Constant, Loop, NestLoop, IfBlock, While)
+from .constfold import (evaluate, harvest, NotConstant)
+from .stream import (canonical)
+
+# Fewest calls re-rolled into a loop
+MIN_ROLL = 3
+# Most iterations of a loop unrolled
+MAX_UNROLL = 8
+
+class CodeSizeReport:
+    """ Record of the runs re-rolled and the loops unrolled to fit the budget """
+    def __init__(self, budget, before):
+        self.budget = budget
+        self.before = before
+        self.after = before
+        self.runs = 0
+        self.calls = 0
+        self.tables = 0
+        self.unrolled = 0
+
+    def __str__(self):
+        return (f"Code size: {self.before} -> {self.after} statements for a budget of {self.budget}, "
+                f"{self.calls} calls re-rolled into {self.runs} loops ({self.tables} over index arrays), "
+                f"{self.unrolled} small loops unrolled")
+
+def fit_code_size(codeObj, budget):
+    """ Change the shape of the code written so that it fits in budget statements where possible
+
+    If the code is over budget, runs of calls of the same gate with the same parameters (or measurements) whose
+    qubit indices differ are re-rolled into loops, those saving the most first, until it fits. Indices which are
+    affine in the position in the run become expressions of the loop variable and any others are read from a
+    constant index array declared before the loop. If the code is within budget, implicit and explicit loops of at
+    most MAX_UNROLL iterations with constant bounds whose bodies are only calls are instead unrolled, the smallest
+    first, while it stays within budget.
+
+    :param codeObj: ProgFile to optimise
+    :param budget: Most statements to write, counting each level of implicit loops and the lines of circuits
+    :returns: Report of the changes made
+    :rtype: CodeSizeReport
+    """
+    report = CodeSizeReport(budget, code_size(codeObj.code))
+    blocks = list(_blocks(codeObj, codeObj.code, set()))
+    if report.before > budget:
+        _Roller(codeObj, report).fit(blocks, report.before - budget)
+    else:
+        _unroll(blocks, budget - report.before, report)
+    report.after = code_size(codeObj.code)
+    return report
+
+def code_size(code):
+    """ Number of statements written for code, counting each level of implicit loops and the lines of child blocks """
+    size = 0
+    for line in code:
+        size += 1 + len(_levels(line))
+        if isinstance(line, Include):
+            size += code_size(line.raw_code)
+        elif isinstance(getattr(line, "code", None), list):
+            size += code_size(line.code)
+    return size
+
+def _levels(line):
+    """ Implicit loops wrapping line, outermost first """
+    levels = []
+    loop = getattr(line, "loops", None)
+    while isinstance(loop, NestLoop):
+        levels.append(loop)
+        loop = loop.code[0]
+    return levels
+
+def _blocks(scope, code, runtime):
+    """ Yield each list of code with the block it is resolved in and the names only known at run time """
+    yield scope, code, runtime
+    for line in code:
+        if isinstance(line, Gate) and not isinstance(line, Opaque):
+            args = {arg.name for arg in (*line.pargs, *line.spargs, *line.qargs)}
+            yield from _blocks(line, line.code, runtime | args)
+        elif isinstance(line, Include):
+            yield from _blocks(scope, line.raw_code, runtime)
+        elif isinstance(line, Loop):
+            yield from _blocks(line, line.code, runtime | set(line.var))
+        elif isinstance(line, (IfBlock, While)):
+            yield from _blocks(line, line.code, runtime)
+
+def _args(line):
+    """ [register, index] pairs a call or measurement acts on, in order """
+    if isinstance(line, Measure):
+        return [line.qargs, line.pargs]
+    return line.qargs
+
+def _set_args(line, args):
+    """ Replace the [register, index] pairs of line by args """
+    if isinstance(line, Measure):
+        line._qargs, line._pargs = args
+    else:
+        line._qargs = args
+
+def _shape(scope, line, runtime):
+    """ What a line does apart from the integer indices it acts on, with those indices
+
+    :returns: (key, indices) where lines of equal keys differ only in indices, None if line cannot be re-rolled
+    :rtype: tuple
+    """
+    if getattr(line, "loops", None) or hasattr(line, "inlineComment"):
+        return None
+    if isinstance(line, CallGate) and not line.byprod and not line.gargs:
+        params = canonical(scope, [*line.pargs, *line.spargs], runtime)
+        if params is None:
+            return None
+        key = [line.callee, params]
+    elif isinstance(line, Measure):
+        key = ["measure"]
+    else:
+        return None
+    indices = []
+    for reg, index in _args(line):
+        value = canonical(scope, index, runtime)
+        if value is None:
+            return None
+        key.append(id(reg))
+        # Indices which are not single integers (ranges, runtime maths) must be the same throughout a run
+        if isinstance(value, int) and not isinstance(value, bool):
+            indices.append(value)
+            key.append(None)
+        else:
+            indices.append(None)
+            key.append(value)
+    return tuple(key), indices
+
+def _affine(column):
+    """ Start and stride of a column of indices if it is affine in the position, None otherwise """
+    stride = column[1] - column[0] if len(column) > 1 else 0
+    if all(index == column[0] + stride*pos for pos, index in enumerate(column)):
+        return column[0], stride
+    return None
+
+class _Roller:
+    """ Re-roll runs of lines which differ only in integer indices into loops
+
+    :param codeObj: ProgFile being optimised, whose names the loop variables must not clash with
+    :param report: Report to record changes in
+    """
+    def __init__(self, codeObj, report):
+        self.report = report
+        self.names = set(codeObj.get_objs("Copy"))
+        self.nLoops = 0
+
+    def fit(self, blocks, excess):
+        """ Re-roll the runs saving the most statements until excess statements are saved """
+        candidates = []
+        for scope, code, runtime in blocks:
+            candidates += self.runs(scope, code, runtime)
+        candidates.sort(key=lambda candidate: -candidate[0])
+
+        chosen = {}
+        saved = 0
+        for saving, code, start, end, pieces in candidates:
+            if saved >= excess:
+                break
+            chosen.setdefault(id(code), (code, []))[1].append((start, end, pieces))
+            saved += saving
+
+        for code, runs in chosen.values():
+            scope, runtime = next((scope, runtime) for scope, block, runtime in blocks if block is code)
+            for start, end, pieces in sorted(runs, key=lambda run: -run[0]):
+                code[start:end] = self.roll(scope, code[start:end], pieces, runtime)
+
+    def runs(self, scope, code, runtime):
+        """ Candidate runs of code, each (saving, code, start, end, pieces) """
+        candidates = []
+        run, key, start = [], None, 0
+        for pos, line in enumerate([*code, None]):
+            shape = None if line is None else _shape(scope, line, runtime)
+            if shape is not None and run and shape[0] == key:
+                run.append(shape[1])
+                continue
+            if len(run) >= MIN_ROLL:
+                saving, pieces = self.plan(run)
+                if saving > 0:
+                    candidates.append((saving, code, start, pos, pieces))
+            key, run, start = (shape[0], [shape[1]], pos) if shape is not None else (None, [], pos)
+        return candidates
+
+    @staticmethod
+    def plan(indices):
+        """ Cheapest way to write a run with the given indices
+
+        :returns: (statements saved, pieces) where each piece is the (start, end) of lines written as one loop
+        :rtype: tuple
+        """
+        nLines = len(indices)
+        columns = [pos for pos, index in enumerate(indices[0]) if index is not None]
+
+        # Split into maximal runs affine in every column, each written as a loop if long enough
+        affine, cost, start = [], 0, 0
+        while start < nLines:
+            end = min(start + 2, nLines)
+            strides = [indices[end-1][col] - indices[start][col] for col in columns]
+            while end < nLines and all(indices[end][col] - indices[end-1][col] == stride
+                                       for col, stride in zip(columns, strides)):
+                end += 1
+            if end - start >= MIN_ROLL:
+                affine.append((start, end))
+                cost += 2
+            else:
+                end = start + 1
+                cost += 1
+            start = end
+
+        # Or the whole run as one loop reading the columns which are not affine from index arrays
+        tables = sum(1 for col in columns if _affine([index[col] for index in indices]) is None)
+        if 2 + tables < cost:
+            return nLines - 2 - tables, [(0, nLines)]
+        return nLines - cost, affine
+
+    def roll(self, scope, lines, pieces, runtime):
+        """ Lines with the pieces given re-rolled into loops """
+        newCode = []
+        done = 0
+        for start, end in pieces:
+            newCode += lines[done:start]
+            indices = [_shape(scope, line, runtime)[1] for line in lines[start:end]]
+            newCode += self.loop(scope, lines[start:end], indices)
+            done = end
+        return newCode + lines[done:]
+
+    def loop(self, scope, lines, indices):
+        """ Loop equivalent to lines, acting on the integer indices given (None where they are the same throughout),
+        preceded by the index arrays it reads
+        """
+        var = self.name("_roll")
+        nLines = len(lines)
+        columns = [None if index is None else [row[pos] for row in indices] for pos, index in enumerate(indices[0])]
+        fits = [None if column is None else _affine(column) for column in columns]
+
+        # Count over the indices of a column directly if every column which varies steps alike
+        base, step = 0, 1
+        strides = {fit[1] for fit in fits if fit is not None and fit[1] != 0}
+        if len(strides) == 1 and all(fit is not None for column, fit in zip(columns, fits) if column is not None):
+            stride = strides.pop()
+            if stride > 0:
+                base, step = next(fit for fit in fits if fit is not None and fit[1] == stride)
+
+        lets, args = [], []
+        for pos, ((reg, index), column, fit) in enumerate(zip(_args(lines[0]), columns, fits)):
+            if column is None:
+                args.append([reg, index])
+            elif fit is not None:
+                args.append([reg, _index(var, base, step, *fit)])
+            else:
+                table = f"{var}_arg{pos}"
+                self.names.add(table)
+                lets.append(Let(scope, (table, "const listint"), (column, None)))
+                args.append([reg, f"{table}[{var}]"])
+        rolled = copy.copy(lines[0])
+        _set_args(rolled, args)
+        body = copy.copy(rolled)
+        body.loops = []
+        rolled.innermost = NestLoop(body, var, base, base + step*(nLines - 1), step)
+        rolled.loops = rolled.innermost
+
+        self.report.runs += 1
+        self.report.calls += nLines
+        self.report.tables += 1 if lets else 0
+        return lets + [rolled]
+
+    def name(self, prefix):
+        """ Name starting with prefix used nowhere else """
+        name = f"{prefix}{self.nLoops}"
+        while name in self.names:
+            self.nLoops += 1
+            name = f"{prefix}{self.nLoops}"
+        self.nLoops += 1
+        self.names.add(name)
+        return name
+
+def _index(var, base, step, start, stride):
+    """ Index start + stride*k written in terms of var = base + step*k """
+    if stride == 0:
+        return start
+    if stride == step:
+        return var if start == base else f"{var} + {start - base}"
+    term = var if stride == 1 else f"{stride}*{var}"
+    if start == 0:
+        return term
+    return f"{start} + {term}" if stride > 0 else f"{start} - {-stride}*{var}"
+
+def _unroll(blocks, room, report):
+    """ Unroll the smallest loops of constant bounds first while they fit in room more statements """
+    candidates = []
+    for scope, code, runtime in blocks:
+        for line in code:
+            copies = _implicit_copies(scope, line, runtime) if _levels(line) else None
+            if isinstance(line, Loop) and not isinstance(line, NestLoop):
+                copies = _explicit_copies(line, runtime)
+            if copies is not None:
+                candidates.append((len(copies) - code_size([line]), code, line, copies))
+    candidates.sort(key=lambda candidate: candidate[0])
+
+    chosen = {}
+    for growth, code, line, copies in candidates:
+        if growth > room:
+            break
+        room -= growth
+        chosen.setdefault(id(code), (code, {}))[1][id(line)] = copies
+        report.unrolled += 1
+
+    for code, copies in chosen.values():
+        code[:] = [newLine for line in code for newLine in copies.get(id(line), [line])]
+
+def _constant_range(scope, start, end, step, runtime):
+    """ Values taken by an inclusive loop of constant bounds and at most MAX_UNROLL iterations, None otherwise """
+    try:
+        start, end, step = (evaluate(scope, elem, runtime) for elem in (start, end, step))
+    except NotConstant:
+        return None
+    if not all(isinstance(elem, int) for elem in (start, end, step)) or step == 0:
+        return None
+    values = range(start, end + (1 if step > 0 else -1), step)
+    return values if len(values) <= MAX_UNROLL else None
+
+def _unlooped(line, args, pargs=None, spargs=None):
+    """ Copy of line, outside any implicit loop, with new arguments """
+    newLine = copy.copy(line)
+    newLine.loops = None
+    newLine.innermost = None
+    _set_args(newLine, args)
+    if pargs is not None:
+        newLine._pargs = pargs
+    if spargs is not None:
+        newLine._spargs = spargs
+    return newLine
+
+def _implicit_copies(scope, line, runtime):
+    """ Copies of a line with one level of implicit loop for each iteration, None if it cannot be unrolled """
+    levels = _levels(line)
+    if len(levels) != 1 or len(levels[0].var) != 1 or not isinstance(line, (CallGate, Measure)):
+        return None
+    loop = levels[0]
+    values = _constant_range(scope, loop.start[0], loop.end[0], loop.step[0], runtime)
+    if values is None:
+        return None
+    var = loop.var[0]
+    offset = re.compile(rf"{re.escape(var)}(?: \+ (-?\d+))?")
+
+    def substitute(index, value):
+        match = offset.fullmatch(index) if isinstance(index, str) else None
+        if match is None:
+            if isinstance(index, str) and re.search(rf"\b{re.escape(var)}\b", index):
+                raise NotConstant(index)
+            return index
+        return value + int(match.group(1) or 0)
+
+    body = loop.code[0]
+    try:
+        return [_unlooped(body, [[reg, substitute(index, value)] for reg, index in _args(body)]) for value in values]
+    except NotConstant:
+        return None
+
+def _explicit_copies(loop, runtime):
+    """ Copies of the body of a for loop for each iteration, None if it cannot be unrolled """
+    if len(loop.var) != 1 or loop.cycle or loop.finish:
+        return None
+    if not loop.code or not all(isinstance(line, (CallGate, Measure)) and not getattr(line, "loops", None)
+                                and not getattr(line, "byprod", None) for line in loop.code):
+        return None
+    values = _constant_range(loop.parent, loop.start[0], loop.end[0], loop.step[0], runtime)
+    if values is None:
+        return None
+    var = loop.var[0]
+
+    def substitute(elem, value, integer):
+        # A bare reference to the variable resolves to its declared value rather than the binding
+        if isinstance(elem, (str, Constant)) and getattr(elem, "name", elem) == var:
+            return value
+        used = set()
+        harvest(elem, used)
+        if var not in used and not (isinstance(elem, str) and re.search(rf"\b{re.escape(var)}\b", elem)):
+            return elem
+        result = evaluate(loop, elem, runtime, bindings={var: value})
+        if integer and not isinstance(result, int):
+            raise NotConstant(elem)
+        return result
+
+    copies = []
+    try:
+        for value in values:
+            for line in loop.code:
+                args = [[reg, substitute(index, value, True)] for reg, index in _args(line)]
+                if isinstance(line, Measure):
+                    copies.append(_unlooped(line, args))
+                    continue
+                pargs = [substitute(parg, value, False) for parg in line.pargs]
+                spargs = [substitute(sparg, value, True) for sparg in line.spargs]
+                copies.append(_unlooped(line, args, pargs, spargs))
+    except NotConstant:
+        return None
+    return copies
@@ -0,0 +1,370 @@
+"""
+Module to fold compile-time constants and eliminate dead code from the parsed program before translation
+"""
+import re
+import copy
+from pyparsing import (ParseResults)
+from ..parser.tokens import (Binary, Function)
+from ..parser.types import (mathsNamespace, MathsBlock, Constant, Register, ClassicalRegister,
+                            Alias, InlineAlias, Gate, Include, Let, Loop, NestLoop, IfBlock, While, CBlock,
+                            Comment, SetAlias, Dealloc, Next, CycleTarget, FinishTarget, TheEnd)
+
+identifier = re.compile(r"[A-Za-z_]\w*")
+
+# Functions which may be evaluated at compile time
+_FOLDABLE_FUNCS = set(mathsNamespace) | {"arcsin", "arccos", "arctan"}
+
+class NotConstant(Exception):
+    """ Raised when an expression depends on values only known at run time """
+
+class FoldReport:
+    """ Record of the expressions folded and code eliminated by a folding pass """
+    def __init__(self):
+        self.folded = 0
+        self.prunedIfs = 0
+        self.prunedLoops = 0
+        self.unreachable = 0
+        self.removed = {"constants": [], "aliases": [], "registers": []}
+
+    def __str__(self):
+        outStr = (f"Constant folding: {self.folded} expressions folded, "
+                  f"{self.prunedIfs} conditionals pruned, {self.prunedLoops} loops pruned, "
+                  f"{self.unreachable} unreachable lines removed")
+        for kind, names in self.removed.items():
+            outStr += f"\nEliminated {kind}: {', '.join(names) if names else '-'}"
+        return outStr
+
+def fold_constants(codeObj):
+    """ Fold constant maths, prune dead blocks and remove unused declarations from codeObj
+
+    :param codeObj: ProgFile to optimise in place
+    :returns: Report of what was eliminated
+    :rtype: FoldReport
+    """
+    report = FoldReport()
+    codeObj._code = _fold_code(codeObj, codeObj.code, set(), report)
+    while _eliminate_unused(codeObj, _used_names(codeObj.code), report):
+        pass
+    return report
+
+def fold_gate(gate):
+    """ Fold constant maths and prune dead blocks within the body of gate in place
+
+    :param gate: Gate to optimise, names bound to constants in its scope are folded
+    :returns: Report of what was folded
+    :rtype: FoldReport
+    """
+    report = FoldReport()
+    args = {arg.name for arg in (*gate.pargs, *gate.spargs, *gate.qargs)}
+    gate._code = _fold_code(gate, gate.code, args, report)
+    return report
+
+def _walk_constant(scope, elem, runtime, ops, leaves, visited=frozenset(), bindings=None):
+    """ Collect operators and numerical leaves of elem, raising NotConstant if any leaf is not known
+
+    :param scope: Block in which elem is resolved
+    :param elem: Element of maths to check
+    :param runtime: Names which are only known at run time (arguments, loop variables)
+    :param ops: Set to accumulate operators into
+    :param leaves: List to accumulate numerical leaves into
+    :param visited: Constants already being resolved (guards self-reference)
+    :param bindings: Values of names known for this evaluation only (e.g. gate arguments)
+    """
+    if bindings is None:
+        bindings = {}
+    walk = lambda sub, seen=visited: _walk_constant(scope, sub, runtime, ops, leaves, seen, bindings)
+    if isinstance(elem, bool):
+        leaves.append(int(elem))
+    elif isinstance(elem, (int, float)):
+        leaves.append(elem)
+    elif isinstance(elem, MathsBlock):
+        for point in elem.maths:
+            walk(point)
+    elif isinstance(elem, Binary):
+        for operator, operand in elem.args:
+            if operator == "in":
+                raise NotConstant(operator)
+            ops.add(operator)
+            walk(operand)
+    elif isinstance(elem, Function):
+        if elem.op not in _FOLDABLE_FUNCS:
+            raise NotConstant(elem.op)
+        for arg in elem.args:
+            walk(arg)
+    elif isinstance(elem, (str, Constant)):
+        name = getattr(elem, "name", elem)
+        if name in bindings:
+            leaves.append(bindings[name])
+            return
+        if name in runtime or name in visited:
+            raise NotConstant(name)
+        obj = elem if isinstance(elem, Constant) else scope.get_objs("Copy").get(name, None)
+        if not isinstance(obj, Constant) or obj.loopVar:
+            raise NotConstant(name)
+        if obj.val is None: # Language constant
+            if name not in mathsNamespace:
+                raise NotConstant(name)
+            leaves.append(mathsNamespace[name])
+        else:
+            walk(obj.val, visited | {name})
+    else:
+        raise NotConstant(elem)
+
+def evaluate(scope, elem, runtime=(), bindings=None):
+    """ Evaluate elem if it is a compile-time constant
+
+    :param scope: Block in which elem is resolved
+    :param elem: Maths to evaluate
+    :param runtime: Names which are only known at run time
+    :param bindings: Values of names known for this evaluation only (e.g. gate arguments)
+    :returns: Numerical value of elem
+    :rtype: int/float
+    :raises NotConstant: If elem cannot be evaluated at compile time
+    """
+    ops, leaves = set(), []
+    _walk_constant(scope, elem, set(runtime), ops, leaves, bindings=bindings)
+    # Integer division differs between QASM maths and the target languages, leave it to them
+    if "/" in ops and not any(isinstance(leaf, float) for leaf in leaves):
+        raise NotConstant("/")
+    # div and mod round towards minus infinity in Python and towards zero in C, so are left to the target language
+    for operator in ("div", "mod", "%"):
+        if operator in ops:
+            raise NotConstant(operator)
+
+    try:
+        value = eval(scope.resolve_maths(elem, additionalVars=bindings, topLevel=False), copy.copy(mathsNamespace))
+    except (ArithmeticError, ValueError, TypeError, NameError, SyntaxError):
+        raise NotConstant(elem)
+    if isinstance(value, bool):
+        value = int(value)
+    if not isinstance(value, (int, float)):
+        raise NotConstant(elem)
+    return value
+
+def _fold(scope, elem, runtime, report):
+    """ Return elem with all constant sub-expressions replaced by their values """
+    if not isinstance(elem, (MathsBlock, Constant)):
+        return elem
+    try:
+        value = evaluate(scope, elem, runtime)
+        report.folded += 1
+        return value
+    except NotConstant:
+        pass
+
+    if isinstance(elem, MathsBlock):
+        for point in elem.maths:
+            if isinstance(point, Binary):
+                point.args = [(operator, _fold(scope, operand, runtime, report))
+                              for operator, operand in point.args]
+            elif isinstance(point, Function):
+                point.args = [_fold(scope, arg, runtime, report) for arg in point.args]
+    return elem
+
+def _fold_args(scope, args, runtime, report):
+    """ Fold maths in the indices of [register, index] argument pairs in place """
+    if not isinstance(args, list) or not args:
+        return
+    if isinstance(args[0], Register): # Single argument
+        args = [args]
+    for arg in args:
+        if not isinstance(arg, list) or len(arg) != 2:
+            continue
+        index = arg[1]
+        if isinstance(index, tuple):
+            arg[1] = tuple(_fold(scope, elem, runtime, report) for elem in index)
+        else:
+            arg[1] = _fold(scope, index, runtime, report)
+
+def _is_empty(code):
+    """ Check whether a block contains anything other than comments and loop book-keeping """
+    return all(isinstance(line, (Comment, Next, CycleTarget, FinishTarget)) for line in code)
+
+def _declares(code):
+    """ Check whether a block declares anything which would leak scope if spliced into its parent """
+    return any(isinstance(line, (Let, Register, Gate)) for line in code)
+
+def _fold_code(scope, code, runtime, report):
+    """ Fold a list of code lines within scope, returning the new list of lines
+
+    :param scope: Block in which the code is resolved
+    :param code: List of code lines
+    :param runtime: Names which are only known at run time
+    :param report: FoldReport to update
+    :returns: Folded code
+    :rtype: list
+    """
+    fold = lambda elem: _fold(scope, elem, runtime, report)
+    newCode = []
+    exited = False
+    for line in code:
+        # Nothing but definitions and loop labels survives an unconditional exit
+        exited = exited or bool(newCode) and isinstance(newCode[-1], TheEnd)
+        if exited and not isinstance(line, (Gate, Include, Comment, Next, CycleTarget, FinishTarget)):
+            report.unreachable += 1
+            continue
+
+        if isinstance(line, Gate):
+            args = {arg.name for arg in (*line.pargs, *line.spargs, *line.qargs)}
+            line._code = _fold_code(line, line.code, runtime | args, report)
+
+        elif isinstance(line, Include):
+            line._code = _fold_code(scope, line.raw_code, runtime, report)
+
+        elif isinstance(line, Let):
+            line.const.val = fold(line.const.val)
+
+        elif isinstance(line, Loop):
+            line.start = [fold(elem) for elem in line.start]
+            line.end = [fold(elem) for elem in line.end]
+            line.step = [fold(elem) for elem in line.step]
+            line._code = _fold_code(line, line.code, runtime | set(line.var), report)
+            bounds = list(zip(line.start, line.end, line.step))
+            if all(isinstance(elem, (int, float)) for bound in bounds for elem in bound):
+                emptyRange = any(start > end if step > 0 else start < end for start, end, step in bounds)
+            else:
+                emptyRange = False
+            if emptyRange or _is_empty(line.code):
+                report.prunedLoops += 1
+                continue
+
+        elif isinstance(line, IfBlock):
+            line._code = _fold_code(line, line.code, runtime, report)
+            try:
+                cond = evaluate(scope, line.cond, runtime)
+            except NotConstant:
+                cond = None
+            if cond is not None:
+                if not cond or _is_empty(line.code):
+                    report.prunedIfs += 1
+                    continue
+                if not _declares(line.code):
+                    report.prunedIfs += 1
+                    newCode += line.code
+                    continue
+
+        elif isinstance(line, While):
+            line._code = _fold_code(line, line.code, runtime, report)
+            try:
+                if not evaluate(scope, line.cond, runtime):
+                    report.prunedLoops += 1
+                    continue
+            except NotConstant:
+                pass
+
+        else:
+            for attr in ("_pargs", "_spargs"):
+                args = getattr(line, attr, None)
+                if isinstance(args, list) and args and not isinstance(args[0], (Register, list)):
+                    args[:] = [fold(arg) for arg in args] # In place as implicit loops hold a copy of line
+                else:
+                    _fold_args(scope, args, runtime, report)
+            _fold_args(scope, getattr(line, "_qargs", None), runtime, report)
+            if getattr(line, "loops", None):
+                loops = line.loops
+                while isinstance(loops, NestLoop):
+                    loops.start = [fold(elem) for elem in loops.start]
+                    loops.end = [fold(elem) for elem in loops.end]
+                    loops = loops.code[0]
+
+        newCode.append(line)
+    return newCode
+
+def harvest(value, used):
+    """ Add the names referenced by value to the set used """
+    if value is None or isinstance(value, (bool, int, float)):
+        return
+    if isinstance(value, str):
+        used.update(identifier.findall(value))
+    elif isinstance(value, MathsBlock):
+        harvest(value.maths, used)
+    elif isinstance(value, Binary):
+        harvest([operand for _, operand in value.args], used)
+    elif isinstance(value, Function):
+        harvest(list(value.args), used)
+    elif isinstance(value, InlineAlias):
+        harvest(list(value.targets), used)
+    elif isinstance(value, (Register, Constant)):
+        if value.name is not None:
+            used.add(value.name)
+    elif isinstance(value, ParseResults):
+        harvest(value.asList(), used)
+    elif isinstance(value, (list, tuple)):
+        for elem in value:
+            harvest(elem, used)
+
+def _used_names(code, used=None):
+    """ Collect all names referenced (rather than declared) in code and its children
+
+    :param code: List of code lines
+    :param used: Set to accumulate into
+    :returns: Referenced names
+    :rtype: set
+    """
+    if used is None:
+        used = set()
+    for line in code:
+        if isinstance(line, (Comment, Dealloc)):
+            continue
+        if isinstance(line, CBlock):
+            harvest(list(line.block), used)
+        elif isinstance(line, Gate):
+            harvest(getattr(line, "byprod", None), used)
+            # Arguments shadow outer names within the gate body
+            args = {arg.name for arg in (*line.pargs, *line.spargs, *line.qargs)}
+            used |= _used_names(line.code) - args
+            continue
+        elif isinstance(line, Let):
+            harvest(line.const.val, used)
+        elif isinstance(line, Register):
+            harvest(line.size, used)
+        elif isinstance(line, SetAlias):
+            harvest(line.qargs, used)
+            harvest(line.pargs[1], used)
+        elif isinstance(line, Include):
+            _used_names(line.raw_code, used)
+        else:
+            for attr in ("pargs", "qargs", "spargs", "cond", "start", "end", "step", "variable", "value", "byprod"):
+                harvest(getattr(line, attr, None), used)
+            if getattr(line, "loops", None):
+                harvest([line.loops.start, line.loops.end], used)
+
+        if isinstance(getattr(line, "code", None), list):
+            _used_names(line.code, used)
+    return used
+
+def _eliminate_unused(block, used, report):
+    """ Remove declarations from block (and children) which are not referenced
+
+    :param block: Block containing code
+    :param used: Set of names referenced anywhere in the program
+    :param report: FoldReport to update
+    :returns: Whether anything was removed
+    :rtype: bool
+    """
+    removed = set()
+    newCode = []
+    for line in block.code:
+        if isinstance(line, Let) and line.const.name not in used:
+            report.removed["constants"].append(line.const.name)
+            continue
+        if isinstance(line, Alias) and line.name not in used:
+            report.removed["aliases"].append(line.name)
+            removed.add(line.name)
+            continue
+        if isinstance(line, ClassicalRegister) and line.name not in used:
+            report.removed["registers"].append(line.name)
+            removed.add(line.name)
+            continue
+        newCode.append(line)
+
+    changed = len(newCode) != len(block.code)
+    # Remove operations on deleted objects
+    block._code = [line for line in newCode
+                   if not (isinstance(line, SetAlias) and line.alias.name in removed)
+                   and not (isinstance(line, Dealloc) and line.pargs in removed)]
+
+    for line in block.code:
+        if isinstance(getattr(line, "code", None), list):
+            changed = _eliminate_unused(line, used, report) or changed
+    return changed
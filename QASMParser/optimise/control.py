@@ -0,0 +1,79 @@
+"""
+Module to apply controlled gates with constant parameters as a single multi-controlled unitary rather than
+through the recursively generated _ctrl_ gates
+"""
+from ..parser.types import (CallGate, InlineAlias, ApplyMatrix)
+from .unitary import (NotUnitary, gate_unitary)
+from .stream import (count_calls, transform_runs)
+from .precompute import (LiteralTable, constant_params, expand_qargs)
+
+# Largest number of target qubits for which the unitary of the controlled body is computed
+MAX_TARGET_QUBITS = 4
+
+class ControlReport:
+    """ Record of the controlled gate calls replaced by multi-controlled unitaries """
+    def __init__(self):
+        self.calls = 0
+        self.literals = 0
+        self.remaining = 0
+
+    def __str__(self):
+        return (f"Native control: {self.calls} controlled gate calls replaced by multi-controlled unitaries "
+                f"({self.literals} new matrices), {self.remaining} gate calls remain")
+
+def native_controls(codeObj, maxQubits=MAX_TARGET_QUBITS):
+    """ Replace calls to controlled gates with constant parameters by one multi-controlled unitary each in place
+
+    :param codeObj: ProgFile to optimise
+    :param maxQubits: Largest number of target qubits to compute the unitary for
+    :returns: Report of the changes made
+    :rtype: ControlReport
+    """
+    report = ControlReport()
+    literals = LiteralTable(codeObj)
+    transform = lambda scope, run, runtime, exact: [_native_control(scope, line, runtime, maxQubits, literals, report)
+                                                    for line in run]
+    codeObj._code = transform_runs(codeObj, codeObj.code, set(), True, transform)
+    literals.finalise()
+    report.literals = literals.new
+    report.remaining = count_calls(codeObj.code) - report.calls
+    return report
+
+def _native_control(scope, line, runtime, maxQubits, literals, report):
+    """ Replace a call to a controlled gate by a multi-controlled application of the unitary of its body
+
+    :param scope: Block in which the code is resolved
+    :param line: Line of a straight-line run
+    :param runtime: Names which are only known at run time
+    :param maxQubits: Largest number of target qubits to compute the unitary for
+    :param literals: LiteralTable in which to declare matrices
+    :param report: ControlReport to update
+    :returns: Line to use in place of line
+    """
+    if not isinstance(line, CallGate) or line.gargs or line.loops or line.callee.controlOf is None:
+        return line
+    ctrlArg, *qargs = line.qargs
+    if not isinstance(ctrlArg[0], InlineAlias):
+        return line
+
+    params = constant_params(scope, line, runtime)
+    controls = expand_qargs(scope, ctrlArg[0].targets, runtime)
+    targets = expand_qargs(scope, qargs, runtime)
+    if params is None or controls is None or targets is None:
+        return line
+    pargs, (nControls, *spargs) = params
+    spargs = tuple(spargs)
+    if len(controls) != nControls:
+        return line
+
+    base = line.callee.controlOf
+    try:
+        matrix = gate_unitary(base, pargs, spargs, maxQubits)
+    except NotUnitary:
+        return line
+    if len(matrix) != 2**len(targets):
+        return line
+
+    report.calls += 1
+    literal = literals.declare((base, pargs, spargs), base.name, matrix)
+    return ApplyMatrix(line.parent, matrix, targets, literal, controls)
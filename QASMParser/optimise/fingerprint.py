@@ -0,0 +1,225 @@
+"""
+Module to compute a canonical fingerprint of a program, independent of naming, comments and formatting
+"""
+import hashlib
+import re
+import numpy as np
+from ..parser.types import (Gate, Opaque, CallGate, Comment, Include, Loop, IfBlock, While, Register, Constant,
+                            MathsBlock, Bitstring, CBlock, Let, InitEnv, ApplyMatrix, MatrixLiteral)
+from .constfold import (evaluate, NotConstant)
+
+# Significant figures kept of real parameters, so that equal values computed differently hash alike
+PRECISION = 12
+
+class Fingerprinter:
+    """ Streaming canonical hash of the code of a program
+
+    Every name declared (registers, aliases, constants, loop variables and gate arguments) is replaced by its
+    order of declaration in its scope, and every parameter known at compile time by its value. A gate call is
+    hashed through the fingerprint of the body of the gate called, computed the first time it is called, so that
+    the names of gates and the definitions never called make no difference. Core and opaque gates are kept by name.
+
+    If canonical is False, names, comments, numbers and expressions are instead kept as written (with the values of
+    constant expressions alongside), as are the signatures of gates and the mappings of registers, so that code
+    which would be written differently hashes differently.
+
+    :param codeObj: ProgFile whose code is hashed
+    :param canonical: Whether to hash the canonical form of the code
+    """
+    def __init__(self, codeObj, canonical=True):
+        self.codeObj = codeObj
+        self.canonical = canonical
+        self._gates = {}
+        self._stack = []
+
+    def digest(self):
+        """ Fingerprint of the program
+
+        :returns: Hexadecimal SHA-256 digest
+        :rtype: str
+        """
+        hasher = hashlib.sha256()
+        self.hash_code(hasher, self.codeObj, self.codeObj.code, {}, set())
+        return hasher.hexdigest()
+
+    def hash_code(self, hasher, scope, code, names, runtime):
+        """ Feed the canonical form of every line of code (and child blocks) to hasher
+
+        :param hasher: hashlib object to update
+        :param scope: Block in which the code is resolved
+        :param code: List of code lines
+        :param names: Canonical name of each name declared, updated as declarations are met
+        :param runtime: Names which are only known at run time
+        """
+        for line in code:
+            if isinstance(line, Comment) and not self.canonical:
+                self.update(hasher, ("Comment", line.comment))
+                continue
+            if isinstance(line, (Comment, InitEnv)) or isinstance(line, Gate):
+                # Gates are hashed when they are called
+                continue
+            if isinstance(line, Include):
+                self.hash_code(hasher, scope, line.raw_code, names, runtime)
+                continue
+
+            if isinstance(line, Let):
+                self.declare(names, line.const.name)
+            elif isinstance(line, Register) and line.name is not None:
+                self.declare(names, line.name)
+
+            lineRuntime = runtime
+            if getattr(line, "loops", None):
+                for var in line.loops.var:
+                    self.declare(names, var)
+                lineRuntime = runtime | set(line.loops.var)
+                self.update(hasher, ("loops", self.loop(scope, line.loops, names, lineRuntime)))
+            if isinstance(line, Loop):
+                for var in line.var:
+                    self.declare(names, var)
+                lineRuntime = runtime | set(line.var)
+
+            self.update(hasher, self.token(scope, line, names, lineRuntime))
+            if isinstance(line, (Loop, IfBlock, While)):
+                self.hash_code(hasher, line, line.code, names, lineRuntime)
+                self.update(hasher, ("end",))
+
+    def token(self, scope, line, names, runtime):
+        """ Canonical form of a single line """
+        value = lambda elem: self.value(scope, elem, names, runtime)
+        token = [type(line).__name__]
+        if isinstance(line, Loop):
+            token.append(self.loop(scope, line, names, runtime))
+        elif isinstance(line, (IfBlock, While)):
+            token.append(value(line.cond))
+        elif isinstance(line, CBlock):
+            token.append(" ".join(" ".join(line.block).split()) if self.canonical else "\n".join(line.block))
+        elif isinstance(line, Let):
+            token += [names[line.const.name], value(line.const.val)]
+        elif isinstance(line, Register):
+            token.append(value(line.size))
+            if not self.canonical:
+                token.append(tuple(getattr(line, "mapping", None) or ()))
+        elif isinstance(line, (ApplyMatrix, MatrixLiteral)):
+            token.append(self.matrix(line.matrix))
+            # The literal is referred to by name in the translation
+            literal = line if isinstance(line, MatrixLiteral) else line.literal
+            if not self.canonical and literal is not None:
+                token.append(literal.name)
+        if isinstance(line, CallGate):
+            token.append(self.gate(line.callee))
+            token.append(value(line.byprod))
+        for attr in ("qargs", "controls", "pargs", "spargs", "gargs", "variable", "value"):
+            token.append(value(getattr(line, attr, None)))
+        if not self.canonical and hasattr(line, "inlineComment"):
+            token.append(line.inlineComment.comment)
+        return tuple(token)
+
+    def loop(self, scope, loop, names, runtime):
+        """ Canonical form of the variables and bounds of a loop """
+        value = lambda elem: self.value(scope, elem, names, runtime)
+        return tuple((names[var], value(start), value(end), value(step))
+                     for var, start, end, step in zip(loop.var, loop.start, loop.end, loop.step))
+
+    def gate(self, gate):
+        """ Canonical form of a gate: its name if it is core or opaque, else the fingerprint of its body """
+        if isinstance(gate, Opaque) or gate.name in Gate.internalGates:
+            return ("gate", gate.name)
+        if gate in self._stack:
+            # Recursive call, identified by how many gates up the stack it calls
+            return ("recurse", len(self._stack) - self._stack.index(gate))
+        if id(gate) not in self._gates:
+            self._stack.append(gate)
+            hasher = hashlib.sha256()
+            names = {}
+            args = [getattr(arg, "name", arg) for arg in (*gate.qargs, *gate.pargs, *gate.spargs, *gate.gargs)]
+            for arg in args:
+                self.declare(names, arg)
+            runtime = set(args)
+            self.update(hasher, ("args", len(gate.qargs), len(gate.pargs), len(gate.spargs), len(gate.gargs),
+                                 tuple(self.value(gate, arg.size, names, runtime) for arg in gate.qargs)))
+            if not self.canonical:
+                self.update(hasher, ("signature", type(gate).__name__, gate.name, tuple(args),
+                                     tuple(getattr(arg, "varType", None) for arg in gate.pargs),
+                                     getattr(gate, "returnType", None), tuple(sorted(gate.reboundArgs))))
+            self.hash_code(hasher, gate, gate.code, names, runtime)
+            self._stack.pop()
+            self._gates[id(gate)] = hasher.hexdigest()
+        return ("gate", self._gates[id(gate)])
+
+    def value(self, scope, elem, names, runtime):
+        """ Canonical form of an argument, index, size or expression """
+        if elem is None or isinstance(elem, bool):
+            return elem
+        if isinstance(elem, (int, float)):
+            return _number(elem) if self.canonical else elem
+        if isinstance(elem, Bitstring):
+            return "".join(elem.val) + "b"
+        if isinstance(elem, Gate):
+            return self.gate(elem)
+        if isinstance(elem, (Constant, MathsBlock)):
+            try:
+                number = _number(evaluate(scope, elem, runtime))
+            except NotConstant:
+                number = None
+            if self.canonical and number is not None:
+                return number
+            if isinstance(elem, Constant):
+                text = names.get(elem.name, elem.name)
+            else:
+                text = _rename(elem.dump(), names)
+            return text if number is None else (text, number)
+        if isinstance(elem, Register):
+            if elem.name is None:
+                return type(elem).__name__
+            return names.get(elem.name, elem.name)
+        if isinstance(elem, (list, tuple)):
+            return tuple(self.value(scope, item, names, runtime) for item in elem)
+        if isinstance(elem, str):
+            if not self.canonical:
+                return elem
+            try:
+                return _number(float(elem))
+            except ValueError:
+                return _rename(elem, names)
+        return type(elem).__name__
+
+    def matrix(self, matrix):
+        """ Canonical form of a precomputed unitary: its rounded elements, or the digest of its exact bytes """
+        matrix = np.ascontiguousarray(matrix)
+        if self.canonical:
+            return tuple(_number(part) for elem in matrix.flat for part in (elem.real, elem.imag))
+        return hashlib.sha256(matrix.tobytes()).hexdigest()
+
+    def declare(self, names, name):
+        """ Give name the next canonical name of its scope, or itself if the hash is not canonical """
+        if name not in names:
+            names[name] = f"_{len(names)}" if self.canonical else name
+
+    @staticmethod
+    def update(hasher, token):
+        """ Feed a token to hasher """
+        hasher.update(repr(token).encode())
+        hasher.update(b"\n")
+
+def fingerprint(codeObj):
+    """ Canonical fingerprint of a program for use as a cache key
+
+    Two programs have the same fingerprint if they apply the same gates, with the same parameters, to registers of
+    the same sizes declared in the same order, whatever the names of their registers, constants and gates, their
+    comments and their formatting. It is computed in a single pass over the code (and the body of each gate called).
+
+    :param codeObj: ProgFile to fingerprint
+    :returns: Hexadecimal SHA-256 digest
+    :rtype: str
+    """
+    return Fingerprinter(codeObj).digest()
+
+def _number(value):
+    """ Canonical form of a number """
+    value = float(format(value, f".{PRECISION}g"))
+    return int(value) if value.is_integer() else value
+
+def _rename(text, names):
+    """ Replace declared names in text by their canonical names and normalise whitespace """
+    text = re.sub(r"[A-Za-z_]\w*", lambda match: names.get(match.group(0), match.group(0)), text)
+    return " ".join(text.split())
@@ -0,0 +1,133 @@
+"""
+Module to fuse runs of gates acting on a small number of qubits into single dense unitaries
+"""
+import numpy as np
+from ..parser.types import (Comment, ApplyMatrix)
+from .unitary import (apply)
+from .stream import (count_calls, transform_runs, resolve_call, keys_overlap)
+
+class FusionReport:
+    """ Record of the gates fused by a fusion pass """
+    def __init__(self, maxQubits):
+        self.maxQubits = maxQubits
+        self.before = 0
+        self.after = 0
+        self.fused = 0
+        self.unitaries = 0
+
+    def __str__(self):
+        return (f"Fusion (k={self.maxQubits}): {self.fused} gates fused into {self.unitaries} unitaries, "
+                f"{self.before} gate applications reduced to {self.after}")
+
+class _Group:
+    """ Set of operations fused into a single unitary
+
+    :param qubits: Keys of the qubits acted on, the first is the least significant
+    :param targets: [register, index] pairs matching qubits
+    :param matrix: Unitary of the members applied in order
+    :param members: Operations fused
+    """
+    def __init__(self, qubits, targets, matrix, members):
+        self.qubits = qubits
+        self.targets = targets
+        self.matrix = matrix
+        self.members = members
+
+    @classmethod
+    def combine(cls, groups, operation):
+        """ Fuse the disjoint open groups with operation applied after them """
+        qubits, targets = [], []
+        for group in groups:
+            qubits += group.qubits
+            targets += group.targets
+        for qubit, target in zip(operation.qubits, operation.targets):
+            if qubit not in qubits:
+                qubits.append(qubit)
+                targets.append(target)
+
+        nQubits = len(qubits)
+        matrix = np.eye(2**nQubits, dtype=complex)
+        members = []
+        for group in groups:
+            matrix = apply(matrix, group.matrix, [qubits.index(qubit) for qubit in group.qubits], nQubits)
+            members += group.members
+        matrix = apply(matrix, operation.matrix, [qubits.index(qubit) for qubit in operation.qubits], nQubits)
+        return cls(qubits, targets, matrix, members + [operation])
+
+def fuse_gates(codeObj, maxQubits=2):
+    """ Fuse runs of gates acting on at most maxQubits qubits into single unitaries in place
+
+    :param codeObj: ProgFile to optimise
+    :param maxQubits: Largest number of qubits in a fused unitary
+    :returns: Report of the changes made
+    :rtype: FusionReport
+    """
+    report = FusionReport(maxQubits)
+    report.before = count_calls(codeObj.code)
+    transform = lambda scope, run, runtime, exact: _fuse_run(scope, run, runtime, maxQubits, report)
+    codeObj._code = transform_runs(codeObj, codeObj.code, set(), False, transform)
+    report.after = count_calls(codeObj.code)
+    return report
+
+def _fuse_run(scope, run, runtime, maxQubits, report):
+    """ Greedily fuse a straight-line run of gate calls
+
+    Each qubit has at most one open group; a gate joins (and merges) the open groups on its qubits while the
+    result stays within maxQubits, otherwise those groups are closed and it starts a new one.
+
+    :param scope: Block in which the code is resolved
+    :param run: List of gate calls and comments
+    :param runtime: Names which are only known at run time
+    :param maxQubits: Largest number of qubits in a fused unitary
+    :param report: FusionReport to update
+    :returns: Fused run
+    :rtype: list
+    """
+    newCode = list(run)
+    groups = []
+    current = {}
+
+    def close(group):
+        for qubit in group.qubits:
+            if current.get(qubit) is group:
+                del current[qubit]
+
+    for position, line in enumerate(run):
+        if isinstance(line, Comment):
+            continue
+        operation = resolve_call(scope, line, runtime, maxQubits)
+        operation.position = position
+
+        if (operation.matrix is None or not operation.concrete or operation.targets is None
+                or len(set(operation.qubits)) != len(operation.qubits)):
+            for group in {id(group): group for group in current.values()}.values():
+                if keys_overlap(group.qubits, operation.qubits):
+                    close(group)
+            continue
+
+        touching = list({id(current[qubit]): current[qubit]
+                         for qubit in operation.qubits if qubit in current}.values())
+        nQubits = len({qubit for group in touching for qubit in group.qubits} | set(operation.qubits))
+        if nQubits > maxQubits:
+            for group in touching:
+                close(group)
+            touching = []
+
+        group = _Group.combine(touching, operation)
+        for old in touching:
+            groups.remove(old)
+        groups.append(group)
+        for qubit in group.qubits:
+            current[qubit] = group
+
+    for group in groups:
+        if len(group.members) < 2:
+            continue
+        report.fused += len(group.members)
+        report.unitaries += 1
+        last = group.members[-1]
+        for member in group.members[:-1]:
+            newCode[member.position] = None
+        newCode[last.position] = ApplyMatrix(last.line.parent, group.matrix, group.targets)
+
+    return [line for line in newCode if line is not None]
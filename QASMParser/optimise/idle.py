@@ -0,0 +1,74 @@
+"""
+Module to remove qubits which are never used from the simulated state along with gates which cannot be observed
+"""
+import numpy as np
+from ..parser.types import (QuantumRegister)
+from .lightcone import (prune_light_cone, classify_line)
+from .reuse import (called_ancillas, defined_ancillas)
+
+class IdleReport:
+    """ Record of the gates and qubits removed by idle qubit pruning """
+    def __init__(self):
+        self.lightCone = None
+        self.before = 0
+        self.after = 0
+        self.idle = []
+
+    def __str__(self):
+        removed = f" ({', '.join(self.idle)})" if self.idle else ""
+        # After the light-cone pass nothing is left to prune, and its report has already been given
+        lightCone = f"{self.lightCone}\n" if self.lightCone.pruned else ""
+        return (f"{lightCone}"
+                f"Idle qubits: {len(self.idle)} never used qubits removed{removed}, "
+                f"state reduced from {self.before} to {self.after} qubits")
+
+def prune_idle_qubits(codeObj):
+    """ Drop gates after the last observable use of their qubits and remove never used qubits in place
+
+    Gates are pruned by the light cone of the measurements, which is only reported if this pruned any (it prunes
+    nothing after the light-cone pass). The remaining lines of the main program (and the circuit-local registers of
+    any circuit they may call) determine which physical indices are used; those are renumbered contiguously in order
+    and the size of the QuEST register shrinks to match. Qubits which are never used are mapped to index 0 as
+    nothing refers to them.
+
+    :param codeObj: ProgFile to optimise
+    :returns: Report of the changes made
+    :rtype: IdleReport
+    """
+    report = IdleReport()
+    report.lightCone = prune_light_cone(codeObj)
+    report.before = QuantumRegister.numPhysicalQubits
+    if report.before is None:
+        report.before = QuantumRegister.numQubits + QuantumRegister.numGateQubits
+
+    registers = {reg.name: reg for reg in codeObj.quantumRegisters}
+    nQubits = sum(reg.size for reg in registers.values())
+    touched = np.zeros(nQubits, dtype=bool)
+    ancillas = []
+    for line in codeObj.code:
+        kind, mask = classify_line(codeObj, line, registers, nQubits)
+        if kind != "classical":
+            touched |= mask
+        ancillas += [reg for reg in called_ancillas(line, set()) if reg not in ancillas]
+
+    used = set()
+    for reg in registers.values():
+        for index in range(reg.size):
+            if touched[reg.start + index]:
+                used.add(reg.mapping[index])
+    for reg in ancillas:
+        used.update(reg.mapping)
+    report.after = len(used)
+    if not used or report.after == report.before:
+        report.after = report.before
+        return report
+
+    remap = {old: new for new, old in enumerate(sorted(used))}
+    for reg in registers.values():
+        report.idle += [f"{reg.name}[{index}]" for index in range(reg.size) if not touched[reg.start + index]]
+        reg.mapping = tuple(remap[old] if touched[reg.start + index] else 0 for index, old in enumerate(reg.mapping))
+    for reg in defined_ancillas(codeObj.code):
+        reg.mapping = tuple(remap[old] for old in reg.mapping) if reg in ancillas else (0,)*reg.size
+
+    QuantumRegister.numPhysicalQubits = report.after
+    return report
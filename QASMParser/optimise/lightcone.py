@@ -0,0 +1,109 @@
+"""
+Module to prune gates which lie outside the past light cone of every measurement and so cannot affect any output
+"""
+import numpy as np
+from ..parser.types import (Gate, CallGate, Comment, Include, Let, Set, Dealloc, Register, SetAlias, Measure, Reset,
+                            Output, Return, ApplyMatrix, MatrixLiteral)
+from .stream import (count_calls, resolve_call, qubit_keys)
+
+class LightConeReport:
+    """ Record of the gates pruned by a light-cone pass """
+    def __init__(self):
+        self.measurements = 0
+        self.resets = 0
+        self.before = 0
+        self.after = 0
+        self.pruned = 0
+        self.untouched = []
+
+    def __str__(self):
+        if not self.measurements:
+            return "Light cone: no measurements, the full state is the output so nothing was pruned"
+        return (f"Light cone: {self.pruned} gate calls pruned outside the light cone of {self.measurements} "
+                f"measurements and {self.resets} resets, "
+                f"{self.before} gate calls reduced to {self.after}, "
+                f"{len(self.untouched)} qubits untouched ({', '.join(self.untouched)})")
+
+def prune_light_cone(codeObj):
+    """ Remove top-level gate calls which cannot affect any measurement in place
+
+    Walks the program backwards keeping a bitset of the qubits whose state may still be observed. Measurements and
+    resets (and anything which is not a plain gate call, such as loops and conditionals) make their qubits live; a
+    gate touching a live qubit is kept and makes all of its qubits live, any other gate is pruned. Programs without
+    measurements are left alone.
+
+    :param codeObj: ProgFile to optimise
+    :returns: Report of the changes made
+    :rtype: LightConeReport
+    """
+    report = LightConeReport()
+    report.before = count_calls(codeObj.code)
+    registers = {reg.name: reg for reg in codeObj.quantumRegisters}
+    nQubits = sum(reg.size for reg in registers.values())
+
+    masks = [classify_line(codeObj, line, registers, nQubits) for line in codeObj.code]
+    report.measurements = sum(1 for line in codeObj.code if isinstance(line, Measure))
+    report.resets = sum(1 for line in codeObj.code if isinstance(line, Reset))
+    # Resets keep their qubits live like measurements, but without a measurement the full state is the output
+    if not report.measurements:
+        report.after = report.before
+        return report
+
+    live = np.zeros(nQubits, dtype=bool)
+    keep = np.ones(len(masks), dtype=bool)
+    for position in reversed(range(len(masks))):
+        kind, mask = masks[position]
+        if kind in ("measure", "barrier"):
+            live |= mask
+        elif kind == "gate":
+            if (live & mask).any():
+                live |= mask
+            else:
+                keep[position] = False
+                report.pruned += 1
+
+    codeObj._code = [line for line, kept in zip(codeObj.code, keep) if kept]
+    report.after = count_calls(codeObj.code)
+
+    touched = np.zeros(nQubits, dtype=bool)
+    for (kind, mask), kept in zip(masks, keep):
+        if kept and kind != "classical":
+            touched |= mask
+    report.untouched = [f"{reg.name}[{index}]" for reg in registers.values() for index in range(reg.size)
+                        if not touched[reg.start + index]]
+    return report
+
+def classify_line(codeObj, line, registers, nQubits):
+    """ Classify a line of the main program by its action on the qubits
+
+    :returns: (kind, mask) where kind is "gate", "measure", "barrier" or "classical" and mask is the bitset of
+              qubits it may act on
+    :rtype: tuple
+    """
+    if isinstance(line, Include) and all(isinstance(child, (Comment, Gate)) for child in line.raw_code):
+        return "classical", np.zeros(nQubits, dtype=bool)
+    if isinstance(line, (Comment, Gate, Let, Set, Dealloc, Register, SetAlias, Output, Return, MatrixLiteral)):
+        return "classical", np.zeros(nQubits, dtype=bool)
+    if isinstance(line, (Measure, Reset)):
+        reg, index = line.qargs
+        keys, _ = qubit_keys(codeObj, reg, index if index is not None else (0, reg.size-1), set())
+        return "measure", qubit_mask(keys, registers, nQubits)
+    if isinstance(line, ApplyMatrix) or isinstance(line, CallGate) and not line.byprod and line.callee.unitary:
+        operation = resolve_call(codeObj, line, set(), maxQubits=0)
+        return "gate", qubit_mask(operation.qubits, registers, nQubits)
+    # Anything else (loops, conditionals, circuits returning values, classical blocks) may observe any qubit
+    return "barrier", np.ones(nQubits, dtype=bool)
+
+def qubit_mask(keys, registers, nQubits):
+    """ Bitset of the qubits referred to by keys, wildcards and unknown registers refer to all qubits """
+    mask = np.zeros(nQubits, dtype=bool)
+    for key in keys:
+        if key is None or key[0] not in registers:
+            mask[:] = True
+            continue
+        reg = registers[key[0]]
+        if key[1] == "*":
+            mask[reg.start:reg.start + reg.size] = True
+        else:
+            mask[reg.start + key[1]] = True
+    return mask
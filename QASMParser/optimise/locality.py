@@ -0,0 +1,106 @@
+"""
+Module to order the qubits of the simulated state so that those used most stay local to a node when distributed
+"""
+import math
+from ..parser.types import (QuantumRegister, Measure)
+from ..codegraph.codegraph import (CodeGraph)
+from .reuse import (defined_ancillas)
+
+# Bytes in one complex amplitude of a double precision QuEST state
+AMPLITUDE_BYTES = 16
+
+class LocalityReport:
+    """ Record of the communication expected before and after ordering the qubits """
+    def __init__(self, nRanks):
+        self.nRanks = nRanks
+        self.nQubits = 0
+        self.nGlobal = 0
+        self.gates = 0
+        self.before = 0
+        self.after = 0
+        self.moved = []
+        self.reason = None
+
+    volumeBefore = property(lambda self: self.before * 2**self.nQubits)
+    volumeAfter = property(lambda self: self.after * 2**self.nQubits)
+
+    def __str__(self):
+        volume = lambda amps: f"{amps} amplitudes ({amps*AMPLITUDE_BYTES/2**20:.3g} MiB)"
+        if self.reason is not None:
+            return f"Locality: {self.reason}, qubit order unchanged"
+        moved = f" ({', '.join(self.moved)})" if self.moved else ""
+        return (f"Locality: {self.nQubits} qubits over {self.nRanks} ranks, {self.nGlobal} global, "
+                f"{len(self.moved)} qubits moved{moved}\n"
+                f"Estimated communication: {self.before} of {self.gates} gates on global qubits exchanging "
+                f"{volume(self.volumeBefore)} before, {self.after} exchanging {volume(self.volumeAfter)} after")
+
+def order_qubits(codeObj, nRanks):
+    """ Renumber the physical qubits in place so that those used least are the global (highest) ones
+
+    QuEST splits the state over nRanks nodes by its highest log2(nRanks) qubits; a gate acting on one of these
+    exchanges the whole state between pairs of nodes. Every qubit is scored by the number of gates acting on it
+    plus the number of interactions it takes part in (the weights of the entanglement graph), and physical
+    indices are assigned in order of decreasing score, ties going to the qubit used first. The communication is
+    estimated by counting the gates which act on a global qubit, in time order, under the old and new orders. The
+    order is left unchanged if there are fewer qubits than global ones.
+
+    :param codeObj: ProgFile to optimise
+    :param nRanks: Number of ranks the state is distributed over, a power of two
+    :returns: Report of the changes made
+    :rtype: LocalityReport
+    """
+    report = LocalityReport(nRanks)
+    report.nQubits = QuantumRegister.numPhysicalQubits
+    if report.nQubits is None:
+        report.nQubits = QuantumRegister.numQubits + QuantumRegister.numGateQubits
+    report.nGlobal = int(math.log2(nRanks))
+    if report.nGlobal > report.nQubits:
+        report.reason = f"cannot distribute {report.nQubits} qubits over {nRanks} ranks"
+        return report
+
+    registers = [*codeObj.quantumRegisters, *defined_ancillas(codeObj.code)]
+    nLogical = QuantumRegister.numQubits + QuantumRegister.numGateQubits
+    graph = CodeGraph(codeObj, nLogical)
+
+    # Circuit-local registers of different circuits may share logical indices
+    physical = [set() for _ in range(nLogical)]
+    for reg in registers:
+        for index, target in enumerate(reg.mapping):
+            physical[reg.start + index].add(target)
+
+    score = [0]*report.nQubits
+    firstUse = [math.inf]*report.nQubits
+    degree = dict(graph.entang.degree(weight="weight"))
+    for logical in graph.entang.nodes:
+        # Node weights count from one for the initial state
+        uses = graph.entang.nodes[logical]["weight"] - 1 + degree[logical]
+        for target in physical[logical]:
+            score[target] += uses
+
+    operations = []
+    for time, verts in enumerate(graph._opVerts):
+        targets = {target for vert in verts for target in physical[vert.qubitID]}
+        for target in targets:
+            firstUse[target] = min(firstUse[target], time)
+        # Measurement only reduces a probability over the nodes
+        if not any(isinstance(vert.op, Measure) for vert in verts):
+            operations.append(targets)
+    report.gates = len(operations)
+
+    order = sorted(range(report.nQubits), key=lambda target: (-score[target], firstUse[target], target))
+    remap = {old: new for new, old in enumerate(order)}
+    report.before = _communicating(operations, {target: target for target in remap}, report)
+    report.after = _communicating(operations, remap, report)
+    if report.after >= report.before:
+        report.after = report.before
+        return report
+
+    for reg in registers:
+        report.moved += [f"{reg.name}[{index}]" for index, old in enumerate(reg.mapping) if remap[old] != old]
+        reg.mapping = tuple(remap[old] for old in reg.mapping)
+    return report
+
+def _communicating(operations, remap, report):
+    """ Count the operations acting on a global qubit once renumbered by remap """
+    local = report.nQubits - report.nGlobal
+    return sum(1 for targets in operations if any(remap[target] >= local for target in targets))
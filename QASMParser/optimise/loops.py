@@ -0,0 +1,475 @@
+"""
+Module to hoist loop-invariant maths out of loops and replace affine indices by induction variables
+"""
+import re
+from ..parser.tokens import (Binary, Function)
+from ..parser.types import (MathsBlock, Constant, Register, Gate, Opaque, Include, Let, Loop, NestLoop, IfBlock,
+                            While)
+from .constfold import (evaluate, harvest, NotConstant)
+
+class LoopReport:
+    """ Record of the maths hoisted out of loops and the induction variables introduced """
+    def __init__(self):
+        self.loops = 0
+        self.hoisted = 0
+        self.induction = 0
+        self.offsets = 0
+
+    def __str__(self):
+        return (f"Loop optimisation: {self.hoisted} invariant expressions hoisted out of {self.loops} loops, "
+                f"{self.induction} affine indices replaced by induction variables, "
+                f"{self.offsets} implicit loop offsets replaced by induction variables")
+
+def optimise_loops(codeObj):
+    """ Hoist loop-invariant maths into temporaries and strength-reduce affine indices in place
+
+    For each loop (outermost first) every sub-expression of its bounds and body which depends on nothing assigned
+    within it is computed once into a ``Let`` before the loop. Indices, special arguments and integer temporaries
+    of the body which are then of the form ``c*i + d`` in the loop variable ``i`` (``c`` an integer, ``d``
+    invariant) become extra variables of the loop header, stepped by ``c`` times the step of the loop. Offsets of
+    implicit loops (``_a_loop + k``) are replaced in the same way.
+
+    :param codeObj: ProgFile to optimise
+    :returns: Report of the changes made
+    :rtype: LoopReport
+    """
+    report = LoopReport()
+    _Optimiser(report).code(codeObj, codeObj.code)
+    return report
+
+def _block(parent, elem):
+    """ Wrap elem in a maths block without reparsing it """
+    block = MathsBlock(parent, 0)
+    block.maths = [elem]
+    return block
+
+def _trivial(elem):
+    """ Check whether elem is a bare name or number which gains nothing from hoisting """
+    if isinstance(elem, MathsBlock):
+        return len(elem.maths) == 1 and _trivial(elem.maths[0])
+    return isinstance(elem, (int, float, str, Constant))
+
+def _divides(elem):
+    """ Check whether elem divides, and so may fail if evaluated where it would not have been """
+    if isinstance(elem, MathsBlock):
+        return any(_divides(point) for point in elem.maths)
+    if isinstance(elem, Binary):
+        return any(operator in ("/", "%", "div", "mod") or _divides(operand) for operator, operand in elem.args)
+    if isinstance(elem, Function):
+        return any(_divides(arg) for arg in elem.args)
+    return False
+
+def _runs(start, end, step):
+    """ Check whether an inclusive loop from start to end runs at least once """
+    return start <= end if step > 0 else start >= end
+
+def _name(elem):
+    """ Name of a variable reference, None for anything else """
+    if isinstance(elem, MathsBlock) and len(elem.maths) == 1:
+        return _name(elem.maths[0])
+    if isinstance(elem, Constant):
+        return elem.name
+    if isinstance(elem, str) and re.fullmatch(r"[A-Za-z_]\w*", elem):
+        return elem
+    return None
+
+def _text(elem):
+    """ Language-neutral text of a trivial element """
+    if isinstance(elem, MathsBlock):
+        return _text(elem.maths[0])
+    if isinstance(elem, Constant):
+        return elem.name
+    return str(elem)
+
+def _linear(coeff, var, terms):
+    """ coeff*var + sum(mult*term for mult, term in terms), folded to an int where possible
+
+    :param coeff: Integer coefficient of var
+    :param var: Trivial element
+    :param terms: List of (integer multiplier, trivial element)
+    :returns: Value as an int or a maths string
+    :rtype: int/str
+    """
+    number = 0
+    parts = []
+    for mult, elem in [(coeff, var), *terms]:
+        if mult == 0:
+            continue
+        if isinstance(elem, int) and not isinstance(elem, bool):
+            number += mult*elem
+            continue
+        text = _text(elem)
+        if not re.fullmatch(r"[\w.]+", text):
+            text = f"({text})"
+        if abs(mult) != 1:
+            text = f"{abs(mult)} * {text}"
+        parts.append(("-" if mult < 0 else "+", text))
+    if not parts:
+        return number
+    outStr = parts[0][1] if parts[0][0] == "+" else f"-{parts[0][1]}"
+    for sign, text in parts[1:]:
+        outStr += f" {sign} {text}"
+    if number:
+        outStr += f" {'-' if number < 0 else '+'} {abs(number)}"
+    return outStr
+
+class _Optimiser:
+    """ Walk a program optimising every loop
+
+    :param report: LoopReport to update
+    """
+    def __init__(self, report):
+        self.report = report
+        self.nTemps = 0
+
+    def code(self, scope, code):
+        """ Optimise the loops in a list of lines, returning the new list """
+        newCode = []
+        for line in code:
+            if isinstance(line, Gate) and not isinstance(line, Opaque):
+                line._code = self.code(line, line.code)
+            elif isinstance(line, Include):
+                line._code = self.code(scope, line.raw_code)
+            elif isinstance(line, Loop):
+                self.report.loops += 1
+                newCode += _Hoister(self, scope, line).loop(line)
+                # Reduced first so that affine indices of inner loops become induction variables of this one
+                # rather than temporaries recomputed before each run of the inner loop
+                _Reducer(self, line).reduce_loop()
+                line._code = self.code(line, line.code)
+            elif isinstance(line, (IfBlock, While)):
+                line._code = self.code(line, line.code)
+            elif isinstance(getattr(line, "loops", None), NestLoop):
+                self.report.loops += 1
+                newCode += _Hoister(self, scope, line.loops).nest(line.loops)
+                self.offsets(line)
+            newCode.append(line)
+        return newCode
+
+    def temp(self, scope, elem, varType):
+        """ Declare a temporary holding elem
+
+        :returns: (Let declaring it, Constant referring to it)
+        :rtype: tuple
+        """
+        objs = scope.get_objs("Copy")
+        name = f"_inv{self.nTemps}"
+        while name in objs:
+            self.nTemps += 1
+            name = f"_inv{self.nTemps}"
+        self.nTemps += 1
+        let = Let(scope, (name, varType), (elem, None))
+        return let, let.const
+
+    def offsets(self, line):
+        """ Replace the offsets of an implicit loop by extra loop variables """
+        loop = line.loops
+        if len(loop.var) != 1 or not _trivial(loop.start[0]) or not _trivial(loop.end[0]):
+            return
+        var = loop.var[0]
+        offset = re.compile(rf"{re.escape(var)} \+ (-?\d+)")
+        induction = {}
+
+        def replace(elem, varType):
+            match = offset.fullmatch(elem) if isinstance(elem, str) and varType == "int" else None
+            if match is None:
+                return elem
+            shift = int(match.group(1))
+            if shift == 0:
+                return var
+            if shift not in induction:
+                induction[shift] = f"{var}_{shift}".replace("-", "m")
+                loop.var.append(induction[shift])
+                loop.induction.append(induction[shift])
+                loop.start.append(_linear(1, loop.start[0], [(1, shift)]))
+                loop.end.append(_linear(1, loop.end[0], [(1, shift)]))
+                loop.step.append(loop.step[0])
+                self.report.offsets += 1
+            return induction[shift]
+
+        for_args(line, replace)
+        for_args(line.innermost.code[0], replace)
+
+class _Hoister:
+    """ Move the maths of a loop which does not change while it runs into temporaries before it
+
+    :param optimiser: Owning optimiser
+    :param scope: Block containing the loop
+    :param loop: Loop (or implicit loop) being optimised
+    """
+    def __init__(self, optimiser, scope, loop):
+        self.optimiser = optimiser
+        self.scope = scope
+        self.objs = getattr(loop, "_objs", None) or scope.get_objs("Copy")
+        self.bound = set()
+        # Whether the maths being hoisted might not have run at all, so must not be able to fail
+        self.speculative = False
+        self.lets = []
+        self.temps = {}
+        self._bind(loop)
+
+    def _bind(self, loop):
+        """ Collect the names assigned anywhere within loop """
+        self.bound |= set(loop.var)
+        for line in loop.code:
+            if isinstance(line, Loop):
+                self._bind(line)
+            elif isinstance(line, Let):
+                self.bound.add(line.const.name)
+            elif isinstance(line, (IfBlock, While)):
+                self._bind_block(line)
+            if isinstance(getattr(line, "loops", None), NestLoop):
+                self.bound |= set(line.loops.var)
+
+    def _bind_block(self, block):
+        """ Collect the names assigned within a conditional block """
+        for line in block.code:
+            if isinstance(line, Let):
+                self.bound.add(line.const.name)
+            elif isinstance(line, Loop):
+                self._bind(line)
+            elif isinstance(line, (IfBlock, While)):
+                self._bind_block(line)
+            if isinstance(getattr(line, "loops", None), NestLoop):
+                self.bound |= set(line.loops.var)
+
+    def invariant(self, elem):
+        """ Check whether elem depends only on names which are not assigned within the loop """
+        if isinstance(elem, (list, Register)):
+            return False
+        names = set()
+        harvest(elem, names)
+        return not any(name in self.bound or isinstance(self.objs.get(name, None), Register) for name in names)
+
+    def hoist(self, elem, varType):
+        """ Return elem with its maximal invariant sub-expressions replaced by temporaries
+
+        :param elem: Maths to hoist from
+        :param varType: Type of the value of elem, "int" or "float"
+        """
+        if _trivial(elem) or not isinstance(elem, (MathsBlock, Binary, Function)):
+            return elem
+        if self.invariant(elem) and not (self.speculative and _divides(elem)):
+            key = (varType, self._key(elem))
+            if key not in self.temps:
+                block = elem if isinstance(elem, MathsBlock) else _block(self.scope, elem)
+                let, const = self.optimiser.temp(self.scope, block, varType)
+                self.lets.append(let)
+                self.temps[key] = const
+                self.optimiser.report.hoisted += 1
+            return self.temps[key]
+        if isinstance(elem, MathsBlock):
+            elem.maths = [self.hoist(point, varType) for point in elem.maths]
+        elif isinstance(elem, Function):
+            # Arguments of functions are real valued
+            elem.args = [self.hoist(arg, "float") for arg in elem.args]
+        elif isinstance(elem, Binary):
+            self._hoist_chain(elem, varType)
+        return elem
+
+    def _hoist_chain(self, elem, varType):
+        """ Hoist the operands of a chain of operations, then any run of invariant operands in it """
+        elem.args = [(operator, self.hoist(operand, varType)) for operator, operand in elem.args]
+        operators = [operator for operator, _ in elem.args]
+        if "in" in operators or len(elem.args) < 3:
+            return
+        if varType == "int" and all(operator in ("nop", "+", "-") for operator in operators):
+            # Integer sums may be reordered to bring the invariant terms together
+            invariant = [(operator, operand) for operator, operand in elem.args if self.invariant(operand)]
+            variant = [(operator, operand) for operator, operand in elem.args if not self.invariant(operand)]
+        else:
+            prefix = 0
+            while prefix < len(elem.args) and self.invariant(elem.args[prefix][1]):
+                prefix += 1
+            invariant, variant = elem.args[:prefix], elem.args[prefix:]
+        if len(invariant) < 2 or not variant or invariant[0][0] not in ("nop", "+", "-"):
+            return
+        first, rest = invariant[0], invariant[1:]
+        group = Binary([[]])
+        group.args = ([("nop", first[1])] if first[0] in ("nop", "+") else [("nop", 0), first]) + rest
+        temp = self.hoist(_block(self.scope, group), varType)
+        variant = [("+" if operator == "nop" else operator, operand) for operator, operand in variant]
+        elem.args = [("nop", temp), *variant]
+
+    def _key(self, elem):
+        """ Structural key of elem to share temporaries between identical expressions """
+        if isinstance(elem, MathsBlock):
+            return tuple(self._key(point) for point in elem.maths)
+        if isinstance(elem, Binary):
+            return ("binary",) + tuple((operator, self._key(operand)) for operator, operand in elem.args)
+        if isinstance(elem, Function):
+            return (elem.op,) + tuple(self._key(arg) for arg in elem.args)
+        if isinstance(elem, Constant):
+            return ("name", elem.name)
+        return (type(elem).__name__, str(elem))
+
+    def loop(self, loop):
+        """ Hoist the invariant maths of an explicit loop and everything in it
+
+        :returns: Temporaries to declare before the loop
+        :rtype: list
+        """
+        loop.start = [self.hoist(elem, "int") for elem in loop.start]
+        loop.end = [self.hoist(elem, "int") for elem in loop.end]
+        loop.step = [self.hoist(elem, "int") for elem in loop.step]
+        try:
+            bounds = [evaluate(loop, elem) for elem in (loop.start[0], loop.end[0], loop.step[0])]
+            self.speculative = len(loop.var) != 1 or not _runs(*bounds)
+        except NotConstant:
+            self.speculative = True
+        self.lines(loop.code)
+        return self.lets
+
+    def nest(self, loop):
+        """ Hoist the invariant bounds of an implicit loop
+
+        :returns: Temporaries to declare before the line it wraps
+        :rtype: list
+        """
+        loop.end = [self.hoist(elem, "int") for elem in loop.end]
+        return self.lets
+
+    def lines(self, code):
+        """ Hoist the invariant maths of every line in code """
+        for line in code:
+            if isinstance(line, Loop):
+                line.start = [self.hoist(elem, "int") for elem in line.start]
+                line.end = [self.hoist(elem, "int") for elem in line.end]
+                line.step = [self.hoist(elem, "int") for elem in line.step]
+                self.lines(line.code)
+            elif isinstance(line, (IfBlock, While)):
+                speculative, self.speculative = self.speculative, True
+                self.lines(line.code)
+                self.speculative = speculative
+            elif not isinstance(line, Let):
+                for_args(line, lambda elem, varType: self.hoist(elem, varType))
+                if isinstance(getattr(line, "loops", None), NestLoop):
+                    line.loops.start = [self.hoist(elem, "int") for elem in line.loops.start]
+                    line.loops.end = [self.hoist(elem, "int") for elem in line.loops.end]
+
+def for_args(line, replace):
+    """ Replace the indices and numerical arguments of line in place
+
+    :param line: Line whose arguments are replaced
+    :param replace: Function taking (elem, varType) and returning the new elem
+    """
+    for attr in ("_qargs", "_pargs", "_spargs"):
+        args = getattr(line, attr, None)
+        if not isinstance(args, list) or not args:
+            continue
+        if isinstance(args[0], Register): # Single [register, index] argument
+            args = [args]
+        if not isinstance(args[0], list):
+            # In place as implicit loops hold a copy of line
+            varType = "float" if attr == "_pargs" else "int"
+            args[:] = [replace(arg, varType) for arg in args]
+            continue
+        for arg in args:
+            if not isinstance(arg, list) or len(arg) != 2:
+                continue
+            if isinstance(arg[1], tuple):
+                arg[1] = tuple(replace(elem, "int") for elem in arg[1])
+            else:
+                arg[1] = replace(arg[1], "int")
+
+class _Reducer:
+    """ Replace affine functions of the variable of a loop by induction variables stepped with it
+
+    :param optimiser: Owning optimiser
+    :param loop: Loop to reduce
+    """
+    def __init__(self, optimiser, loop):
+        self.optimiser = optimiser
+        self.loop = loop
+        self.hoister = _Hoister(optimiser, loop, loop)
+        self.induction = {}
+        self.step = 1
+
+    def affine(self, elem):
+        """ Split elem into coefficient*var + offset
+
+        :returns: (coefficient, offset) where offset is a list of (multiplier, trivial invariant element),
+                  or None if elem is not affine in the loop variable
+        :rtype: tuple
+        """
+        var = self.loop.var[0]
+        if _name(elem) == var:
+            return 1, []
+        if isinstance(elem, MathsBlock):
+            return self.affine(elem.maths[0]) if len(elem.maths) == 1 else None
+        if _trivial(elem):
+            return (0, [(1, elem)]) if self.hoister.invariant(elem) else None
+        if not isinstance(elem, Binary):
+            return None
+        operators = [operator for operator, _ in elem.args]
+        if all(operator in ("nop", "+", "-") for operator in operators):
+            coeff, offset = 0, []
+            for operator, operand in elem.args:
+                part = self.affine(operand)
+                if part is None:
+                    return None
+                sign = -1 if operator == "-" else 1
+                coeff += sign*part[0]
+                offset += [(sign*mult, term) for mult, term in part[1]]
+            return coeff, offset
+        if operators == ["nop", "*"]:
+            (_, left), (_, right) = elem.args
+            for scale, other in ((left, right), (right, left)):
+                if isinstance(scale, int) and not isinstance(scale, bool):
+                    part = self.affine(other)
+                    if part is not None:
+                        return scale*part[0], [(scale*mult, term) for mult, term in part[1]]
+        return None
+
+    def reduce(self, elem, varType):
+        """ Return the induction variable equal to elem, or elem if it is not worth one """
+        if varType != "int" or _trivial(elem) and _name(elem) is None:
+            return elem
+        part = self.affine(elem)
+        if part is None or part[0] == 0 or part[0] == 1 and not part[1]:
+            return elem
+        coeff, offset = part
+        key = (coeff, tuple((mult, _text(term)) for mult, term in offset))
+        if key not in self.induction:
+            loop = self.loop
+            name = f"_{loop.var[0]}_iv{len(self.induction)}"
+            const = Constant(loop, (name, "int"), (0, None))
+            const.loopVar = True
+            loop._objs[name] = const
+            loop.var.append(name)
+            loop.induction.append(name)
+            loop.start.append(_linear(coeff, loop.start[0], offset))
+            loop.end.append(_linear(coeff, loop.end[0], offset))
+            loop.step.append(coeff*self.step)
+            self.induction[key] = const
+            self.optimiser.report.induction += 1
+        return self.induction[key]
+
+    def reduce_loop(self):
+        """ Reduce the indices of the body of the loop """
+        loop = self.loop
+        if len(loop.var) != 1 or not _trivial(loop.start[0]) or not _trivial(loop.end[0]):
+            return
+        try:
+            self.step = evaluate(loop, loop.step[0], loop.var)
+        except NotConstant:
+            return
+        if not isinstance(self.step, int):
+            return
+        self.lines(loop.code)
+
+    def lines(self, code):
+        """ Reduce the indices of every line in code, including the bodies of inner loops """
+        for line in code:
+            if isinstance(line, Loop):
+                line.start = [self.reduce(elem, "int") for elem in line.start]
+                line.end = [self.reduce(elem, "int") for elem in line.end]
+                if self.loop.var[0] not in line.var:
+                    self.lines(line.code)
+            elif isinstance(line, (IfBlock, While)):
+                self.lines(line.code)
+            elif isinstance(line, Let):
+                if line.const.varType == "int":
+                    line.const.val = self.reduce(line.const.val, "int")
+            elif getattr(line, "loops", None) is None:
+                for_args(line, self.reduce)
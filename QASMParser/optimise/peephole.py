@@ -0,0 +1,152 @@
+"""
+Module to perform commutation-aware peephole optimisation of gate calls:
+- Cancels adjacent inverse pairs
+- Merges consecutive single-qubit gates into a single U
+- Removes identity rotations
+"""
+import copy
+import numpy as np
+from ..parser.types import (Gate, CallGate, Comment)
+from .unitary import (NotUnitary, core_angles, is_identity, embed)
+from .stream import (count_calls, transform_runs, resolve_call)
+
+# Largest gate (in qubits) for which a matrix is computed
+MAX_MATRIX_QUBITS = 3
+# Largest space (in qubits) in which commutation is checked
+MAX_COMMUTE_QUBITS = 4
+# Number of previous operations searched for a partner
+MAX_LOOKBACK = 64
+
+class PeepholeReport:
+    """ Record of the gates cancelled, merged and removed by a peephole pass """
+    def __init__(self):
+        self.before = 0
+        self.after = 0
+        self.cancelled = 0
+        self.merged = 0
+        self.identities = 0
+
+    def __str__(self):
+        return (f"Peephole: {self.before} gate calls reduced to {self.after} "
+                f"({self.cancelled} inverse pairs cancelled, {self.merged} single-qubit gates merged, "
+                f"{self.identities} identity rotations removed)")
+
+def optimise_gates(codeObj):
+    """ Run the peephole optimiser over all blocks of codeObj in place
+
+    :param codeObj: ProgFile to optimise
+    :returns: Report of the changes made
+    :rtype: PeepholeReport
+    """
+    report = PeepholeReport()
+    report.before = count_calls(codeObj.code)
+    transform = lambda scope, run, runtime, exact: _optimise_run(scope, run, runtime, exact, report)
+    codeObj._code = transform_runs(codeObj, codeObj.code, set(), False, transform)
+    report.after = count_calls(codeObj.code)
+    return report
+
+def _optimise_run(scope, run, runtime, exact, report):
+    """ Optimise a straight-line run of gate calls
+
+    :param scope: Block in which the code is resolved
+    :param run: List of gate calls and comments
+    :param runtime: Names which are only known at run time
+    :param exact: Whether global phase must be preserved (inside gates which may be controlled)
+    :param report: PeepholeReport to update
+    :returns: Optimised run
+    :rtype: list
+    """
+    newCode = list(run)
+    window = []
+    for position, line in enumerate(run):
+        if isinstance(line, Comment):
+            continue
+        operation = resolve_call(scope, line, runtime, MAX_MATRIX_QUBITS)
+        operation.position = position
+        _push(window, operation, newCode, exact, report)
+    return [line for line in newCode if line is not None]
+
+def _push(window, operation, newCode, exact, report):
+    """ Add operation to the stream, cancelling or merging it with an earlier operation where possible """
+    if operation.matrix is not None and is_identity(operation.matrix, exact):
+        report.identities += 1
+        _remove(operation, newCode)
+        return
+
+    searched = 0
+    for previous in reversed(window):
+        if not previous.overlaps(operation):
+            continue
+        if _cancels(previous, operation, exact):
+            report.cancelled += 1
+            window.remove(previous)
+            _remove(previous, newCode)
+            _remove(operation, newCode)
+            return
+        if _mergeable(previous, operation):
+            if _merge(previous, operation, newCode, exact):
+                report.merged += 1
+                _remove(operation, newCode)
+                if is_identity(previous.matrix, exact):
+                    report.identities += 1
+                    window.remove(previous)
+                    _remove(previous, newCode)
+                return
+        searched += 1
+        if searched > MAX_LOOKBACK or not _commutes(previous, operation):
+            break
+    window.append(operation)
+
+def _remove(operation, newCode):
+    """ Blank out the line of operation in the new code """
+    newCode[operation.position] = None
+
+def _cancels(first, second, exact):
+    """ Check whether second undoes first """
+    if first.signature != second.signature or first.signature is None:
+        return False
+    if first.matrix is not None and second.matrix is not None:
+        return is_identity(second.matrix @ first.matrix, exact)
+    # Fall back to the inverses generated by the parser
+    names = (first.line.name, second.line.name)
+    return (first.params is not None and first.params == second.params and
+            (names[0] == "_inv_"+names[1] or names[1] == "_inv_"+names[0]))
+
+def _mergeable(first, second):
+    """ Check whether two single-qubit operations may be combined into one U """
+    return (isinstance(first.line, CallGate) and first.matrix is not None and second.matrix is not None
+            and first.concrete and second.concrete
+            and len(first.qubits) == len(second.qubits) == 1 and first.qubits == second.qubits)
+
+def _merge(first, second, newCode, exact):
+    """ Replace first by a U equal to second after first, returns whether successful """
+    matrix = second.matrix @ first.matrix
+    try:
+        angles = core_angles(matrix, exact)
+    except NotUnitary:
+        return False
+
+    merged = copy.copy(first.line)
+    merged._name = "U"
+    merged.callee = Gate.internalGates["U"]
+    merged._pargs = list(angles)
+    merged._spargs = []
+    merged._gargs = []
+    merged._qargs = [list(first.line.qargs[0])]
+
+    newCode[first.position] = merged
+    first.line = merged
+    first.matrix = matrix
+    first.params = angles
+    return True
+
+def _commutes(first, second):
+    """ Check whether two overlapping operations commute """
+    if (first.matrix is None or second.matrix is None or not first.concrete or not second.concrete):
+        return False
+    qubits = list(dict.fromkeys(first.qubits + second.qubits))
+    if len(qubits) > MAX_COMMUTE_QUBITS:
+        return False
+    firstFull = embed(first.matrix, [qubits.index(qubit) for qubit in first.qubits], len(qubits))
+    secondFull = embed(second.matrix, [qubits.index(qubit) for qubit in second.qubits], len(qubits))
+    return np.allclose(firstFull @ secondFull, secondFull @ firstFull)
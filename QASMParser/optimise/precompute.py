@@ -0,0 +1,176 @@
+"""
+Module to replace calls to small gates with constant parameters by a single application of their precomputed unitary
+"""
+import hashlib
+import numpy as np
+from ..parser.types import (Gate, CallGate, NestLoop, Alias, InlineAlias, DeferredAlias, ApplyMatrix,
+                            MatrixLiteral)
+from .unitary import (NotUnitary, CX_MATRIX, gate_unitary)
+from .stream import (count_calls, transform_runs, canonical)
+
+class PrecomputeReport:
+    """ Record of the gate calls replaced by precomputed unitaries """
+    def __init__(self, maxQubits):
+        self.maxQubits = maxQubits
+        self.calls = 0
+        self.inverses = 0
+        self.literals = 0
+        self.remaining = 0
+
+    def __str__(self):
+        return (f"Precompute (k={self.maxQubits}): {self.calls} gate calls replaced by {self.literals} "
+                f"precomputed unitaries ({self.inverses} inverses taken as adjoints), "
+                f"{self.remaining} gate calls remain")
+
+class LiteralTable:
+    """ MatrixLiterals declared by a program, shared by every pass which declares them
+
+    :param codeObj: ProgFile in which literals are declared
+    """
+    def __init__(self, codeObj):
+        self.codeObj = codeObj
+        self._byKey = {}
+        self._byMatrix = {line.matrix.tobytes(): line for line in codeObj.code if isinstance(line, MatrixLiteral)}
+        self._declared = set(self._byMatrix)
+        self.new = 0
+
+    def declare(self, key, stem, matrix):
+        """ Get the literal for key, reusing any literal with an identical matrix
+
+        :param key: Hashable description of what the matrix is the unitary of, e.g. (gate, pargs, spargs)
+        :param stem: Base for the name of a new literal
+        :param matrix: Unitary to declare
+        :returns: Literal holding matrix
+        :rtype: MatrixLiteral
+        """
+        if key not in self._byKey:
+            literal = self._byMatrix.get(matrix.tobytes())
+            if literal is None:
+                literal = MatrixLiteral(self.codeObj, literal_name(stem, matrix), matrix)
+                self._byMatrix[matrix.tobytes()] = literal
+                self.new += 1
+            self._byKey[key] = literal
+        return self._byKey[key]
+
+    def finalise(self):
+        """ Declare any new literals at the start of the program """
+        newLiterals = [literal for matrix, literal in self._byMatrix.items() if matrix not in self._declared]
+        self.codeObj._code = newLiterals + self.codeObj.code
+        self._declared = set(self._byMatrix)
+
+def literal_name(stem, matrix):
+    """ Name of the literal declaring matrix, which depends only on the matrix so that it is stable between runs
+
+    :param stem: Base for the name
+    :param matrix: Unitary declared
+    :returns: Name of the literal
+    :rtype: str
+    """
+    digest = hashlib.sha256(np.ascontiguousarray(matrix).tobytes()).hexdigest()
+    return f"_mat_{stem}_{digest[:12]}"
+
+def precompute_gates(codeObj, maxQubits=2):
+    """ Replace calls to gates on at most maxQubits qubits with constant parameters by their unitary in place
+
+    Each distinct unitary is declared once as a MatrixLiteral at the start of the program and shared by all of
+    its applications.
+
+    :param codeObj: ProgFile to optimise
+    :param maxQubits: Largest number of qubits of a gate to precompute
+    :returns: Report of the changes made
+    :rtype: PrecomputeReport
+    """
+    report = PrecomputeReport(maxQubits)
+    literals = LiteralTable(codeObj)
+    transform = lambda scope, run, runtime, exact: [_precompute(scope, line, runtime, maxQubits, literals, report)
+                                                    for line in run]
+    codeObj._code = transform_runs(codeObj, codeObj.code, set(), True, transform)
+    literals.finalise()
+    report.literals = literals.new
+    report.remaining = count_calls(codeObj.code) - report.calls
+    return report
+
+def constant_params(scope, line, runtime):
+    """ Numerical values of the pargs and spargs of line, None if any are not known at compile time
+
+    :returns: (pargs, spargs)
+    :rtype: tuple
+    """
+    params = canonical(scope, [*line.pargs, *line.spargs], runtime)
+    if params is None or not all(isinstance(param, (int, float)) for param in params):
+        return None
+    nArgs = len(line.pargs)
+    return params[:nArgs], params[nArgs:]
+
+def _precompute(scope, line, runtime, maxQubits, literals, report):
+    """ Replace line by an application of its precomputed unitary if possible
+
+    :param scope: Block in which the code is resolved
+    :param line: Line of a straight-line run
+    :param runtime: Names which are only known at run time
+    :param maxQubits: Largest number of qubits of a gate to precompute
+    :param literals: LiteralTable in which to declare matrices
+    :param report: PrecomputeReport to update
+    :returns: Line to use in place of line
+    """
+    # A core U with constant parameters is three rotations, so is precomputed too (as are the Us the peephole pass
+    # merges runs into), while CX stays native
+    if not isinstance(line, CallGate) or line.gargs or line.callee is Gate.internalGates.get("CX"):
+        return line
+
+    params = constant_params(scope, line, runtime)
+    targets = expand_qargs(scope, line.qargs, runtime)
+    if params is None or targets is None:
+        return line
+    pargs, spargs = params
+    try:
+        matrix = gate_unitary(line.callee, pargs, spargs, maxQubits)
+    except NotUnitary:
+        return line
+    if len(matrix) != 2**len(targets):
+        return line
+    # A native controlled-NOT is cheaper than a dense two-qubit unitary
+    if len(matrix) == 4 and np.array_equal(matrix, CX_MATRIX):
+        return line
+
+    report.calls += 1
+    if line.callee.inverseOf is not None:
+        report.inverses += 1
+
+    literal = literals.declare((line.callee, pargs, spargs), line.callee.name, matrix)
+    applied = ApplyMatrix(line.parent, matrix, targets, literal)
+    if line.loops:
+        _copy_loops(line, applied)
+    return applied
+
+def expand_qargs(scope, qargs, runtime):
+    """ Expand qargs into single qubit [register, index] pairs, None if not possible """
+    targets = []
+    for reg, index in qargs:
+        if isinstance(reg, (Alias, InlineAlias, DeferredAlias)):
+            return None
+        if isinstance(index, (list, tuple)):
+            index = canonical(scope, index, runtime)
+            if index is None or not all(isinstance(elem, int) for elem in index):
+                return None
+            targets += [[reg, i] for i in range(index[0], index[1]+1)]
+        else:
+            targets.append([reg, index])
+    return targets
+
+def _copy_loops(line, applied):
+    """ Wrap applied in the same implicit loops as line """
+    levels = []
+    loop = line.loops
+    while isinstance(loop, NestLoop):
+        levels.append(loop)
+        loop = loop.code[0]
+
+    body = ApplyMatrix(applied.parent, applied.matrix, applied.qargs, applied.literal, applied.controls)
+    applied.innermost = None
+    for level in reversed(levels):
+        newLevel = NestLoop(body, level.var, level.start, level.end, level.step)
+        if applied.innermost is None:
+            applied.innermost = newLevel
+        body = newLevel
+    applied.loops = body
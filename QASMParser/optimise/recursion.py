@@ -0,0 +1,143 @@
+"""
+Module to turn tail-recursive circuits into loops and unroll recursion with constant spargs to a bounded depth
+"""
+from ..parser.types import (Gate, Opaque, CallGate, Comment, Include, Dealloc, Reset, IfBlock, While, MathsBlock,
+                            TheEnd, TailCall)
+from ..parser.filehandle import (NullBlock)
+from .specialise import (specialisable, specialise_gate, dispatch_call, find_calls)
+from .stream import (canonical)
+
+class RecursionReport:
+    """ Record of the recursive circuits unrolled and turned into loops """
+    def __init__(self):
+        self.copies = []
+        self.calls = 0
+        self.generic = 0
+        self.folded = 0
+        self.loops = []
+        self.recursive = []
+
+    def __str__(self):
+        outStr = (f"Recursion: {len(self.recursive)} recursive circuits, "
+                  f"{len(self.loops)} tail calls made into loops ({', '.join(self.loops) or '-'})")
+        if self.copies or self.calls or self.generic:
+            outStr += (f"\nUnrolled {len(self.copies)} levels ({', '.join(self.copies) or '-'}), "
+                       f"{self.calls} calls dispatched to them, {self.generic} calls left recursive")
+        return outStr
+
+def eliminate_recursion(codeObj, maxDepth=0):
+    """ Unroll recursive calls with constant spargs to at most maxDepth levels then turn tail calls into loops
+
+    Each level of unrolling is a copy of the circuit specialised to the spargs of the call, so that a base case
+    guarded by the spargs folds away along with the calls it makes unreachable. Calls deeper than maxDepth, or
+    whose spargs are only known at runtime, are left to the generic circuit.
+
+    A circuit whose last quantum operation is an unmodified call to itself (possibly inside conditionals) has its
+    body wrapped in an infinite loop, the self-call becoming a reassignment of the arguments and a restart.
+
+    :param codeObj: ProgFile to optimise
+    :param maxDepth: Number of levels of recursion to unroll
+    :returns: Report of the changes made
+    :rtype: RecursionReport
+    """
+    report = RecursionReport()
+    gates = _recursive_gates(codeObj.code)
+    report.recursive = [gate.name for gate in gates]
+    if maxDepth > 0:
+        _unroll(codeObj, maxDepth, report)
+    for gate in gates:
+        if _loop_tail_call(gate):
+            report.loops.append(gate.name)
+    return report
+
+def _recursive_gates(code):
+    """ Every recursive gate defined in code """
+    found = []
+    for line in code:
+        if isinstance(line, Include):
+            found += _recursive_gates(line.raw_code)
+        elif isinstance(line, Gate) and not isinstance(line, Opaque) and line.recursive:
+            found.append(line)
+    return found
+
+def _unroll(codeObj, maxDepth, report):
+    """ Dispatch calls to recursive gates with constant spargs to copies specialised to them, maxDepth levels deep """
+    unrolled = {}
+    pending = [(codeObj, codeObj.code, set(), 0)]
+    while pending:
+        scope, code, runtime, depth = pending.pop()
+        for callScope, line, callRuntime in find_calls(scope, code, runtime):
+            if not line.callee.recursive or not specialisable(codeObj, line.callee):
+                continue
+            values = canonical(callScope, line.spargs, callRuntime)
+            if values is None or not all(isinstance(value, int) for value in values):
+                report.generic += 1
+                continue
+            key = (line.callee, values)
+            if key not in unrolled:
+                if depth >= maxDepth:
+                    report.generic += 1
+                    continue
+                spec = specialise_gate(codeObj, line.callee, values, report)
+                unrolled[key] = spec
+                report.copies.append(spec.name)
+                pending.append((spec, spec.code, {arg.name for arg in (*spec.pargs, *spec.qargs)}, depth + 1))
+            dispatch_call(line, unrolled[key])
+            report.calls += 1
+
+def _is_self_call(gate, line):
+    """ Check whether line is a plain call of gate to itself """
+    return isinstance(line, CallGate) and line.callee is gate and line.loops is None and not line.byprod
+
+def _tail_call(gate, code):
+    """ Find the self-call of gate in tail position of code
+
+    :returns: (block, position, trailing) where trailing are the lines which follow the call on exit,
+              or None if the last operation is not a self-call
+    :rtype: tuple
+    """
+    trailing = []
+    for position in reversed(range(len(code))):
+        line = code[position]
+        if isinstance(line, Comment):
+            continue
+        if isinstance(line, Dealloc) or isinstance(line, Reset) and line.qargs[0] in gate.localQregs:
+            trailing.insert(0, line)
+            continue
+        if _is_self_call(gate, line):
+            return code, position, trailing
+        if isinstance(line, IfBlock):
+            found = _tail_call(gate, line.code)
+            if found is None:
+                return None
+            block, position, inner = found
+            return block, position, inner + trailing
+        return None
+    return None
+
+def _loop_tail_call(gate):
+    """ Wrap the body of gate in a loop which its tail call restarts
+
+    :returns: Whether gate had a tail call
+    :rtype: bool
+    """
+    if gate.byprod is not None:
+        return False
+    found = _tail_call(gate, gate.code)
+    if found is None:
+        return False
+    block, position, trailing = found
+    restart = [*trailing, TailCall(gate, block[position])]
+
+    if block is gate.code:
+        body = block[:position] + restart
+    else:
+        # Falling out of the conditionals ends the call
+        block[position:position+1] = restart
+        body = gate.code + [TheEnd(gate, gate.name)]
+
+    loop = While(gate, NullBlock(gate.currentFile), MathsBlock(gate, "1"))
+    loop._code = body
+    gate._code = [loop]
+    gate.reboundArgs = {arg.name for arg in (*gate.qargs, *gate.pargs, *gate.spargs)}
+    return True
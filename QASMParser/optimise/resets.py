@@ -0,0 +1,176 @@
+"""
+Module to elide resets of qubits already in the zero state and batch the remaining resets
+"""
+import numpy as np
+from ..parser.types import (Gate, Opaque, Include, Reset, Register, QuantumRegister, BatchReset)
+from .lightcone import (classify_line)
+from .constfold import (evaluate, NotConstant)
+
+class ResetReport:
+    """ Record of the resets elided and batched """
+    def __init__(self):
+        self.elided = 0
+        self.batched = 0
+        self.batches = 0
+        self.reinitialised = 0
+
+    def __str__(self):
+        return (f"Resets: {self.elided} resets of qubits already zero elided, {self.batched} resets batched into "
+                f"{self.batches} operations, {self.reinitialised} of which reinitialise the whole state")
+
+def optimise_resets(codeObj):
+    """ Remove resets of qubits known to be zero and merge runs of resets into single operations in place
+
+    In the main program a qubit is known to be zero from the start of the program, or after a reset, until a line
+    acts on it (anything other than a plain gate call or measurement acts on every qubit). Resets of qubits known to
+    be zero are removed, as are the resets of circuit-local registers which the circuit never uses. Each remaining
+    run of resets becomes a single batched reset, which skips the measurement of qubits found in a basis state,
+    and a run of the main program which resets every qubit which may not be zero reinitialises the state instead.
+
+    :param codeObj: ProgFile to optimise
+    :returns: Report of the changes made
+    :rtype: ResetReport
+    """
+    report = ResetReport()
+    _elide_program(codeObj, report)
+    codeObj._code = _batch_code(codeObj, codeObj.code, report)
+    _reinitialise(codeObj, report)
+    return report
+
+def _physical(codeObj):
+    """ Physical indices of the logical qubits of the main program, in the order used by classify_line """
+    return np.array([target for reg in codeObj.quantumRegisters for target in reg.mapping], dtype=int)
+
+def _elide_program(codeObj, report):
+    """ Remove resets of the main program acting only on qubits known to be zero """
+    registers = {reg.name: reg for reg in codeObj.quantumRegisters}
+    nQubits = sum(reg.size for reg in registers.values())
+    physical = _physical(codeObj)
+    nPhysical = QuantumRegister.numPhysicalQubits
+    if nPhysical is None:
+        nPhysical = QuantumRegister.numQubits + QuantumRegister.numGateQubits
+    # Qubits of circuit-local registers are reset on exit so are zero between lines
+    zero = np.ones(nPhysical, dtype=bool)
+
+    newCode = []
+    for line in codeObj.code:
+        kind, mask = classify_line(codeObj, line, registers, nQubits)
+        touched = np.zeros(nPhysical, dtype=bool)
+        touched[physical[mask]] = True
+        if isinstance(line, Reset):
+            if not (touched & ~zero).any():
+                report.elided += 1
+                continue
+            # The mask may cover a whole register where only part of it is reset
+            reset = _targets(codeObj, _batch(codeObj, [line], None), nPhysical)
+            if reset is not None:
+                zero |= reset
+        elif kind == "barrier":
+            zero[:] = False
+        elif kind != "classical":
+            zero &= ~touched
+        newCode.append(line)
+    codeObj._code = newCode
+
+def _batch_code(scope, code, report):
+    """ Replace each run of resets in code (and child blocks) by a batched reset, returning the new code """
+    newCode = []
+    run = []
+    for line in code:
+        if isinstance(line, Reset):
+            run.append(line)
+            continue
+        if run:
+            newCode.append(_batch(scope, run, report))
+            run = []
+        if isinstance(line, Gate) and not isinstance(line, Opaque):
+            _elide_unused(line, report)
+            line._code = _batch_code(line, line.code, report)
+        elif isinstance(line, Include):
+            line._code = _batch_code(scope, line.raw_code, report)
+        elif isinstance(getattr(line, "code", None), list) and not isinstance(line, Gate):
+            line._code = _batch_code(line, line.code, report)
+        newCode.append(line)
+    if run:
+        newCode.append(_batch(scope, run, report))
+    return newCode
+
+def _batch(scope, run, report):
+    """ Merge a run of resets into one batched reset, counted in report unless it is None """
+    qargs = []
+    for line in run:
+        reg, index = line.qargs
+        if line.loops is None:
+            qargs.append([reg, index])
+            continue
+        # A reset has a single argument, so its implicit loop runs over exactly the qubits reset
+        qargs.append([reg, (line.loops.start[0], line.loops.end[0])])
+    if report is not None:
+        report.batched += len(run)
+        report.batches += 1
+    return BatchReset(scope, qargs)
+
+def _targets(codeObj, batch, nPhysical):
+    """ Bitset of the physical qubits reset by batch, None if they are not known at compile time """
+    touched = np.zeros(nPhysical, dtype=bool)
+    for reg, index in batch.qargs:
+        if reg not in codeObj.quantumRegisters:
+            return None
+        try:
+            bounds = [int(evaluate(codeObj, elem)) for elem in (index if isinstance(index, tuple) else (index,))]
+        except NotConstant:
+            return None
+        touched[[reg.mapping[i] for i in range(bounds[0], bounds[-1]+1)]] = True
+    return touched
+
+def _elide_unused(gate, report):
+    """ Remove the resets on exit of circuit-local registers which the circuit never uses """
+    unused = {reg for reg in gate.localQregs if not _uses(gate.code, reg)}
+    kept = [line for line in gate.code if not (isinstance(line, Reset) and line.qargs[0] in unused)]
+    report.elided += len(gate.code) - len(kept)
+    gate._code = kept
+
+def _uses(code, reg):
+    """ Check whether any line of code other than its declaration and resets refers to reg """
+    for line in code:
+        if line is reg or isinstance(line, Reset):
+            continue
+        for attr in ("_qargs", "_pargs"):
+            args = getattr(line, attr, None)
+            if not isinstance(args, list) or not args:
+                continue
+            if isinstance(args[0], Register):
+                args = [args]
+            if any(isinstance(arg, list) and arg and arg[0] is reg for arg in args):
+                return True
+        if isinstance(getattr(line, "code", None), list) and not isinstance(line, Gate):
+            if _uses(line.code, reg):
+                return True
+    return False
+
+def _reinitialise(codeObj, report):
+    """ Mark the batched resets of the main program which leave every qubit zero as reinitialising the state """
+    registers = {reg.name: reg for reg in codeObj.quantumRegisters}
+    nQubits = sum(reg.size for reg in registers.values())
+    physical = _physical(codeObj)
+    nPhysical = QuantumRegister.numPhysicalQubits
+    if nPhysical is None:
+        nPhysical = QuantumRegister.numQubits + QuantumRegister.numGateQubits
+    zero = np.ones(nPhysical, dtype=bool)
+
+    for line in codeObj.code:
+        if isinstance(line, BatchReset):
+            touched = _targets(codeObj, line, nPhysical)
+            if touched is None:
+                zero[:] = False
+                continue
+            if not (~zero & ~touched).any():
+                line.whole = True
+                report.reinitialised += 1
+            zero |= touched
+            continue
+        kind, mask = classify_line(codeObj, line, registers, nQubits)
+        if kind == "barrier":
+            zero[:] = False
+        elif kind != "classical":
+            zero[physical[mask]] = False
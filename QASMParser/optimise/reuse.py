@@ -0,0 +1,187 @@
+"""
+Module to let qubits whose lifetimes do not overlap share a physical index in the simulated state
+"""
+import numpy as np
+from ..parser.types import (Gate, CallGate, Include, Measure, Reset, QuantumRegister, DeferredQuantumRegister)
+from .lightcone import (classify_line)
+
+class ReuseReport:
+    """ Record of the qubits mapped onto shared physical indices """
+    def __init__(self):
+        self.before = 0
+        self.after = 0
+        self.ancillas = 0
+        self.resets = 0
+
+    def __str__(self):
+        return (f"Qubit reuse: {self.before} qubits ({self.ancillas} circuit-local) mapped onto {self.after} "
+                f"physical qubits, {self.resets} resets inserted")
+
+class Lifetime:
+    """ Lines of the main program during which a logical qubit holds a state
+
+    :param reg: Register holding the qubit
+    :param index: Index of the qubit in reg
+    :param live: Bitset over the lines of the main program, set where the qubit holds a state
+    :param clean: Whether the qubit is left in a basis state after each of its live lines
+    :param measured: Whether the qubit is last measured rather than reset and so must be reset before reuse
+    """
+    def __init__(self, reg, index, live, clean, measured=False):
+        self.reg = reg
+        self.index = index
+        self.live = live
+        self.clean = clean
+        self.measured = measured
+
+    used = property(lambda self: bool(self.live.any()))
+    first = property(lambda self: int(np.argmax(self.live)))
+    last = property(lambda self: len(self.live) - 1 - int(np.argmax(self.live[::-1])))
+
+class Slot:
+    """ Physical qubit shared by the logical qubits assigned to it
+
+    :param nLines: Number of lines in the main program
+    """
+    def __init__(self, nLines):
+        self.busy = np.zeros(nLines, dtype=bool)
+        self.occupants = []
+
+    dirty = property(lambda self: any(not occupant.clean for occupant in self.occupants))
+    lastUsed = property(lambda self: max((occupant.last for occupant in self.occupants), default=-1))
+
+    def fits(self, lifetime):
+        """ Check whether lifetime may be added, given that no occupant starts after it """
+        if self.dirty:
+            return False
+        if not lifetime.clean:
+            return self.lastUsed < lifetime.first
+        return not (self.busy & lifetime.live).any()
+
+    def add(self, lifetime):
+        """ Assign lifetime to this slot """
+        self.busy |= lifetime.live
+        self.occupants.append(lifetime)
+
+def reuse_qubits(codeObj):
+    """ Map logical qubits whose lifetimes do not overlap onto shared physical indices in place
+
+    A qubit of the main program is live from the first to the last line which acts on it. Qubits of circuit-local
+    registers are live during any line which may call their circuit and are reset when it exits. A physical index
+    may be reused once its previous occupant is known to be in a basis state, i.e. it was last measured (a reset
+    is then inserted after the measurement) or reset. Qubits are assigned greedily in order of first use.
+
+    :param codeObj: ProgFile to optimise
+    :returns: Report of the changes made
+    :rtype: ReuseReport
+    """
+    report = ReuseReport()
+    report.before = QuantumRegister.numPhysicalQubits
+    if report.before is None:
+        report.before = QuantumRegister.numQubits + QuantumRegister.numGateQubits
+    registers = {reg.name: reg for reg in codeObj.quantumRegisters}
+    nQubits = sum(reg.size for reg in registers.values())
+    nLines = len(codeObj.code)
+
+    classified = [classify_line(codeObj, line, registers, nQubits) for line in codeObj.code]
+    masks = np.array([mask for _, mask in classified], dtype=bool).reshape(nLines, nQubits)
+
+    lifetimes = []
+    for reg in registers.values():
+        for index in range(reg.size):
+            touched = masks[:, reg.start + index]
+            live = np.zeros(nLines, dtype=bool)
+            if not touched.any():
+                lifetimes.append(Lifetime(reg, index, live, True))
+                continue
+            first = int(np.argmax(touched))
+            last = nLines - 1 - int(np.argmax(touched[::-1]))
+            live[first:last+1] = True
+            clean = classified[last][0] == "measure"
+            lifetimes.append(Lifetime(reg, index, live, clean, clean and isinstance(codeObj.code[last], Measure)))
+
+    ancillas = {}
+    for position, line in enumerate(codeObj.code):
+        for reg in called_ancillas(line, set()):
+            ancillas.setdefault(reg, np.zeros(nLines, dtype=bool))[position] = True
+    for reg, live in ancillas.items():
+        report.ancillas += reg.size
+        lifetimes += [Lifetime(reg, index, live.copy(), True) for index in range(reg.size)]
+
+    slots = []
+    for lifetime in sorted((lifetime for lifetime in lifetimes if lifetime.used), key=lambda x: x.first):
+        slot = next((slot for slot in slots if slot.fits(lifetime)), None)
+        if slot is None:
+            slot = Slot(nLines)
+            slots.append(slot)
+        slot.add(lifetime)
+    if not slots:
+        return report
+    # Lifetimes are of logical qubits, so an earlier remapping may already use fewer physical qubits
+    if len(slots) > report.before:
+        report.after = report.before
+        return report
+
+    # Keep the main qubits in declaration order so an unmeasured final state reads as before
+    order = {reg: position for position, reg in enumerate(registers.values())}
+    rank = lambda slot: min(((order.get(occupant.reg, len(order)), occupant.index)
+                             for occupant in slot.occupants))
+    slots.sort(key=rank)
+
+    physical = {}
+    resets = {}
+    for slotID, slot in enumerate(slots):
+        for occupant in slot.occupants:
+            physical[(occupant.reg, occupant.index)] = slotID
+            if occupant.measured and slot.lastUsed > occupant.last:
+                reset = Reset(codeObj, [occupant.reg, (occupant.index, occupant.index)])
+                resets.setdefault(occupant.last, []).append(reset)
+                report.resets += 1
+
+    for reg in [*registers.values(), *ancillas]:
+        reg.mapping = tuple(physical.get((reg, index), 0) for index in range(reg.size))
+    for reg in defined_ancillas(codeObj.code):
+        if reg not in ancillas:
+            reg.mapping = (0,)*reg.size
+
+    codeObj._code = [newLine for position, line in enumerate(codeObj.code)
+                     for newLine in [line, *resets.get(position, [])]]
+    QuantumRegister.numPhysicalQubits = len(slots)
+    report.after = len(slots)
+    return report
+
+def called_ancillas(line, seen):
+    """ Circuit-local registers which may hold qubits while line runs
+
+    :param line: Line to search
+    :param seen: Gates already searched
+    :returns: Registers found
+    :rtype: list
+    """
+    if isinstance(line, CallGate):
+        if id(line.callee) in seen:
+            return []
+        seen.add(id(line.callee))
+        found = [reg for reg in line.callee.localQregs if isinstance(reg, DeferredQuantumRegister)]
+        code = line.callee.code
+    elif isinstance(line, Gate):
+        # Definitions do not run
+        return []
+    elif isinstance(line, Include):
+        found, code = [], line.raw_code
+    else:
+        found, code = [], getattr(line, "code", None)
+    if isinstance(code, list):
+        for child in code:
+            found += [reg for reg in called_ancillas(child, seen) if reg not in found]
+    return found
+
+def defined_ancillas(code):
+    """ Circuit-local registers of every gate defined in code """
+    found = []
+    for line in code:
+        if isinstance(line, Include):
+            found += defined_ancillas(line.raw_code)
+        elif isinstance(line, Gate):
+            found += [reg for reg in line.localQregs if isinstance(reg, DeferredQuantumRegister)]
+            found += defined_ancillas(line.code)
+    return found
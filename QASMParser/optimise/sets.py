@@ -0,0 +1,83 @@
+"""
+Module to merge runs of classical register assignments into bulk copies and constant initialisers
+"""
+from ..parser.types import (Gate, Opaque, Include, Set, Bitstring)
+
+class SetReport:
+    """ Record of the assignments merged """
+    def __init__(self):
+        self.merged = 0
+        self.copies = 0
+        self.constants = 0
+
+    def __str__(self):
+        return (f"Sets: {self.merged} assignments merged away, leaving {self.copies} bulk copies and "
+                f"{self.constants} constant initialisers")
+
+def coalesce_sets(codeObj):
+    """ Merge each run of assignments to consecutive bits of a classical register in place
+
+    An assignment from several sources (e.g. ``set d = \\1b, c[0:1], c[2:3]\\``) is split into one assignment per
+    contiguous piece. Neighbouring pieces which copy consecutive bits of the same register become a single copy,
+    and neighbouring bitstrings become a single constant, which is emitted as a static array (or as packed words).
+
+    :param codeObj: ProgFile to optimise
+    :returns: Report of the changes made
+    :rtype: SetReport
+    """
+    report = SetReport()
+    codeObj._code = _coalesce_code(codeObj.code, report)
+    return report
+
+def _coalesce_code(code, report):
+    """ Merge the runs of assignments in code (and child blocks), returning the new code """
+    newCode = []
+    merged = set()
+    for line in code:
+        if isinstance(line, Gate) and not isinstance(line, Opaque):
+            line._code = _coalesce_code(line.code, report)
+        elif isinstance(line, Include):
+            line._code = _coalesce_code(line.raw_code, report)
+        elif isinstance(getattr(line, "code", None), list) and not isinstance(line, Gate):
+            line._code = _coalesce_code(line.code, report)
+
+        if isinstance(line, Set) and newCode and isinstance(newCode[-1], Set):
+            run = _merge(newCode[-1], line)
+            if run is not None:
+                report.merged += 1
+                merged.discard(id(newCode[-1]))
+                merged.add(id(run))
+                newCode[-1] = run
+                continue
+        newCode.append(line)
+
+    for line in newCode:
+        if id(line) in merged:
+            if isinstance(line.value[0], Bitstring):
+                report.constants += 1
+            else:
+                report.copies += 1
+    return newCode
+
+def _merge(first, second):
+    """ The single assignment equivalent to first followed by second, None if there is none """
+    (var, (varStart, _)), (val, (valStart, valEnd)) = first.variable, first.value
+    (nextVar, (nextVarStart, _)), (nextVal, (nextValStart, nextValEnd)) = second.variable, second.value
+    indices = (varStart, valStart, valEnd, nextVarStart, nextValStart, nextValEnd)
+    if not all(isinstance(index, int) for index in indices):
+        return None
+    size = valEnd - valStart + 1
+    nextSize = nextValEnd - nextValStart + 1
+    if nextVar is not var or nextVarStart != varStart + size:
+        return None
+
+    if isinstance(val, Bitstring) and isinstance(nextVal, Bitstring):
+        bits = val.val[valStart:valEnd+1] + nextVal.val[nextValStart:nextValEnd+1]
+        value = (Bitstring(first.parent, "".join(bits) + "b"), (0, len(bits) - 1))
+    # Copying from the register assigned could read bits the first copy has already overwritten
+    elif val is nextVal and val is not var and nextValStart == valEnd + 1:
+        value = (val, (valStart, nextValEnd))
+    else:
+        return None
+
+    return Set(first.parent, (var, (varStart, varStart + size + nextSize - 1)), value)
@@ -0,0 +1,143 @@
+"""
+Module to recognise measurements at the end of a program and sample many shots from a single simulation
+"""
+import re
+from ..parser.types import (Gate, Opaque, CallGate, Comment, Include, Measure, Reset, Output, CBlock, ClassicalRegister,
+                            SampleShots, BatchReset)
+from .constfold import (evaluate, NotConstant)
+
+# Outcomes are packed into a 64-bit integer by the sampler
+MAX_SAMPLED_BITS = 64
+
+class ShotsReport:
+    """ Record of the terminal measurements found and the shots sampled from them """
+    def __init__(self, shots):
+        self.shots = shots
+        self.measures = 0
+        self.bits = 0
+        self.reason = None
+
+    def __str__(self):
+        if self.reason is not None:
+            return f"Shots: measurements are not terminal ({self.reason}), each run of the program is one shot"
+        return (f"Shots: {self.measures} terminal measurements of {self.bits} output bits, "
+                f"{self.shots} shots sampled from a single simulation")
+
+class NotTerminal(Exception):
+    """ Raised when the measurements of a program do not all happen at its end """
+
+def sample_shots(codeObj, shots):
+    """ Replace the terminal measurements and outputs of the main program by sampling of the final state in place
+
+    :param codeObj: ProgFile to transform
+    :param shots: Number of shots to sample
+    :returns: Report of the changes made
+    :rtype: ShotsReport
+    """
+    report = ShotsReport(shots)
+    try:
+        position, qargs = terminal_measurements(codeObj)
+    except NotTerminal as reason:
+        report.reason = str(reason)
+        return report
+    if len(qargs) > MAX_SAMPLED_BITS:
+        report.reason = f"{len(qargs)} output bits, at most {MAX_SAMPLED_BITS} may be sampled"
+        return report
+
+    tail = codeObj.code[position:]
+    report.measures = sum(1 for line in tail if isinstance(line, Measure))
+    report.bits = len(qargs)
+    codeObj._code = (codeObj.code[:position] + [line for line in tail if isinstance(line, Comment)]
+                     + [SampleShots(codeObj, qargs, shots)])
+    return report
+
+def terminal_measurements(codeObj):
+    """ Find the measurements which end the main program
+
+    The program must end in a run of measurements followed by a run of outputs (comments aside), with no other
+    measurement or reset anywhere before them, including in the circuits called. Every bit output must be
+    measured in the final run.
+
+    :param codeObj: ProgFile to analyse
+    :returns: (position, qargs) where position is the first line of the final run and qargs the qubit measured
+              into each bit output, as [register, index] pairs in output order
+    :rtype: tuple
+    :raises NotTerminal: If the measurements are not terminal
+    """
+    code = codeObj.code
+    end = len(code)
+    while end and isinstance(code[end-1], (Comment, Output)):
+        end -= 1
+    position = end
+    while position and isinstance(code[position-1], (Comment, Measure)):
+        position -= 1
+    if not any(isinstance(line, Output) for line in code[end:]):
+        raise NotTerminal("no outputs at the end")
+    if not any(isinstance(line, Measure) for line in code[position:end]):
+        raise NotTerminal("no measurements before the final outputs")
+    for line in code[:position]:
+        _check_unmeasured(line, set())
+
+    measured = {}
+    for line in code[position:end]:
+        if not isinstance(line, Measure):
+            continue
+        qreg, qindex = line.qargs
+        creg, cindex = line.pargs
+        if qreg not in codeObj.quantumRegisters or not isinstance(creg, ClassicalRegister):
+            raise NotTerminal(f"measurement of {qreg.name} is not of a register of the program")
+        for qubit, bit in zip(_expand(codeObj, line, qindex), _expand(codeObj, line, cindex)):
+            measured[(creg.name, bit)] = [qreg, qubit]
+
+    qargs = []
+    for line in code[end:]:
+        if not isinstance(line, Output):
+            continue
+        creg, cindex = line.pargs
+        for bit in _expand(codeObj, line, cindex):
+            if (creg.name, bit) not in measured:
+                raise NotTerminal(f"{creg.name}[{bit}] is output but not measured at the end")
+            qargs.append(list(measured[(creg.name, bit)]))
+    return position, qargs
+
+def _check_unmeasured(line, seen):
+    """ Check that line (and any circuit it calls) neither measures nor resets a qubit """
+    if isinstance(line, Measure):
+        raise NotTerminal("measure before the end")
+    if isinstance(line, (Reset, BatchReset)):
+        raise NotTerminal("reset before the end")
+    if isinstance(line, CBlock):
+        raise NotTerminal("verbatim code may measure")
+    if isinstance(line, CallGate):
+        if id(line.callee) in seen:
+            return
+        seen.add(id(line.callee))
+        code = [] if isinstance(line.callee, Opaque) else line.callee.code
+    elif isinstance(line, Gate):
+        # Definitions do not run
+        return
+    elif isinstance(line, Include):
+        code = line.raw_code
+    else:
+        code = getattr(line, "code", None)
+    if isinstance(code, list):
+        for child in code:
+            _check_unmeasured(child, seen)
+
+def _expand(scope, line, index):
+    """ Every index an argument of line takes, expanding its implicit loop
+
+    :raises NotTerminal: If an index is not a compile-time constant
+    """
+    try:
+        if line.loops is None:
+            return [int(evaluate(scope, index))]
+        loop = line.loops
+        start, end, step = (int(evaluate(scope, elem)) for elem in (loop.start[0], loop.end[0], loop.step[0]))
+    except NotConstant:
+        raise NotTerminal(f"index of {line.name} is only known at run time")
+    match = re.fullmatch(rf"{re.escape(loop.var[0])}(?: \+ (-?\d+))?", str(index))
+    if match is None:
+        raise NotTerminal(f"index of {line.name} is not a constant offset of its loop")
+    shift = int(match.group(1) or 0)
+    return [value + shift for value in range(start, end+1, step)]
@@ -0,0 +1,206 @@
+"""
+Module to emit copies of circuits specialised to the compile-time constant spargs they are called with
+"""
+import copy
+from ..parser.types import (Gate, Opaque, CallGate, Include, Loop, IfBlock, While, Dealloc, LocalClassicalRegister,
+                            DeferredClassicalRegister, Alias, DeferredAlias)
+from .constfold import (evaluate, fold_gate, NotConstant)
+from .stream import (canonical)
+
+# Largest number of specialised copies of a single gate, guards against unbounded recursion
+MAX_SPECIALISATIONS = 32
+
+class SpecialiseReport:
+    """ Record of the specialised copies made and the calls dispatched to them """
+    def __init__(self):
+        self.copies = []
+        self.calls = 0
+        self.generic = 0
+        self.folded = 0
+
+    def __str__(self):
+        return (f"Specialisation: {len(self.copies)} specialised copies ({', '.join(self.copies) or '-'}), "
+                f"{self.calls} calls dispatched to them, {self.generic} calls with runtime spargs left generic, "
+                f"{self.folded} expressions folded")
+
+def specialise_gates(codeObj):
+    """ Dispatch calls whose spargs are all compile-time constants to a copy of the callee specialised to them
+
+    For each distinct tuple of spargs a copy of the gate is made with the spargs bound, then folded so that
+    sizes, loop bounds and indices are numbers. Deferred classical registers and aliases of the copy become
+    fixed-size (stack) arrays. Calls whose spargs are only known at runtime keep using the generic gate.
+
+    :param codeObj: ProgFile to optimise
+    :returns: Report of the changes made
+    :rtype: SpecialiseReport
+    """
+    report = SpecialiseReport()
+    specialised = {}
+    pending = [(codeObj, codeObj.code, set())]
+    while pending:
+        scope, code, runtime = pending.pop()
+        for callScope, line, callRuntime in find_calls(scope, code, runtime):
+            # Recursive gates are unrolled to a bounded depth by the recursion pass instead
+            if not specialisable(codeObj, line.callee) or line.callee.recursive:
+                continue
+            values = canonical(callScope, line.spargs, callRuntime)
+            if values is None or not all(isinstance(value, int) for value in values):
+                report.generic += 1
+                continue
+            key = (line.callee, values)
+            if key not in specialised:
+                if sum(1 for gate, _ in specialised if gate is line.callee) >= MAX_SPECIALISATIONS:
+                    report.generic += 1
+                    continue
+                spec = specialise_gate(codeObj, line.callee, values, report)
+                specialised[key] = spec
+                report.copies.append(spec.name)
+                pending.append((spec, spec.code, {arg.name for arg in (*spec.pargs, *spec.qargs)}))
+            dispatch_call(line, specialised[key])
+            report.calls += 1
+    return report
+
+def specialisable(codeObj, gate):
+    """ Check whether calls to gate may be dispatched to a specialised copy """
+    return (isinstance(gate, Gate) and not isinstance(gate, Opaque) and gate.spargs and not gate.gargs
+            and gate.name not in Gate.internalGates and gate.controlOf is None and gate in codeObj.code)
+
+def _retarget(line, gate):
+    """ Point a call (and the copy held by its implicit loops) at gate """
+    targets = [line]
+    if line.loops is not None:
+        targets.append(line.innermost.code[0])
+    for target in targets:
+        target._name = gate.name
+        target.callee = gate
+
+def find_calls(scope, code, runtime):
+    """ Every gate call in code and its child blocks
+
+    :returns: List of (scope, line, runtime) for each call
+    :rtype: list
+    """
+    calls = []
+    for line in code:
+        if isinstance(line, CallGate):
+            calls.append((scope, line, runtime))
+        elif isinstance(line, Gate) and not isinstance(line, Opaque):
+            args = {arg.name for arg in (*line.pargs, *line.spargs, *line.qargs)}
+            calls += find_calls(line, line.code, runtime | args)
+        elif isinstance(line, Include):
+            calls += find_calls(scope, line.raw_code, runtime)
+        elif isinstance(line, Loop):
+            calls += find_calls(line, line.code, runtime | set(line.var))
+        elif isinstance(line, (IfBlock, While)):
+            calls += find_calls(line, line.code, runtime)
+    return calls
+
+def specialise_gate(codeObj, gate, values, report):
+    """ Make a copy of gate with its spargs bound to values and declare it after gate
+
+    :param codeObj: ProgFile declaring gate
+    :param gate: Gate to copy
+    :param values: Constant value of each sparg
+    :param report: Report whose count of folded expressions is updated
+    :returns: Specialised gate
+    :rtype: Gate
+    """
+    spec = copy.deepcopy(gate, _shared(codeObj, gate))
+    # Calls of a recursive gate to itself still take spargs
+    for _, line, _ in find_calls(spec, spec.code, set()):
+        if line.callee is spec:
+            _retarget(line, gate)
+    name = f"{gate.name}_" + "_".join(str(value).replace("-", "m") for value in values)
+    while name in codeObj.get_objs("Copy"):
+        name += "_"
+    spec._name = name
+
+    for sparg, value in zip(spec.spargs, values):
+        sparg.val = value
+    spec._spargs = []
+    for arg in spec.qargs:
+        try:
+            arg._size = arg._end = arg._maxIndex = int(evaluate(spec, arg.size))
+        except NotConstant:
+            pass
+    report.folded += fold_gate(spec).folded
+    _fix_registers(spec)
+
+    spec._inverse = spec._control = None
+    codeObj._objs[name] = spec
+    position = codeObj.code.index(gate) + 1
+    codeObj._code = codeObj.code[:position] + [spec] + codeObj.code[position:]
+    return spec
+
+def _shared(codeObj, gate):
+    """ Deepcopy memo which shares everything outside the body of gate (program, other gates, file handles) """
+    memo = {id(codeObj): codeObj}
+    memo.update((id(obj), obj) for obj in codeObj.get_objs("Copy").values() if obj is not gate)
+    stack, seen = [gate], set()
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or id(obj) in memo:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, (list, tuple, set)):
+            stack += obj
+        elif isinstance(obj, dict):
+            stack += obj.values()
+        elif hasattr(obj, "__dict__"):
+            for attr, value in vars(obj).items():
+                if attr in ("currentFile", "instructions"):
+                    memo[id(value)] = value
+                else:
+                    stack.append(value)
+    return memo
+
+def _fix_registers(spec):
+    """ Replace deferred registers and aliases of spec whose size is now known by fixed-size ones """
+    # Registers which are returned or assigned the result of a call must stay as pointers
+    assigned = {line.byprod for _, line, _ in find_calls(spec, spec.code, set()) if line.byprod}
+    fixed = {}
+    for reg in [*spec.localCregs, *spec.localAliases]:
+        if not isinstance(reg, (DeferredClassicalRegister, DeferredAlias)) or reg is spec.byprod:
+            continue
+        if reg.name in assigned:
+            continue
+        try:
+            size = int(evaluate(spec, reg.size))
+        except NotConstant:
+            continue
+        if isinstance(reg, DeferredAlias):
+            fixed[reg.name] = Alias(spec, reg.name, (size, size))
+        else:
+            fixed[reg.name] = LocalClassicalRegister(spec, reg.name, size)
+
+    deferred = (DeferredClassicalRegister, DeferredAlias)
+    spec._code = [fixed.get(line.name, line) if isinstance(line, deferred) else line for line in spec.code
+                  if not (isinstance(line, Dealloc) and line.pargs in fixed)]
+    _rebind(spec, fixed)
+
+def _rebind(block, fixed):
+    """ Point the scope of block and its child blocks at the fixed registers """
+    block._objs.update((name, reg) for name, reg in fixed.items() if name in block._objs)
+    for line in block.code:
+        if isinstance(line, (Loop, IfBlock, While)):
+            _rebind(line, fixed)
+        for attr in ("_qargs", "_pargs"):
+            args = getattr(line, attr, None)
+            if not isinstance(args, list):
+                continue
+            for arg in ([args] if args and not isinstance(args[0], list) else args):
+                if isinstance(arg, list) and arg and getattr(arg[0], "name", None) in fixed:
+                    arg[0] = fixed[arg[0].name]
+
+def dispatch_call(line, spec):
+    """ Retarget a call (and the copy held by its implicit loops) at spec """
+    _retarget(line, spec)
+    targets = [line]
+    if line.loops is not None:
+        targets.append(line.innermost.code[0])
+    for target in targets:
+        target._spargs = []
+        # Single qubit arguments are passed by index rather than by reference
+        for qarg, arg in zip(target.qargs, spec.qargs):
+            if arg.size == 1 and isinstance(qarg[1], tuple) and qarg[1][0] == qarg[1][1]:
+                qarg[1] = qarg[1][0]
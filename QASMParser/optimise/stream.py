@@ -0,0 +1,168 @@
+"""
+Module to resolve straight-line runs of gate calls into ordered streams of operations on qubits
+"""
+from ..parser.types import (Gate, Opaque, CallGate, Comment, Include, Loop, IfBlock, While, Alias, InlineAlias,
+                            Constant, MathsBlock, ApplyMatrix)
+from .constfold import (evaluate, NotConstant)
+from .unitary import (NotUnitary, gate_unitary, controlled)
+
+class GateOp:
+    """ Resolved gate call in a straight-line stream
+
+    :param line: CallGate (or ApplyMatrix) being resolved
+    :param qubits: Keys of qubits touched, (register, index) where index "*" is any, None is a wildcard
+    :param targets: [register, index] pairs matching qubits if all are known
+    :param signature: Hashable description of the qubit arguments, None if they cannot be compared
+    :param params: Canonical parameter values, None if they cannot be compared
+    :param matrix: Unitary of a single application of the gate or None if unknown
+    """
+    def __init__(self, line, qubits, targets, signature, params, matrix):
+        self.line = line
+        self.qubits = qubits
+        self.targets = targets
+        self.signature = signature
+        self.params = params
+        self.matrix = matrix
+        self.position = None
+
+    looped = property(lambda self: self.line.loops is not None)
+    concrete = property(lambda self: not self.looped and all(qubit is not None and qubit[1] != "*"
+                                                              for qubit in self.qubits))
+
+    def overlaps(self, other):
+        """ Check whether two operations touch any of the same qubits """
+        return keys_overlap(self.qubits, other.qubits)
+
+def keys_overlap(mine, theirs):
+    """ Check whether two collections of qubit keys may refer to the same qubit """
+    for myKey in mine:
+        for theirKey in theirs:
+            if myKey is None or theirKey is None:
+                return True
+            if myKey[0] == theirKey[0] and "*" in (myKey[1], theirKey[1]) or myKey == theirKey:
+                return True
+    return False
+
+def count_calls(code):
+    """ Count the gate applications written in code and its children """
+    count = 0
+    for line in code:
+        if isinstance(line, (CallGate, ApplyMatrix)):
+            count += 1
+        elif isinstance(line, Include):
+            count += count_calls(line.raw_code)
+        elif isinstance(getattr(line, "code", None), list):
+            count += count_calls(line.code)
+    return count
+
+def transform_runs(scope, code, runtime, exact, transform):
+    """ Replace each straight-line run of gate calls in code (and child blocks) by the result of transform
+
+    :param scope: Block in which the code is resolved
+    :param code: List of code lines
+    :param runtime: Names which are only known at run time
+    :param exact: Whether global phase must be preserved (inside gates which may be controlled)
+    :param transform: Function (scope, run, runtime, exact) returning the lines to replace run
+    :returns: Transformed code
+    :rtype: list
+    """
+    newCode = []
+    run = []
+    for line in code:
+        if isinstance(line, (Comment, ApplyMatrix)) or isinstance(line, CallGate) and not line.byprod:
+            run.append(line)
+            continue
+
+        # Anything else is a barrier to reordering
+        if run:
+            newCode += transform(scope, run, runtime, exact)
+            run = []
+        if isinstance(line, Gate) and not isinstance(line, Opaque):
+            args = {arg.name for arg in (*line.pargs, *line.spargs, *line.qargs)}
+            line._code = transform_runs(line, line.code, runtime | args, True, transform)
+        elif isinstance(line, Include):
+            line._code = transform_runs(scope, line.raw_code, runtime, exact, transform)
+        elif isinstance(line, Loop):
+            line._code = transform_runs(line, line.code, runtime | set(line.var), exact, transform)
+        elif isinstance(line, (IfBlock, While)):
+            line._code = transform_runs(line, line.code, runtime, exact, transform)
+        newCode.append(line)
+
+    if run:
+        newCode += transform(scope, run, runtime, exact)
+    return newCode
+
+def canonical(scope, elem, runtime):
+    """ Hashable form of a parameter or index for comparison, None if it cannot be determined """
+    if isinstance(elem, (int, float, str)):
+        return elem
+    if isinstance(elem, (list, tuple)):
+        canon = tuple(canonical(scope, sub, runtime) for sub in elem)
+        return None if None in canon else canon
+    try:
+        return evaluate(scope, elem, runtime)
+    except NotConstant:
+        pass
+    if isinstance(elem, Constant):
+        return elem.name
+    if isinstance(elem, MathsBlock):
+        try:
+            return scope.resolve_maths(elem, topLevel=False)
+        except (NotImplementedError, KeyError):
+            pass
+    return None
+
+def qubit_keys(scope, reg, index, runtime):
+    """ Keys of the qubits addressed by reg[index] with the matching [register, index] pairs
+
+    :returns: (keys, targets) where targets is None if any index is not known
+    :rtype: tuple
+    """
+    if isinstance(reg, (Alias, InlineAlias)):
+        return [None], None
+    index = canonical(scope, index, runtime)
+    if isinstance(index, int):
+        return [(reg.name, index)], [[reg, index]]
+    if isinstance(index, tuple) and all(isinstance(elem, int) for elem in index):
+        indices = range(index[0], index[1]+1)
+        return [(reg.name, i) for i in indices], [[reg, i] for i in indices]
+    return [(reg.name, "*")], None
+
+def resolve_call(scope, line, runtime, maxQubits=None):
+    """ Resolve a gate call into a GateOp
+
+    :param scope: Block in which line is resolved
+    :param line: CallGate or ApplyMatrix to resolve
+    :param runtime: Names which are only known at run time
+    :param maxQubits: Largest gate for which to compute a matrix
+    :returns: Resolved operation
+    :rtype: GateOp
+    """
+    qargs = line.qargs + line.controls if isinstance(line, ApplyMatrix) else line.qargs
+    qubits, targets = [], []
+    for reg, index in qargs:
+        keys, regTargets = qubit_keys(scope, reg, index, runtime)
+        qubits += keys
+        targets = targets + regTargets if targets is not None and regTargets is not None else None
+
+    signature = tuple((reg.name, canonical(scope, index, runtime)) for reg, index in qargs)
+    if line.loops is not None:
+        signature += (canonical(scope, [line.loops.start, line.loops.end], runtime),)
+        # Iterations must act on distinct qubits for the loops to compare as a whole
+        if any(qubit is None or qubit[1] != "*" for qubit in qubits):
+            signature = None
+    if None in qubits or signature is None or any(index is None for _, index in signature[:len(qargs)]):
+        signature = None
+    if isinstance(line, ApplyMatrix):
+        return GateOp(line, tuple(qubits), targets, signature, None, controlled(line.matrix, line.nControls))
+
+    params = canonical(scope, [*line.pargs, *line.spargs], runtime)
+
+    matrix = None
+    if params is not None and not line.gargs and all(isinstance(param, (int, float)) for param in params):
+        nArgs = len(line.pargs)
+        try:
+            matrix = gate_unitary(line.callee, params[:nArgs], params[nArgs:], maxQubits)
+        except NotUnitary:
+            matrix = None
+    return GateOp(line, tuple(qubits), targets, signature, params, matrix)
@@ -0,0 +1,210 @@
+"""
+Module to compute the unitary matrices of gates whose parameters are known at compile time
+"""
+import numpy as np
+from ..parser.types import (Gate, Opaque, CallGate, Comment, Argument, ApplyMatrix)
+from .constfold import (evaluate, NotConstant)
+
+# Tolerance for numerical comparisons of matrices
+TOLERANCE = 1e-10
+
+# Unitaries already computed, keyed by (gate, pargs, spargs)
+_UNITARIES = {}
+
+class NotUnitary(Exception):
+    """ Raised when the unitary of a gate cannot be determined at compile time """
+
+def rotate_z(angle):
+    """ Matrix of QuEST rotateZ """
+    return np.array([[np.exp(-0.5j*angle), 0], [0, np.exp(0.5j*angle)]])
+
+def rotate_x(angle):
+    """ Matrix of QuEST rotateX """
+    cos, sin = np.cos(angle/2), np.sin(angle/2)
+    return np.array([[cos, -1j*sin], [-1j*sin, cos]])
+
+def core_unitary(theta, phi, lamda):
+    """ Matrix of the core U gate as implemented by the backends (Rz(lambda), Rx(theta) then Rz(phi)) """
+    return rotate_z(phi) @ rotate_x(theta) @ rotate_z(lamda)
+
+# Control is qubit 0 (least significant), target qubit 1
+CX_MATRIX = np.array([[1, 0, 0, 0],
+                      [0, 0, 0, 1],
+                      [0, 0, 1, 0],
+                      [0, 1, 0, 0]], dtype=complex)
+
+def core_angles(matrix, exact=False):
+    """ Decompose a single qubit unitary into the parameters of the core U gate
+
+    :param matrix: 2x2 unitary to decompose
+    :param exact: Whether the global phase must also be reproduced
+    :returns: (theta, phi, lambda) such that U(theta, phi, lambda) reproduces matrix
+    :rtype: tuple
+    :raises NotUnitary: If exact and the global phase cannot be expressed by U
+    """
+    special = matrix / np.sqrt(np.linalg.det(matrix))
+    theta = 2*np.arctan2(abs(special[1, 0]), abs(special[0, 0]))
+    plus = 2*np.angle(special[1, 1]) if abs(special[1, 1]) > TOLERANCE else 0.
+    minus = 2*np.angle(1j*special[1, 0]) if abs(special[1, 0]) > TOLERANCE else 0.
+    phi, lamda = (plus + minus)/2, (plus - minus)/2
+
+    phase = phase_of(matrix, core_unitary(theta, phi, lamda))
+    if abs(phase) > TOLERANCE:
+        # U is special unitary, so only a sign can be absorbed (by a 2 pi shift in phi)
+        if abs(abs(phase) - np.pi) < TOLERANCE:
+            phi += 2*np.pi
+        elif exact:
+            raise NotUnitary("Global phase")
+    return tuple(_tidy(angle) for angle in (theta, phi, lamda))
+
+def _tidy(angle):
+    """ Snap numerical noise to zero for readable output """
+    angle = float(angle)
+    return 0 if abs(angle) < TOLERANCE else angle
+
+def phase_of(matrix, reference):
+    """ Global phase such that matrix = exp(i phase) reference
+
+    :returns: Phase in (-pi, pi] or None if the matrices differ by more than a phase
+    """
+    index = np.unravel_index(np.argmax(abs(reference)), reference.shape)
+    phase = np.angle(matrix[index] / reference[index])
+    if not np.allclose(matrix, np.exp(1j*phase)*reference, atol=TOLERANCE):
+        return None
+    return phase
+
+def is_identity(matrix, exact=False):
+    """ Check whether matrix is the identity (up to global phase unless exact) """
+    identity = np.eye(len(matrix))
+    if exact:
+        return np.allclose(matrix, identity, atol=TOLERANCE)
+    return phase_of(matrix, identity) is not None
+
+def apply(operator, matrix, qubits, nQubits):
+    """ Left-multiply operator by matrix acting on the listed qubits of an nQubits space
+
+    Qubit ordering follows QuEST: qubits[0] is the least significant bit of matrix
+
+    :param operator: (2**nQubits, m) array to act on
+    :param matrix: (2**k, 2**k) array to apply
+    :param qubits: Indices in the nQubits space of the k qubits matrix acts on
+    :param nQubits: Number of qubits in the space of operator
+    :returns: matrix (embedded) @ operator
+    :rtype: numpy.ndarray
+    """
+    nTargets = len(qubits)
+    tensor = operator.reshape([2]*nQubits + [-1])
+    axes = [nQubits - 1 - qubit for qubit in reversed(qubits)]
+    tensor = np.tensordot(matrix.reshape([2]*(2*nTargets)), tensor, axes=(list(range(nTargets, 2*nTargets)), axes))
+    tensor = np.moveaxis(tensor, list(range(nTargets)), axes)
+    return tensor.reshape(2**nQubits, -1)
+
+def embed(matrix, qubits, nQubits):
+    """ Full matrix of matrix acting on qubits within an nQubits space """
+    return apply(np.eye(2**nQubits, dtype=complex), matrix, qubits, nQubits)
+
+def controlled(matrix, nControls):
+    """ Unitary of matrix controlled on nControls qubits placed after (more significant than) its targets """
+    if not nControls:
+        return matrix
+    size = len(matrix)
+    full = np.eye(size * 2**nControls, dtype=complex)
+    full[-size:, -size:] = matrix
+    return full
+
+def gate_unitary(gate: Gate, pargs=(), spargs=(), maxQubits=None):
+    """ Compute the unitary of a gate with known parameters by expanding its body down to the core gates
+
+    :param gate: Gate to compute
+    :param pargs: Numerical values of the parameter arguments
+    :param spargs: Numerical values of the special arguments
+    :param maxQubits: Largest number of qubits to compute for (None for no limit)
+    :returns: Matrix with the first qarg as the least significant qubit
+    :rtype: numpy.ndarray
+    :raises NotUnitary: If gate cannot be expanded to a matrix at compile time
+
+    Results are cached per (gate, parameter values) and shared between callers so must not be modified in place
+    """
+    return _gate_unitary(gate, tuple(pargs), tuple(spargs), maxQubits, set())
+
+def clear_cache():
+    """ Forget all previously computed unitaries """
+    _UNITARIES.clear()
+
+def _gate_unitary(gate, pargs, spargs, maxQubits, stack):
+    """ Recursive worker for gate_unitary, stack holds the gates currently being expanded """
+    key = (gate, pargs, spargs)
+    if key in _UNITARIES:
+        matrix = _UNITARIES[key]
+        if maxQubits is not None and len(matrix) > 2**maxQubits:
+            raise NotUnitary(gate.name)
+        return matrix
+    matrix = _expand_unitary(gate, pargs, spargs, maxQubits, stack)
+    matrix.flags.writeable = False
+    _UNITARIES[key] = matrix
+    return matrix
+
+def _expand_unitary(gate, pargs, spargs, maxQubits, stack):
+    """ Compute the unitary of gate from its definition """
+    if gate.name == "U":
+        return core_unitary(*pargs)
+    if gate.name == "_inv_U":
+        return core_unitary(*pargs).conj().T
+    if gate.name == "CX":
+        return CX_MATRIX
+    if isinstance(gate, Gate) and gate.inverseOf is not None:
+        # Inverse is the adjoint, no need to expand the rewritten body
+        return _gate_unitary(gate.inverseOf, pargs, spargs, maxQubits, stack).conj().T
+    if isinstance(gate, Opaque) or not gate.unitary or gate.gargs or id(gate) in stack:
+        raise NotUnitary(gate.name)
+
+    bindings = {arg.name: float(val) for arg, val in zip(gate.pargs, pargs)}
+    bindings.update({arg.name: int(val) for arg, val in zip(gate.spargs, spargs)})
+
+    # Lay out arguments in order
+    offsets = {}
+    nQubits = 0
+    for arg in gate.qargs:
+        size = arg.size
+        if not isinstance(size, int):
+            try:
+                size = int(evaluate(gate, size, bindings=bindings))
+            except NotConstant:
+                raise NotUnitary(gate.name)
+        offsets[arg.name] = nQubits
+        nQubits += size
+    if maxQubits is not None and nQubits > maxQubits:
+        raise NotUnitary(gate.name)
+
+    value = lambda elem: evaluate(gate, elem, bindings=bindings)
+    stack.add(id(gate))
+    operator = np.eye(2**nQubits, dtype=complex)
+    try:
+        for line in gate.code:
+            if isinstance(line, Comment):
+                continue
+            if not isinstance(line, ApplyMatrix) and (not isinstance(line, CallGate) or line.loops is not None
+                                                      or line.byprod or line.gargs):
+                raise NotUnitary(gate.name)
+            qubits = []
+            for reg, index in line.qargs + (line.controls if isinstance(line, ApplyMatrix) else []):
+                if not isinstance(reg, Argument) or reg.name not in offsets:
+                    raise NotUnitary(gate.name)
+                if isinstance(index, tuple):
+                    start, end = map(value, index)
+                    qubits += [offsets[reg.name] + i for i in range(int(start), int(end)+1)]
+                else:
+                    qubits.append(offsets[reg.name] + int(value(index)))
+            if isinstance(line, ApplyMatrix):
+                matrix = controlled(line.matrix, line.nControls)
+            else:
+                matrix = _gate_unitary(line.callee,
+                                       tuple(value(parg) for parg in line.pargs),
+                                       tuple(value(sparg) for sparg in line.spargs),
+                                       None, stack)
+            operator = apply(operator, matrix, qubits, nQubits)
+    except (NotConstant, TypeError, ValueError):
+        raise NotUnitary(gate.name)
+    finally:
+        stack.discard(id(gate))
+    return operator
@@ -37,6 +37,8 @@ rangeToIndexWarning = "Passed range specifier to index"
 badDirectiveWarning = "Unrecognised directive: {}"
 argWarning = "Bad argument list in {} expected {}, received {}"
 redefClassLangWarning = "Classical language already defined as {}"
+redefOptimiseWarning = "Optimisation level already set to {}"
+badOptimiseWarning = "Unrecognised optimisation level {}, expected 0 to {}"
 inlineOpaqueWarning = "Cannot set opaque by inline directive"
 dupWarning = "{Name} is already declared as a {Type}"
 existWarning = "{Type} {Name} has not been declared"
@@ -21,6 +21,7 @@ class ProgFile(CodeBlock):
     def __init__(self, filename):
         self.filename = filename
         self.classLang = None
+        self.optimiseLevel = None
         CodeBlock.__init__(self, self, QASMFile(filename), False)
         self._name = "<main>"
         for gate in Gate.internalGates.values():
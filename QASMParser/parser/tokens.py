@@ -87,12 +87,12 @@ class Binary(MathOp):
                 outStr += f"{op} "
             if isinstance(elem, ParseResults):
                 outStr += f'{elem["var"]} '
-            elif hasattr(elem, "dump"):
-                outStr += elem.dump()
+            elif hasattr(elem, "dump"): # Bracket nested operations to preserve precedence
+                outStr += f"({elem.dump()}) "
             elif isinstance(elem, (tuple, list)):
                 for subElem in elem:
                     if hasattr(subElem, "dump"):
-                        outStr += subElem.dump()
+                        outStr += f"({subElem.dump()}) "
                     else:
                         outStr += f"{subElem} "
             else:
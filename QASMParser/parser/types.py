@@ -5,7 +5,9 @@ Main module for tokenising parsed files
 import re
 import copy
 import sys
+import math
 from abc import ABC
+from contextvars import ContextVar
 from collections import Iterable
 
 from pyparsing import (ParseResults)
@@ -19,7 +21,7 @@ from .errors import (argWarning, langWarning, badMappingWarning,
                      rangeToIndexWarning, gateDeclareWarning, freeWarning,
                      badConstantWarning, recursiveGateWarning, targetModifyWarning,
                      inlineAliasLoopWarning, targetUniqueWarning, recursiveDefWarning,
-                     possibleMismatchWarning)
+                     possibleMismatchWarning, redefOptimiseWarning, badOptimiseWarning)
 from .tokens import (MathOp, Binary, Function, mathsParser)
 from .filehandle import (QASMBlock, NullBlock)
 
@@ -27,6 +29,14 @@ isInt = re.compile(r"[+-]?(\d+)(?:[eE][+-]?\d+)?")
 isReal = re.compile(r"[+-]?(\d*\.\d+|\d+\.\d*)(?:[eE][+-]?\d+)?")
 isBitStr = re.compile(r"[01]+b$")
 
+# Highest level accepted by the optimise directive
+MAX_OPTIMISE_LEVEL = 3
+
+# Names which may be evaluated when resolving maths to a value
+mathsNamespace = {"pi": math.pi, "sin": math.sin, "cos": math.cos, "tan": math.tan, "sqrt": math.sqrt,
+                  "exp": math.exp, "ln": math.log, "acos": math.acos, "asin": math.asin, "atan": math.atan,
+                  "abs": abs}
+
 def unique(listCheck):
     """ Check that all elements of list are unique
         https://stackoverflow.com/a/5281641"""
@@ -99,6 +109,16 @@ def to_lang_error(self):
     print("Not implemented:", langWarning.format(type(self).__name__))
     sys.exit(1)
 
+# Backend translating code in the current context (thread), set while an output language is written
+activeBackend = ContextVar("activeBackend", default=None)
+
+def to_lang_dispatch(self):
+    """ Translate into the language of the active backend """
+    backend = activeBackend.get()
+    if backend is None:
+        return to_lang_error(self)
+    return backend.translate(self)
+
 
 class CoreOp(ABC):
     """ Abstract base class for QASM operations """
@@ -127,7 +147,7 @@ class CoreOp(ABC):
     trueType = property(lambda self: self._trueType)
     name = property(lambda self: self._name)
     parent = property(lambda self: self._parent)
-    to_lang = to_lang_error
+    to_lang = to_lang_dispatch
 
 # Base types
 
@@ -200,7 +220,7 @@ class Operation(CoreOp, ABC):
             # print(inlineAliasLoopWarning)
             return
 
-        baseStart, baseEnd = pargs[0][1]
+        baseStart, baseEnd = pargs[0][1][:2]
         loopable = baseStart != baseEnd
 
         if loopable:
@@ -211,7 +231,7 @@ class Operation(CoreOp, ABC):
 
         if loopVar:
             for parg in pargs:
-                pargStart, _ = parg[1]
+                pargStart = parg[1][0]
                 if pargStart - baseStart:
                     parg[1] = loopVar + f" + {pargStart - baseStart}"
                 else:
@@ -575,10 +595,14 @@ class CodeBlock(CoreOp, ABC):
         if isinstance(elem, MathsBlock):
             for point in elem.maths:
                 outStr += recurse(point)
+            if not topLevel: # Preserve precedence of nested blocks
+                outStr = f"({outStr})"
         elif isinstance(elem, (float, int)):
             outStr += str(elem)
         elif isinstance(elem, Constant):
-            if not hasattr(elem, "sparg"):
+            if elem.val is None: # Language constant, e.g. pi
+                outStr += elem.name
+            elif not hasattr(elem, "sparg"):
                 outStr += recurse(elem.val)
             else:
                 outStr += elem.name
@@ -606,9 +630,8 @@ class CodeBlock(CoreOp, ABC):
                 else:
                     raise NotImplementedError(operator)
         elif isinstance(elem, Function):
-            elem = elem.op
             args = (recurse(arg) for arg in elem.args)
-            outStr += "{}({})".format(elem, ", ".join(args))
+            outStr += "{}({})".format(subOp.get(elem.op, elem.op), ", ".join(args))
 
         elif isinstance(elem, ParseResults):
             var = self.resolve(elem, argType="Constant")
@@ -626,7 +649,7 @@ class CodeBlock(CoreOp, ABC):
 
         if topLevel:
             try:
-                return eval(str(outStr))
+                return eval(str(outStr), copy.copy(mathsNamespace))
             except ValueError:
                 self._error(mathsEvalWarning.format(outStr))
             except NameError:
@@ -891,14 +914,14 @@ class CodeBlock(CoreOp, ABC):
         :param modifiers: Modifiers on call such as invert and control
 
         """
-        if gateName == self.name: # Recursive
-            if self.canRecurse:
-                self._gate(self.name, NullBlock(self.currentFile),
-                           self.pargs, self.qargs, self.spargs, self.gargs,
-                           recursive=False, unitary=self.unitary, argType="circuit")
-                self.recursive = True
+        enclosing = self
+        while isinstance(enclosing, SubBlock):
+            enclosing = enclosing.parent
+        if isinstance(enclosing, Gate) and gateName == enclosing.name: # Recursive
+            if enclosing.canRecurse:
+                enclosing.recursive = True
             else:
-                self._error(f"Attempted to recurse non-recursive gate type {self.trueType}")
+                self._error(f"Attempted to recurse non-recursive gate type {enclosing.trueType}")
 
         self._is_def(gateName, create=False, argType="Gate")
 
@@ -1074,6 +1097,16 @@ class CodeBlock(CoreOp, ABC):
                 self._error(redefClassLangWarning.format(self.classLang))
 
             self.classLang = args.strip('"\'')
+        elif directive in ["optimise", "optimize"]:
+            if type(self).__name__ != "ProgFile":
+                self._error(failedOpWarning.format("set optimisation level", self.trueType))
+            elif self.optimiseLevel is not None:
+                self._error(redefOptimiseWarning.format(self.optimiseLevel))
+
+            level = args.strip().lstrip("-").lstrip("Oo")
+            if not level.isdigit() or int(level) > MAX_OPTIMISE_LEVEL:
+                self._error(badOptimiseWarning.format(args.strip(), MAX_OPTIMISE_LEVEL))
+            self.optimiseLevel = int(level)
         elif directive == "classical":
             if block:
                 self.classical_block(block)
@@ -1571,6 +1604,8 @@ class QuantumRegister(Register):
     """
     numQubits = 0
     numGateQubits = 0
+    # Size of the state once qubits share physical indices, None if every qubit has its own
+    numPhysicalQubits = None
 
     def __init__(self, parent, name, inter):
         """Initialise a quantum register
@@ -1609,6 +1644,7 @@ class DeferredQuantumRegister(QuantumRegister):
         """
         Register.__init__(self, parent, name, inter)
         self._nQubitsUsed = nQubitsUsed
+        self._mapping = None
         self._argType = "QuantumRegister"
         QuantumRegister.numGateQubits = max(self.end - QuantumRegister.numQubits,
                                             QuantumRegister.numGateQubits)
@@ -1616,7 +1652,17 @@ class DeferredQuantumRegister(QuantumRegister):
     nQubitsUsed = property(lambda self: self._nQubitsUsed)
     start = property(lambda self: self._start + QuantumRegister.numQubits + self.nQubitsUsed)
     end = property(lambda self: self._end + QuantumRegister.numQubits + self.nQubitsUsed)
-    mapping = property(lambda self: tuple(range(self.start, self.end)))
+
+    @property
+    def mapping(self):
+        """ Return the labels of the qubits in the register, placed after the main qubits unless set explicitly """
+        if self._mapping is None:
+            return tuple(range(self.start, self.end))
+        return self._mapping
+
+    @mapping.setter
+    def mapping(self, val):
+        QuantumRegister.mapping.fset(self, val)
 
 class ClassicalRegister(Register):
     """
@@ -1652,6 +1698,16 @@ class DeferredClassicalRegister(ClassicalRegister):
         ClassicalRegister.__init__(self, parent, name, size)
         self._end -= 1
 
+class LocalClassicalRegister(ClassicalRegister):
+    """
+    Classical register of fixed size local to a gate which is never returned or reassigned,
+    so may live on the stack
+
+    :param parent: Parent block defining object
+    :param name: Reference name of the object
+    :param size: Size of register to initialise
+    """
+
 class Targets(list):
     """ Type to protect alias targets """
     def __getitem__(self, item):
@@ -1832,15 +1888,25 @@ class Gate(Referencable, CodeBlock):
 
         self._inverse = None
         self._control = None
+        self._inverseOf = None
+        self._controlOf = None
 
         self.canRecurse = recursive
         self.recursive = False
+        self.byprod = None
+        # Arguments reassigned when a tail call is made into a loop
+        self.reboundArgs = set()
 
         self.spargs = spargs
         self.qargs = qargs
         self.pargs = pargs
         self.gargs = gargs
 
+        # Allow the body to call the gate being defined
+        if recursive:
+            self._argType = "Gate"
+            self._objs[name] = self
+
         self.parse_instructions()
 
         # Free vars
@@ -1867,6 +1933,9 @@ class Gate(Referencable, CodeBlock):
         if returnType is not None:
             self.returnType = returnType
 
+    inverseOf = property(lambda self: self._inverseOf)
+    controlOf = property(lambda self: self._controlOf)
+
     def invert(self, parent):
         """Calculates the inverse of the gate and called gates and assigns it to self._inverse """
         if not self.unitary:
@@ -1883,17 +1952,22 @@ class Gate(Referencable, CodeBlock):
             if isinstance(line, CallGate):
                 line = copy.copy(line)
                 gateName = line.name
-                if parent._check_def("_inv_"+gateName, create=True, argType="Gate"):
-                    gate = parent.resolve(gateName, argType="Gate")
+                gate = parent.resolve(gateName, argType="Gate")
+                if gate.invert is gate: # Self-inverse
+                    invGate = gate
+                elif parent._check_def("_inv_"+gateName, create=True, argType="Gate"):
                     invGate = gate.invert(parent)
-                    self._objs[invGate.name] = invGate
-                line.qargs[0][1] = (0, 0)
-                inverse._code += [CallGate(self, "_inv_"+gateName,
-                                           line.pargs, line.qargs, line.gargs, line.spargs, line.byprod)]
+                else:
+                    invGate = parent.resolve("_inv_"+gateName, argType="Gate")
+                self._objs[invGate.name] = invGate
+                qargs = [[reg, index if isinstance(index, tuple) else (index, index)] for reg, index in line.qargs]
+                inverse._code += [CallGate(self, invGate.name,
+                                           line.pargs, qargs, line.gargs, line.spargs, line.byprod)]
 
             else:
                 self._error(failedOpWarning.format("invert "+line.name, self.name + " invert"))
 
+        inverse._inverseOf = self
         self._inverse = inverse
         parent._code += [inverse]
         parent._objs[inverse.name] = inverse
@@ -1929,9 +2003,12 @@ class Gate(Referencable, CodeBlock):
                 if parent._check_def("_ctrl_"+gateName, create=True, argType="Gate"):
                     gate = parent.resolve(gateName, argType="Gate")
                     ctrlGate = gate.control_gate(parent)
-                    self._objs[ctrlGate.name] = ctrlGate
-                line._qargs[0][1] = (0, 0)
-                line._qargs = [[ctrlArg, (0, nCtrlsArg)], *line.qargs]
+                else:
+                    ctrlGate = parent.resolve("_ctrl_"+gateName, argType="Gate")
+                self._objs[ctrlGate.name] = ctrlGate
+                line._qargs = [[ctrlArg, (0, nCtrlsArg)],
+                               *([reg, index if isinstance(index, tuple) else (index, index)]
+                                 for reg, index in line.qargs)]
                 line._spargs = [nCtrlsArg, *line.spargs]
                 control._code += [CallGate(control, "_ctrl_"+gateName,
                                            line.pargs, line.qargs, line.gargs, line.spargs, line.byprod)]
@@ -1939,6 +2016,7 @@ class Gate(Referencable, CodeBlock):
             else:
                 self._error(failedOpWarning.format("control "+line.name, self.name + " control"))
 
+        control._controlOf = self
         self._control = control
         parent._code += [control]
         parent._objs[control.name] = control
@@ -2021,6 +2099,7 @@ class Circuit(Gate):
         self._is_def(argName, create=True)
         variable = DeferredClassicalRegister(self, argName, size)
         self._objs[argName] = variable
+        self._code += [variable]
 
     def _qreg(self, argName, size):
         self._is_def(argName, create=True)
@@ -2104,8 +2183,6 @@ class Comment(CoreOp):
         self._name = comment
         self.comment = comment
 
-    to_lang = to_lang_error
-
 class Let(CoreOp):
     """ Set a variable """
     def __init__(self, parent, var, val=None):
@@ -2258,7 +2335,7 @@ class CallGate(Operation):
             Operation.handle_loops(self, pargs)
         elif self.nLoops < 2:
             for parg in pargs:
-                pargStart, pargEnd = parg[1]
+                pargStart, pargEnd = parg[1][:2]
                 if pargStart == pargEnd:
                     parg[1] = pargStart
                 else:
@@ -2339,6 +2416,38 @@ class Dealloc(Operation):
     def __init__(self, parent, targ):
         Operation.__init__(self, parent, pargs=targ)
 
+class ApplyMatrix(Operation):
+    """ Apply a unitary computed at compile time
+
+    :param parent: Parent block defining object
+    :param matrix: Dense unitary matrix with the first qarg as the least significant qubit
+    :param qargs: Target qubits as [register, index] pairs
+    :param literal: MatrixLiteral declaring matrix if it is shared
+    :param controls: Control qubits as [register, index] pairs
+    """
+    def __init__(self, parent, matrix, qargs, literal=None, controls=()):
+        Operation.__init__(self, parent, qargs)
+        self.matrix = matrix
+        self.literal = literal
+        self.controls = list(controls)
+
+    nQubits = property(lambda self: len(self.qargs))
+    nControls = property(lambda self: len(self.controls))
+
+class MatrixLiteral(CoreOp):
+    """ Unitary computed at compile time and declared once to be shared by every ApplyMatrix using it
+
+    :param parent: Parent block defining object
+    :param name: Name of the declared matrix
+    :param matrix: Dense unitary matrix with the first qarg as the least significant qubit
+    """
+    def __init__(self, parent, name, matrix):
+        CoreOp.__init__(self, parent)
+        self._name = name
+        self.matrix = matrix
+
+    nQubits = property(lambda self: len(self.matrix).bit_length() - 1)
+
 class CBlock(CoreOp):
     """ Classical block """
     def __init__(self, parent, block):
@@ -2385,6 +2494,8 @@ class Loop(SubBlock):
         self.targetID = None
         self.finish = False
         self.cycle = False
+        # Variables stepped alongside the loop variable, which end with it so need no test of their own
+        self.induction = []
 
         if not isinstance(var, (list, tuple)):
             var = [var]
@@ -2415,6 +2526,7 @@ class NestLoop(Loop):
     def __init__(self, block, var, start, end, step=1):
         self._code = [block]
         self.depth = 1
+        self.induction = []
         if not isinstance(var, (list, tuple)):
             var = [var]
         if not isinstance(start, (list, tuple)):
@@ -2481,6 +2593,8 @@ class Next:
     def __init__(self, parentID):
         self.parentID = parentID
 
+    to_lang = to_lang_dispatch
+
 
 class Cycle(LoopOp):
     """ Jump to end of loop """
@@ -2494,6 +2608,8 @@ class CycleTarget:
     def __init__(self, targetID):
         self.targetID = targetID
 
+    to_lang = to_lang_dispatch
+
 
 class Finish(LoopOp):
     """ Break out of loop """
@@ -2506,8 +2622,48 @@ class FinishTarget:
     def __init__(self, targetID):
         self.targetID = targetID
 
+    to_lang = to_lang_dispatch
+
 class TheEnd(CoreOp):
     """ Class to end the process """
     def __init__(self, parent, var=None):
         CoreOp.__init__(self, parent)
         self.var = var
+
+class TailCall(CoreOp):
+    """ Rebind the arguments of the enclosing gate to those of a call to itself and restart its body
+
+    :param parent: Gate whose body is restarted
+    :param call: Self-call whose arguments are bound
+    """
+    def __init__(self, parent, call):
+        CoreOp.__init__(self, parent)
+        self.call = call
+
+class SampleShots(CoreOp):
+    """ Sample the terminal measurements of a program many times from a single simulation and print a histogram
+
+    :param parent: Program whose state is sampled
+    :param qargs: Measured qubits as [register, index] pairs in the order their bits are output
+    :param shots: Number of shots to sample
+    """
+    def __init__(self, parent, qargs, shots):
+        CoreOp.__init__(self, parent)
+        self._qargs = qargs
+        self.shots = shots
+
+    qargs = property(lambda self: self._qargs)
+
+class BatchReset(CoreOp):
+    """ Reset several qubits to the zero state in a single operation
+
+    :param parent: Parent block defining object
+    :param qargs: Qubits to reset as [register, index] pairs, where an index may be an inclusive (start, end) range
+    :param whole: Whether every qubit of the state which may be non-zero is reset, so it may be reinitialised
+    """
+    def __init__(self, parent, qargs, whole=False):
+        CoreOp.__init__(self, parent)
+        self._qargs = qargs
+        self.whole = whole
+
+    qargs = property(lambda self: self._qargs)
@@ -6,10 +6,30 @@ from QASMParser.parser.parser import (ProgFile)
 from QASMParser.parser.coregates import setup_QASM_gates
 from QASMParser.parser.types import (QuantumRegister)
 from QASMParser.codegraph.partitioning import (partition)
+from QASMParser.codegraph.scheduler import (Scheduler)
+from QASMParser.optimise.fingerprint import (fingerprint)
 from .cli import get_command_args
 from .printer import (to_lang)
+from .passes import (PassManager)
+from .cache import (CodeCache)
 from .errors import (noSpecWarning)
 
+def requested_passes(argList):
+    """ Passes requested explicitly on the command line and their arguments
+
+    :param argList: Parsed command line arguments
+    :returns: Argument of each pass requested by name, None for passes taking no argument
+    :rtype: dict
+    """
+    flags = ["fold_constants", "specialise", "light_cone", "prune_qubits", "peephole", "native_control",
+             "reuse_qubits", "optimise_resets", "coalesce_sets", "optimise_loops"]
+    counts = ["precompute", "fuse", "ranks", "shots", "code_size"]
+    requested = {flag.replace("_", "-"): None for flag in flags if getattr(argList, flag)}
+    requested.update({count.replace("_", "-"): getattr(argList, count) for count in counts if getattr(argList, count)})
+    if argList.eliminate_recursion is not None:
+        requested["eliminate-recursion"] = argList.eliminate_recursion
+    return requested
+
 def main():
     """ Run main program """
     argList = get_command_args()
@@ -24,6 +44,14 @@ def main():
         print(source)
         myProg = ProgFile(source)
 
+        if argList.fingerprint:
+            print(f"Fingerprint: {fingerprint(myProg)}")
+        level = argList.optimise if myProg.optimiseLevel is None else myProg.optimiseLevel
+        passManager = PassManager(level, requested_passes(argList), partition=bool(argList.partition))
+        passReport = passManager.run(myProg)
+        if passReport.records:
+            print(passReport)
+
         if argList.print or argList.entanglement:
             codeGraph = CodeGraph(myProg, QuantumRegister.numQubits)
             if argList.print:
@@ -35,16 +63,19 @@ def main():
 
         if  any((argList.analyse, argList.dummy_partition)):
 
+            if argList.analyse:
+                print(Scheduler(myProg, QuantumRegister.numQubits, argList.max_depth).schedule)
+
             if argList.dummy_partition:
                 partition(myProg, argList.partition, argList.max_depth, dummy=True)
 
         else:
             lang = None
             if argList.language:
-                lang = argList.language
+                lang = argList.language.split(",")
             elif argList.output.endswith('.py'):
                 lang = "Python"
-            elif argList.output.endswith('.c'):
+            elif argList.output.endswith('.c') or argList.split:
                 lang = "C"
             elif not argList.output:
                 raise IOError(noSpecWarning)
@@ -57,12 +88,20 @@ def main():
             else:
                 outputFile = None
 
+            cache = CodeCache(argList.cache) if argList.cache and not argList.debug else None
+
             partition(myProg, argList.partition, argList.max_depth)
             to_lang(myProg, outputFile, lang,
                     include_internals=argList.include_internals,
                     includes=argList.include,
                     module=argList.to_module,
-                    verbose=argList.debug)
+                    verbose=argList.debug,
+                    threads=argList.threads,
+                    cache=cache,
+                    split=argList.split)
+
+            if cache is not None:
+                print(cache.report)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,81 @@
+"""
+Module to dispatch the translation of each node of the code to the functions of an output language
+"""
+from importlib import import_module
+from contextlib import contextmanager
+
+from QASMParser.parser.types import (Gate, activeBackend, to_lang_error)
+
+from .errors import (langNotDefWarning)
+
+class Backend:
+    """ Translator of code into one output language
+
+    Each language module in QASMToQuEST/langs supplies to_lang_table, mapping the classes of the code to the
+    functions translating them. The function used for a class is the entry of the nearest class of its MRO, looked
+    up once per class and cached. Nodes call the backend active in their context (thread) through their to_lang, so
+    several backends may translate the same code one after another or in separate threads.
+
+    :param langOut: Name of the language module
+    """
+    def __init__(self, langOut):
+        try:
+            self.lang = import_module(f"QASMToQuEST.langs.{langOut}")
+        except ImportError:
+            raise NotImplementedError(langNotDefWarning.format(langOut))
+        self.name = langOut
+        self._toLang = self.lang.to_lang_table()
+        self._children = self.lang.children_table() if hasattr(self.lang, "children_table") else {}
+        self._coreCode = self.lang.core_gate_code()
+        self._declare = self.lang.declaration_table() if hasattr(self.lang, "declaration_table") else None
+        self._cache = {}
+        self.useTN = False
+
+    def use_tn(self):
+        """ Switch to the translations for tensor network simulation """
+        if hasattr(self.lang, "tn_table"):
+            self._toLang.update(self.lang.tn_table())
+        self._cache = {}
+        self.useTN = True
+
+    def method(self, cls):
+        """ Function translating nodes of class cls
+
+        :param cls: Class of the node
+        :returns: Function taking the node and returning its translation
+        """
+        try:
+            return self._cache[cls]
+        except KeyError:
+            pass
+        method = next((self._toLang[base] for base in cls.__mro__ if base in self._toLang), to_lang_error)
+        self._cache[cls] = method
+        return method
+
+    def translate(self, node):
+        """ Translation of a single node (not including its children) """
+        return self.method(type(node))(node)
+
+    splittable = property(lambda self: self._declare is not None)
+
+    def declare(self, node):
+        """ Declaration of a node defined at file scope, for a header shared between translation units """
+        return next(self._declare[base] for base in type(node).__mro__ if base in self._declare)(node)
+
+    def code_of(self, node):
+        """ Children of node as they are written in this language """
+        if isinstance(node, Gate) and Gate.internalGates.get(node.name) is node and node.name in self._coreCode:
+            return self._coreCode[node.name]
+        for base in type(node).__mro__:
+            if base in self._children:
+                return self._children[base](node)
+        return node.code
+
+    @contextmanager
+    def active(self):
+        """ Make this the backend used by to_lang in the current context """
+        token = activeBackend.set(self)
+        try:
+            yield self
+        finally:
+            activeBackend.reset(token)
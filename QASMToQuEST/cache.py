@@ -0,0 +1,109 @@
+"""
+Module to reuse the translations of circuit definitions which are unchanged since a previous run
+"""
+import hashlib
+import os
+import tempfile
+import threading
+
+from QASMParser.parser.types import (Gate, Opaque)
+from QASMParser.optimise.fingerprint import (Fingerprinter)
+
+class CodeCacheReport:
+    """ Count of circuit definitions reused from the cache and translated afresh """
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    total = property(lambda self: self.hits + self.misses)
+
+    def __str__(self):
+        return (f"Codegen cache: {self.hits} of {self.total} circuit definitions reused, "
+                f"{self.misses} translated, in {self.directory}")
+
+class CodeCache:
+    """ Store on disk of the translated text of circuit definitions
+
+    Each definition is keyed by a structural hash of its arguments and body (see Fingerprinter with canonical False),
+    which includes the hashes of the circuits it calls, together with the output language, the depth it is written
+    at and the source of the translator, so that a fragment is reused only where it would be written identically.
+    Core and opaque gates are always translated.
+
+    :param directory: Directory holding the fragments, created if needed
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.report = CodeCacheReport(directory)
+        self._fingerprinters = {}
+        self._sources = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cacheable(gate):
+        """ Whether the translation of gate may be cached """
+        return not isinstance(gate, Opaque) and Gate.internalGates.get(gate.name) is not gate
+
+    def key(self, codeObj, gate, backend, depth):
+        """ Key of the translation of gate
+
+        :param codeObj: ProgFile being translated
+        :param gate: Definition to translate
+        :param backend: Backend translating it
+        :param depth: Depth of indentation of the definition
+        :returns: Hex digest naming the fragment
+        :rtype: str
+        """
+        with self._lock:
+            if id(codeObj) not in self._fingerprinters:
+                self._fingerprinters[id(codeObj)] = (codeObj, Fingerprinter(codeObj, canonical=False))
+            body = self._fingerprinters[id(codeObj)][1].gate(gate)
+            source = self.source(backend)
+        hasher = hashlib.sha256()
+        hasher.update(repr((backend.name, backend.useTN, depth, source, body)).encode())
+        return hasher.hexdigest()
+
+    def source(self, backend):
+        """ Hash of the source of the translator of backend, so that changes to it invalidate the cache """
+        if backend.name not in self._sources:
+            hasher = hashlib.sha256()
+            for module in (backend.lang.__file__, __file__,
+                           os.path.join(os.path.dirname(__file__), "printer.py"),
+                           os.path.join(os.path.dirname(__file__), "backend.py")):
+                with open(module, "rb") as sourceFile:
+                    hasher.update(sourceFile.read())
+            self._sources[backend.name] = hasher.hexdigest()
+        return self._sources[backend.name]
+
+    def fetch(self, codeObj, gate, backend, depth, translate):
+        """ Translation of gate, from the cache if present, else from translate which is then stored
+
+        :param codeObj: ProgFile being translated
+        :param gate: Definition to translate
+        :param backend: Backend translating it
+        :param depth: Depth of indentation of the definition
+        :param translate: Function of no arguments returning the translation of gate
+        :returns: Text of the translated definition
+        :rtype: str
+        """
+        path = os.path.join(self.directory, self.key(codeObj, gate, backend, depth) + backend.lang.EXTENSION)
+        try:
+            with open(path) as fragment:
+                text = fragment.read()
+        except FileNotFoundError:
+            pass
+        else:
+            with self._lock:
+                self.report.hits += 1
+            return text
+
+        text = translate()
+        # Write to a temporary file first so that a concurrent or interrupted run never reads a partial fragment
+        handle, tmpPath = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(handle, "w") as fragment:
+            fragment.write(text)
+        os.replace(tmpPath, path)
+        with self._lock:
+            self.report.misses += 1
+        return text
@@ -2,6 +2,9 @@
 Module to handle command line interface options for QASM transpiler
 """
 import argparse
+import os
+from QASMParser.parser.types import (MAX_OPTIMISE_LEVEL)
+from .errors import (ranksWarning)
 
 # SmartFormatter taken from StackOverflow
 class SmartFormatter(argparse.HelpFormatter):
@@ -22,17 +25,31 @@ class StoreDictKeyPair(argparse.Action):
             newDict[key] = value
         setattr(namespace, self.dest, newDict)
 
+def ranks(value):
+    """ Number of ranks given on the command line, which must be a power of two
+
+    :raises argparse.ArgumentTypeError: If value is not a power of two
+    """
+    try:
+        nRanks = int(value)
+    except ValueError:
+        nRanks = 0
+    if nRanks < 1 or nRanks & (nRanks - 1):
+        raise argparse.ArgumentTypeError(ranksWarning.format(value))
+    return nRanks
+
 _parser = argparse.ArgumentParser(description='QASM parser to translate from QASM to QuEST input',
                                   add_help=True, formatter_class=SmartFormatter)
 _parser.add_argument('sources', nargs="+", help="List of sources to compile")
 _parser.add_argument('-o', '--output', help="File to compile to", default="")
-_parser.add_argument('-l', '--language', help="Output file language")
+_parser.add_argument('-l', '--language', help="Output file language, or comma-separated languages to write "
+                     "from the same parse, each to OUTPUT with the extension of its language")
 _parser.add_argument('-d', '--debug', help="Output original QASM in translation", action="store_true")
 _parser.add_argument('-c', '--to-module', help="Compile as module for inclusion into larger project",
                      action="store_true")
 _parser.add_argument("-I", "--include", help='Include a pre-transpiled source',
                      action=StoreDictKeyPair, metavar="QASMFILE=CFILE,QASMFILE2=CFILE2,...", default={})
-_parser.add_argument('-a', '--analyse', help="Print adjacency matrix info", action="store_true")
+_parser.add_argument('-a', '--analyse', help="Print adjacency matrix info and circuit schedule", action="store_true")
 _parser.add_argument('-p', '--print', nargs='?', help="Print graphical summary of circuit to file",
                      type=str)
 _parser.add_argument('-e', '--entanglement', nargs='?',
@@ -41,7 +58,54 @@ _parser.add_argument('-e', '--entanglement', nargs='?',
 _parser.add_argument('-t', '--dummy-partition', help="Calculate effects of partition without compilation",
                      action="store_true")
 _parser.add_argument('--max-depth', help="Max depth for analysis and printing", type=int, default=-1)
+_parser.add_argument('--threads', help="Translate circuit definitions in N threads", type=int, metavar="N",
+                     default=1)
+_parser.add_argument('--cache', help="Reuse the translations of circuit definitions unchanged since a previous run, "
+                     "stored in DIR; ignored with -d", type=str, metavar="DIR")
+_parser.add_argument('--split', help="Write the C translation to the directory given by -o as a header, N files of "
+                     "circuit definitions (one per CPU by default), the main program and a Makefile for make -j",
+                     type=int, nargs="?", const=os.cpu_count() or 1, metavar="N")
 _parser.add_argument('--include-internals', help="Include internal gates explicitly", action="store_true")
+_parser.add_argument('--fingerprint', help="Print a hash of the circuit which ignores names, comments and formatting",
+                     action="store_true")
+_parser.add_argument('-O', '--optimise', help="Optimisation level: 0 runs only the passes requested, 1 adds cheap "
+                     "local passes, 2 adds circuit-level passes, 3 adds fusion and qubit remapping; overridden by an "
+                     "optimise directive in the source", type=int, choices=range(MAX_OPTIMISE_LEVEL+1), metavar="LEVEL",
+                     default=0)
+_parser.add_argument('--fold-constants', help="Fold compile-time constants and eliminate dead code before translation",
+                     action="store_true")
+_parser.add_argument('--specialise', help="Emit copies of circuits specialised to the constant spargs they are "
+                     "called with", action="store_true")
+_parser.add_argument('--eliminate-recursion', help="Turn tail calls of recursive circuits into loops, unrolling "
+                     "recursion with constant spargs up to DEPTH levels first", type=int, nargs="?", const=0,
+                     metavar="DEPTH", default=None)
+_parser.add_argument('--light-cone', help="Prune gates outside the past light cone of every measurement",
+                     action="store_true")
+_parser.add_argument('--prune-qubits', help="Prune gates outside the light cone of every measurement and remove "
+                     "never used qubits from the register", action="store_true")
+_parser.add_argument('--peephole', help="Cancel inverse gate pairs, merge single-qubit gates and remove identities",
+                     action="store_true")
+_parser.add_argument('--precompute', help="Replace calls to gates on at most K qubits with constant parameters by "
+                     "their precomputed unitary", type=int, metavar="K", default=0)
+_parser.add_argument('--native-control', help="Apply controlled gates with constant parameters as a single "
+                     "multi-controlled unitary", action="store_true")
+_parser.add_argument('--fuse', help="Fuse runs of gates acting on at most K qubits into single unitaries",
+                     type=int, metavar="K", default=0)
+_parser.add_argument('--reuse-qubits', help="Let qubits whose lifetimes do not overlap (including circuit-local "
+                     "qregs) share a physical index", action="store_true")
+_parser.add_argument('--ranks', help="Order qubits so that those used most stay local to a node when the state is "
+                     "distributed over N ranks", type=ranks, metavar="N", default=0)
+_parser.add_argument('--optimise-resets', help="Elide resets of qubits known to be zero and batch the remaining "
+                     "resets", action="store_true")
+_parser.add_argument('--shots', help="If every measurement is at the end of the program, simulate once and print a "
+                     "histogram of N shots sampled from the final state", type=int, metavar="N", default=0)
+_parser.add_argument('--coalesce-sets', help="Merge runs of assignments to classical registers into bulk copies "
+                     "and constant initialisers", action="store_true")
+_parser.add_argument('--code-size', help="Fit the code written to a budget of N statements, re-rolling runs of "
+                     "calls into loops if over it and unrolling small constant loops if within it", type=int,
+                     metavar="N", default=0)
+_parser.add_argument('--optimise-loops', help="Hoist loop-invariant maths out of loops and replace affine indices "
+                     "by induction variables", action="store_true")
 _parser.add_argument('-P', '--partition', help=
                      """R|Set partitioning optimisation type:
     0 = None  -- Do not attempt to partition,
@@ -5,3 +5,13 @@ langMismatchWarning = "Classical language {} does not match output language {}"
 langNotDefWarning = "Language {0} translation not found, check QASMToQuEST/langs/{0}.py exists"
 noLangSpecWarning = "No language specified for screen print"
 noSpecWarning = "Neither language nor output with recognised language specified"
+remapWarning = "{} is not supported with partitioning, each qubit keeps its own index"
+resetsWarning = "Reset optimisation is not supported with partitioning, each qubit is reset separately"
+shotsWarning = "Shot sampling is not supported with partitioning, each run of the program is one shot"
+ranksWarning = "Number of ranks must be a power of two, received {}"
+passNameWarning = "Optimisation pass {} is not registered"
+passDupWarning = "Optimisation pass {} is already registered"
+passCycleWarning = "Optimisation passes {} depend on each other"
+splitLangWarning = "Language {} cannot be split into translation units"
+splitOutputWarning = "Splitting into translation units needs a single language and an output directory"
+wideRegisterWarning = "Classical register {} of {} bits is wider than a word and may only be compared with a value or a register of the same size"
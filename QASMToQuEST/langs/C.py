@@ -1,59 +1,92 @@
 """
 Module to supply functions to write C from given QASM types
 """
-from QASMParser.parser.types import (TensorNetwork, ClassicalRegister, QuantumRegister, DeferredQuantumRegister, DeferredClassicalRegister,
+import re
+import os.path
+from QASMParser.parser.types import (TensorNetwork, ClassicalRegister, LocalClassicalRegister, QuantumRegister, DeferredQuantumRegister, DeferredClassicalRegister,
                                      Let, Argument, CallGate, Comment, Measure, IfBlock, While, Gate, Circuit,
                                      Procedure, Opaque, CBlock, Loop, NestLoop, Reset, Output, InitEnv, Return,
                                      Include, Alias, SetAlias, MathsBlock, Constant,
                                      MathOp, Register, Dealloc, DeferredAlias, InlineAlias, Bitstring, Set,
-                                     Next, Cycle, Finish, FinishTarget, CycleTarget, TheEnd)
+                                     Next, Cycle, Finish, FinishTarget, CycleTarget, TheEnd, TailCall, ApplyMatrix,
+                                     MatrixLiteral, SampleShots, BatchReset)
 from QASMParser.parser.tokens import (Binary, Function)
+from ..errors import (wideRegisterWarning)
 #from QASMParser.parser.filehandle import (NullBlock)
 
-def set_lang():
+def to_lang_table():
     """
-    Assign all methods for converting into C.
+    Functions converting each type into C.
 
-    :returns: None
-    :rtype: None
+    :returns: Function translating nodes of each class
+    :rtype: dict
     """
-    TensorNetwork.to_lang = TensorNetwork_to_c
-    ClassicalRegister.to_lang = DeferredClassicalRegister_to_c
-    QuantumRegister.to_lang = QuantumRegister_to_c
-    DeferredQuantumRegister.to_lang = DeferredQuantumRegister_to_c
-    DeferredClassicalRegister.to_lang = DeferredClassicalRegister_to_c
-    Let.to_lang = Let_to_c
-    Argument.to_lang = Argument_to_c
-    CallGate.to_lang = CallGate_to_c
-    Comment.to_lang = Comment_to_c
-    Measure.to_lang = Measure_to_c
-    IfBlock.to_lang = IfBlock_to_c
-    While.to_lang = While_to_c
-    Gate.to_lang = CreateGate_to_c
-    Circuit.to_lang = CreateGate_to_c
-    Procedure.to_lang = CreateGate_to_c
-    Opaque.to_lang = CreateGate_to_c
-    CBlock.to_lang = CBlock_to_c
-    Loop.to_lang = Loop_to_c
-    NestLoop.to_lang = NestLoop_to_c
-    Reset.to_lang = Reset_to_c
-    Output.to_lang = Output_to_c
-    InitEnv.to_lang = init_env
-    Return.to_lang = Return_to_c
-    Include.to_lang = Include_to_c
-    Alias.to_lang = Alias_to_c
-    SetAlias.to_lang = SetAlias_to_c
-    Set.to_lang = Set_to_c
-    MathsBlock.to_lang = resolve_maths
-    Dealloc.to_lang = Dealloc_to_c
-    DeferredAlias.to_lang = DeferredAlias_to_c
-    Next.to_lang = Next_to_c
-    Cycle.to_lang = Cycle_to_c
-    CycleTarget.to_lang = CycleTarget_to_c
-    Finish.to_lang = Finish_to_c
-    FinishTarget.to_lang = FinishTarget_to_c
-    TheEnd.to_lang = TheEnd_to_c
-    init_core_QASM_gates()
+    return {
+        TensorNetwork: TensorNetwork_to_c,
+        ClassicalRegister: ClassicalRegister_to_c,
+        QuantumRegister: QuantumRegister_to_c,
+        DeferredQuantumRegister: DeferredQuantumRegister_to_c,
+        DeferredClassicalRegister: DeferredClassicalRegister_to_c,
+        LocalClassicalRegister: ClassicalRegister_to_c,
+        Let: Let_to_c,
+        Argument: Argument_to_c,
+        CallGate: CallGate_to_c,
+        Comment: Comment_to_c,
+        Measure: Measure_to_c,
+        IfBlock: IfBlock_to_c,
+        While: While_to_c,
+        Gate: CreateGate_to_c,
+        Circuit: CreateGate_to_c,
+        Procedure: CreateGate_to_c,
+        Opaque: CreateGate_to_c,
+        CBlock: CBlock_to_c,
+        Loop: Loop_to_c,
+        NestLoop: NestLoop_to_c,
+        Reset: Reset_to_c,
+        Output: Output_to_c,
+        InitEnv: init_env,
+        Return: Return_to_c,
+        Include: Include_to_c,
+        Alias: Alias_to_c,
+        SetAlias: SetAlias_to_c,
+        Set: Set_to_c,
+        MathsBlock: resolve_maths,
+        Dealloc: Dealloc_to_c,
+        DeferredAlias: DeferredAlias_to_c,
+        Next: Next_to_c,
+        Cycle: Cycle_to_c,
+        CycleTarget: CycleTarget_to_c,
+        Finish: Finish_to_c,
+        FinishTarget: FinishTarget_to_c,
+        TheEnd: TheEnd_to_c,
+        TailCall: TailCall_to_c,
+        SampleShots: SampleShots_to_c,
+        BatchReset: BatchReset_to_c,
+        ApplyMatrix: ApplyMatrix_to_c,
+        MatrixLiteral: MatrixLiteral_to_c
+    }
+
+def children_table():
+    """
+    Functions giving the code written in the block of each type, where it is not its own code.
+
+    :returns: Function returning the children of nodes of each class
+    :rtype: dict
+    """
+    return {Gate: Gate_code_c}
+
+def declaration_table():
+    """
+    Functions declaring each type defined at file scope in a header shared between translation units.
+
+    :returns: Function declaring nodes of each class
+    :rtype: dict
+    """
+    return {
+        Gate: CreateGate_decl_c,
+        MatrixLiteral: MatrixLiteral_decl_c,
+        Let: Let_decl_c
+    }
 
 # Several details pertaining to the language in question
 HOIST_FUNCS = True    # Move functions to front of program
@@ -62,7 +95,10 @@ HOIST_VARS = False    # Move variables to front of program
 BARECODE = False     # Can code be bare or does it need to be in function
 BLOCKOPEN = "{"      # Block delimiters
 BLOCKCLOSE = "}"     #  ""      ""
+BLOCKEMPTY = ""      # Statement for a block with no code
 INDENT = "  "        # Standard indent depth
+EXTENSION = ".c"     # Extension of output files
+CWORD_BITS = 64      # Bits per word of a packed classical register
 
 _TYPES_TRANSLATION = {
     "int":"int",
@@ -78,31 +114,29 @@ _TYPES_TRANSLATION = {
     None:"void"
 }
 
-def init_core_QASM_gates():
-    """ Set up the core gates in python """
-    unitary = Gate.internalGates["U"]
-    controlledNot = Gate.internalGates["CX"]
-    unitaryInverse = Gate.internalGates["_inv_U"]
-    unitaryControl = Gate.internalGates["_ctrl_U"]
-
-    controlledNot.set_code([CBlock(
-        None,
-        """controlledNot(qreg, a_index, b_index);""".splitlines())])
-    unitary.set_code([CBlock(
-        None,
-        """rotateZ(qreg,a_index,lambda);
-rotateX(qreg,a_index,theta);
-rotateZ(qreg,a_index,phi);""".splitlines())])
+def core_gate_code():
+    """ Code of the core gates in C
 
-    unitaryInverse.set_code([CBlock(
-        None,
-        """rotateZ(qreg,a_index,-phi);
+    :returns: Body of each core gate by name
+    :rtype: dict
+    """
+    return {
+        "CX": [CBlock(
+            None,
+            """controlledNot(qreg, a_index, b_index);""".splitlines())],
+        "U": [CBlock(
+            None,
+            """rotateZ(qreg,a_index,lambda);
+rotateX(qreg,a_index,theta);
+rotateZ(qreg,a_index,phi);""".splitlines())],
+        "_inv_U": [CBlock(
+            None,
+            """rotateZ(qreg,a_index,-phi);
 rotateX(qreg,a_index,-theta);
-rotateZ(qreg,a_index,-lambda);""".splitlines())])
-
-    unitaryControl.set_code([CBlock(
-        None,
-        """Complex _alpha, _beta;
+rotateZ(qreg,a_index,-lambda);""".splitlines())],
+        "_ctrl_U": [CBlock(
+            None,
+            """Complex _alpha, _beta;
 getComplexPairFromRotation(lambda, (Vector) {0, 0, 1}, &_alpha, &_beta);
 ComplexMatrix2 _rot = {
         .real = {{_alpha.real, -_beta.real}, {_beta.real, _alpha.real}}
@@ -120,7 +154,8 @@ ComplexMatrix2 _rot = {
         .real = {{_alpha.real, -_beta.real}, {_beta.real, _alpha.real}}
         .imag = {{_alpha.imag, _beta.imag} {_beta.imag, -_alpha.imag}};
 multiControlledUnitary(qreg, _ctrls, _nCtrls, a_index, _rot);
-""".splitlines())])
+""".splitlines())]
+    }
 
 
 def Maths_to_c(parent, maths: MathsBlock):
@@ -138,7 +173,9 @@ def Maths_to_c(parent, maths: MathsBlock):
     outStr = ""
 
     for element in maths.maths:
-        if isinstance(element, Binary):
+        if isinstance(element, Binary) and compare_registers(parent, element):
+            outStr += compare_registers(parent, element)
+        elif isinstance(element, Binary):
             for operator, operand in element.args:
                 if operator == "in":
                     if len(operand) == 2:
@@ -146,7 +183,10 @@ def Maths_to_c(parent, maths: MathsBlock):
                     else:
                         raise OSError
                     continue
-                operand = resolve_maths(parent, operand)
+                if isinstance(operand, MathsBlock): # Bracket nested operations to preserve precedence
+                    operand = f"({resolve_maths(parent, operand)})"
+                else:
+                    operand = resolve_maths(parent, operand)
                 if operator == "nop":
                     outStr += f"{operand}"
                 elif operator == "^":
@@ -184,6 +224,14 @@ def resolve_maths(self, elem):
 
     if isinstance(elem, MathsBlock):
         value = Maths_to_c(self, elem)
+    elif is_creg_ref(elem) and packed(elem[0]):
+        start, size = creg_bits(elem)
+        if size == 1:
+            value = f"getBit({elem[0].name}, {start})"
+        elif size <= CWORD_BITS:
+            value = f"wordOf({elem[0].name}, {start}, {size})"
+        else:
+            raise NotImplementedError(wideRegisterWarning.format(elem[0].name, size))
     elif isinstance(elem, list) and isinstance(elem[0], ClassicalRegister):
         if isinstance(elem[1], tuple):
             start, end = elem[1]
@@ -208,6 +256,133 @@ def resolve_maths(self, elem):
 
     return value
 
+def is_creg_ref(elem):
+    """Check whether a maths element is a reference [register, index] to bits of a classical register."""
+    return isinstance(elem, list) and len(elem) == 2 and isinstance(elem[0], ClassicalRegister)
+
+def creg_bits(ref):
+    """First bit and number of bits of a classical register referenced by [register, index].
+
+    :returns: (start, size)
+    :rtype: tuple
+    """
+    reg, index = ref
+    if index is None:
+        return 0, reg.size
+    if isinstance(index, tuple):
+        start, end = index
+        return start, end - start + 1
+    return index, 1
+
+def compare_registers(parent, binary):
+    """Syntax conversion for a comparison of a packed classical register wider than a word, None otherwise.
+
+    Two registers of the same size are compared word by word, and a register with any other value by its bits beyond
+    the first word and then its first word.
+    """
+    if len(binary.args) != 2 or binary.args[1][0] not in ("<", "<=", "==", "!=", ">=", ">"):
+        return None
+    (_, left), (operator, right) = binary.args
+    wide = lambda elem: is_creg_ref(elem) and packed(elem[0]) and creg_bits(elem)[1] > CWORD_BITS
+    if wide(left) and wide(right):
+        (leftStart, size), (rightStart, rightSize) = creg_bits(left), creg_bits(right)
+        if size != rightSize:
+            return None
+        return f"compareBits({left[0].name}, {leftStart}, {right[0].name}, {rightStart}, {size}) {operator} 0"
+    if wide(left):
+        (start, size), value = creg_bits(left), resolve_maths(parent, right)
+        return f"compareWord({left[0].name}, {start}, {size}, {value}) {operator} 0"
+    if wide(right):
+        (start, size), value = creg_bits(right), resolve_maths(parent, left)
+        return f"0 {operator} compareWord({right[0].name}, {start}, {size}, {value})"
+    return None
+
+def packed(reg):
+    """Check whether the bits of a classical register are packed into words.
+
+    Registers of fixed size are packed unless they are passed out of their block as arrays (returned or assigned
+    the result of a call) or are named in verbatim code, which may index them as arrays.
+
+    :param reg: Register to check
+    :returns: Whether reg is held as an array of cword
+    :rtype: bool
+    """
+    if not isinstance(reg, ClassicalRegister) or isinstance(reg, DeferredClassicalRegister):
+        return False
+    if not isinstance(reg.size, int):
+        return False
+    if not hasattr(reg, "_packed"):
+        reg._packed = not escapes(reg, reg.parent.code)
+    return reg._packed
+
+def escapes(reg, code):
+    """Check whether any line of code uses reg other than bit by bit."""
+    for line in code:
+        byprod = getattr(line, "byprod", None)
+        while isinstance(byprod, (list, tuple)) and byprod: # Returned names may come nested from the parser
+            byprod = byprod[0]
+        if isinstance(line, CallGate) and byprod == reg.name:
+            return True
+        if isinstance(line, Return) and line.pargs is reg:
+            return True
+        if isinstance(line, CBlock) and re.search(rf"\b{re.escape(reg.name)}\b", "\n".join(line.block)):
+            return True
+        if isinstance(line, Include):
+            if escapes(reg, line.raw_code):
+                return True
+        elif isinstance(getattr(line, "code", None), list) and not isinstance(line, Gate):
+            if escapes(reg, line.code):
+                return True
+    return False
+
+def allocation(reg):
+    """Choose where a deferred register or alias of a circuit is held.
+
+    Those passed out of the circuit as arrays (returned or assigned the result of a call) or named in verbatim code
+    stay on the heap, as do any outside the top level of a circuit. Of the rest, those of a size known at compile
+    time are arrays on the stack and the others come from the arena of the runtime, which is reset when the circuit
+    exits, so that calls in a loop do not allocate on every iteration.
+
+    :param reg: Deferred classical register or alias
+    :returns: "heap", "stack" or "arena"
+    :rtype: str
+    """
+    if not hasattr(reg, "_allocation"):
+        if not isinstance(reg.parent, Gate) or escapes(reg, reg.parent.code):
+            reg._allocation = "heap"
+        elif isinstance(reg.size, int):
+            reg._allocation = "stack"
+        else:
+            reg._allocation = "arena"
+    return reg._allocation
+
+def arena_registers(block):
+    """Deferred registers and aliases declared in block and its child blocks which are taken from the arena."""
+    found = []
+    for line in block.code:
+        if isinstance(line, (DeferredClassicalRegister, DeferredAlias)) and allocation(line) == "arena":
+            found.append(line)
+        elif isinstance(getattr(line, "code", None), list) and not isinstance(line, Gate):
+            found += arena_registers(line)
+    return found
+
+def circuit_of(node):
+    """Circuit whose body contains node, None at file scope."""
+    block = node.parent
+    while block is not None and not isinstance(block, Gate):
+        block = getattr(block, "parent", None)
+    return block
+
+def resolve_index(index):
+    """Resolve a single index (or the first of a range) into C."""
+    if isinstance(index, (list, tuple)):
+        index = index[0]
+    if isinstance(index, Constant):
+        return index.name
+    if isinstance(index, MathsBlock):
+        return resolve_maths(None, index)
+    return str(index)
+
 def resolve_arg(arg):
     """Resolve quantum arguments into their appropriate references or indices.
 
@@ -223,12 +398,13 @@ def resolve_arg(arg):
         index = origIndex[0]
     else:
         ref = ""
+        index = origIndex
 
-    if isinstance(origIndex, Constant):
-        index = origIndex.name
+    if isinstance(index, Constant):
+        index = index.name
 
-    elif isinstance(origIndex, MathsBlock):
-        index = resolve_maths(None, origIndex)
+    elif isinstance(index, MathsBlock):
+        index = resolve_maths(None, index)
 
     if isinstance(obj, Argument):
         if obj.size == 1:
@@ -267,15 +443,51 @@ def inc(filename):
     return f'#include "{filename}"'
 
 HEADER = [inc("stdlib.h"), inc("stdio.h"), inc("QuEST.h"), inc("reqasm.h"), inc("reqasm.c")]
+UNIT_HEADER = [inc("stdlib.h"), inc("stdio.h"), inc("QuEST.h"), inc("reqasm.h")]
 INCLUDE_TN = inc("QuEST_tn.h") + "\n#define CX tn_controlledNot\n#define U tn_unitary"
 
+# Directory holding reqasm.c and reqasm.h
+REQASM_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Makefile of a translation split into units, formatted with the name of the program, its target, objects
+# and the rule linking them
+MAKEFILE = """\
+# Build of {name} from its translation units, e.g. make -j
+REQASM ?= {reqasm}
+CFLAGS ?= -O2
+LDLIBS ?= -lQuEST -lm
+
+OBJS = {objects} reqasm.o
+
+{target}: $(OBJS)
+{link}
+
+%.o: %.c {name}.h
+\t$(CC) $(CPPFLAGS) -I$(REQASM) $(CFLAGS) -c -o $@ $<
+
+reqasm.o: $(REQASM)/reqasm.c $(REQASM)/reqasm.h
+\t$(CC) $(CPPFLAGS) -I$(REQASM) $(CFLAGS) -c -o $@ $<
+
+clean:
+\trm -f {target} $(OBJS)
+
+.PHONY: clean
+"""
+MAKEFILE_LINK = "\t$(CC) $(LDFLAGS) -o $@ $^ $(LDLIBS)"
+MAKEFILE_ARCHIVE = "\t$(AR) rcs $@ $^"
+
 def init_env(self):
     """ Syntax conversion for initialising QuEST environment """
+    # Shots are drawn from rand(), seeded once here so that the program may reseed it
+    if any(isinstance(line, SampleShots) for line in self.parent.code):
+        return 'QuESTEnv Env = createQuESTEnv();\nseedShots();'
     return f'QuESTEnv Env = createQuESTEnv();'
 
 def Output_to_c(self):
     """Syntax conversion for initialising the QuEST environment."""
     parg, bindex = self.pargs
+    if packed(parg):
+        return f'printf("%d ", getBit({parg.name}, {resolve_index(bindex)}));'
     return f'printf("%d ", {parg.name}[{bindex}]);'
 
 def Return_to_c(self):
@@ -285,7 +497,7 @@ def Return_to_c(self):
         parg = resolve_arg((self.pargs, (start, end)))
     else:
         parg = resolve_arg((self.pargs, start))
-    return f'return {parg};'
+    return exit_arena(self) + f'return {parg};'
 
 def Next_to_c(self):
     """Syntax conversion for simple cycle."""
@@ -311,7 +523,24 @@ def TheEnd_to_c(self):
     """Syntax for early termination."""
     if self.var is None:
         return f"exit 0;"
-    return "return;"
+    return exit_arena(self) + "return;"
+
+def TailCall_to_c(self):
+    """Syntax conversion for restarting a gate with the arguments of a call to itself."""
+    call = self.call
+    gate = self.parent
+    values = [*(resolve_arg(qarg) for qarg in call.qargs),
+              *(resolve_maths(call.parent, parg) for parg in call.pargs),
+              *(resolve_maths(call.parent, sparg) for sparg in call.spargs)]
+    types = [*("int" if qarg.size == 1 else "const int*" for qarg in gate.qargs),
+             *(parg.varType for parg in gate.pargs),
+             *("int" for _ in gate.spargs)]
+    names = [arg.name for arg in (*gate.qargs, *gate.pargs, *gate.spargs)]
+    # Evaluate every new value before assigning any
+    changed = [(name, varType, value) for name, varType, value in zip(names, types, values) if value != name]
+    outStr = "".join(f"{varType} _{name}_next = {value};\n" for name, varType, value in changed)
+    outStr += "".join(f"{name} = _{name}_next;\n" for name, _, _ in changed)
+    return outStr + "continue;"
 
 def Reset_to_c(self):
     """Syntax conversion for resetting quantum state to zero."""
@@ -322,8 +551,50 @@ int _{qarg[0].name} = measure(qreg, {qargRef});
 if (_{qarg[0].name}) U(qreg, {qargRef}, pi, 0, 0);
 }}'''
 
+def BatchReset_to_c(self):
+    """Syntax conversion for resetting several qubits to zero at once."""
+    if self.whole:
+        return "initZeroState(qreg);"
+
+    def index(elem):
+        if isinstance(elem, Constant):
+            return elem.name
+        if isinstance(elem, MathsBlock):
+            return resolve_maths(None, elem)
+        return str(elem)
+
+    ranges = [qarg for qarg in self.qargs if isinstance(qarg[1], tuple) and qarg[1][0] != qarg[1][1]]
+    singles = [qarg if not isinstance(qarg[1], tuple) else [qarg[0], qarg[1][0]]
+               for qarg in self.qargs if qarg not in ranges]
+
+    outStr = []
+    for reg, (start, end) in ranges:
+        if isinstance(start, int) and isinstance(end, int):
+            count = end - start + 1
+        else:
+            count = f"{index(end)} - {index(start)} + 1"
+        outStr.append(f"resetQubits(qreg, {resolve_arg([reg, (start, end)])}, {count});")
+    if singles:
+        outStr.append(f"resetQubits(qreg, (int[]) {{{', '.join(resolve_arg(qarg) for qarg in singles)}}}, {len(singles)});")
+    return "\n".join(outStr)
+
+def SampleShots_to_c(self):
+    """Syntax conversion for sampling shots from the final state."""
+    qargRefs = ", ".join(resolve_arg(qarg) for qarg in self.qargs)
+    return f'''{{
+const int _shotQubits[] = {{{qargRefs}}};
+long long int* _shotStates = malloc(sizeof(long long int)*{self.shots});
+sampleStates(qreg, {self.shots}, _shotStates);
+printOutcomes(_shotStates, {self.shots}, _shotQubits, {len(self.qargs)});
+free(_shotStates);
+}}'''
+
 def ClassicalRegister_to_c(self):
     """Syntax conversion for creating a classical register."""
+    if packed(self):
+        return f'cword {self.name}[{-(-self.size // CWORD_BITS)}] = {{0}};'
+    if not isinstance(self, LocalClassicalRegister):
+        return DeferredClassicalRegister_to_c(self)
     return f'int {self.name}[{self.size}];'+"\n"+f'for (int i = 0; i < {self.size}; i++) {self.name}[i] = 0;'
 
 def DeferredClassicalRegister_to_c(self):
@@ -335,11 +606,47 @@ def DeferredClassicalRegister_to_c(self):
     else:
         size = f'{self.size}'
 
+    return deferred_array_to_c(self, size)
+
+def deferred_array_to_c(self, size):
+    """Declaration of the zeroed array of ints holding a deferred register or alias of the given size."""
+    where = allocation(self)
+    if where == "stack":
+        return f'int {self.name}[{size}] = {{0}};'
+    if where == "arena":
+        return f'int* {self.name} = arenaAlloc(sizeof(int)*({size}));'
     return (f'int* {self.name} = malloc(sizeof(int)*({size}));''\n'
             f'for (int i = 0; i < {size}; i++) {self.name}[i] = 0;')
 
 def Dealloc_to_c(self):
-    return f'free({self.pargs});'
+    """Syntax conversion for freeing a deferred register or alias at the end of its circuit."""
+    reg = self.parent.get_objs("Copy").get(self.pargs) if isinstance(self.pargs, str) else self.pargs
+    if not isinstance(reg, (DeferredClassicalRegister, DeferredAlias)):
+        return f'free({self.pargs});'
+    where = allocation(reg)
+    if where == "heap":
+        return f'free({reg.name});'
+    # The arena is reset once for all the registers of the circuit taken from it
+    if where == "arena" and reg is arena_registers(circuit_of(self))[0]:
+        return 'resetArena(_arenaMark);'
+    return ""
+
+def Gate_code_c(self):
+    """Body of a circuit, marking the arena on entry if any of its registers are taken from it."""
+    if not arena_registers(self):
+        return self.code
+    return [CBlock(self, ["const arenaMark _arenaMark = markArena();"]), *self.code]
+
+def exit_arena(self):
+    """Reset of the arena before leaving a circuit early, empty if the circuit takes nothing from it."""
+    gate = circuit_of(self)
+    if gate is None or not arena_registers(gate):
+        return ""
+    # The exit at the end of the body (or of the loop a tail call restarts) follows the reset
+    last = gate.code[-1] if gate.code else None
+    while isinstance(last, While) and last.code:
+        last = last.code[-1]
+    return "" if last is self else "resetArena(_arenaMark);\n"
 
 def QuantumRegister_to_c(self):
     """Syntax conversion for creating a quantum register."""
@@ -347,7 +654,7 @@ def QuantumRegister_to_c(self):
 
 def DeferredQuantumRegister_to_c(self):
     """Syntax conversion for creating a quantum register."""
-    return f"const int[] {self.name} = {{{', '.join(map(str, self.mapping))}}};"
+    return f"const int {self.name}[] = {{{', '.join(map(str, self.mapping))}}};"
 
 def TensorNetwork_to_c(self):
     """Syntax conversion for creating a TensorNetwork """
@@ -378,8 +685,7 @@ def DeferredAlias_to_c(self):
     else:
         size = f'{self.size}'
 
-    return (f'int* {self.name} = malloc(sizeof(int)*{size});''\n'
-            f'for (int i = 0; i < {size}; i++) {self.name}[i] = 0;')
+    return deferred_array_to_c(self, size)
 
 def SetAlias_to_c(self):
     """Syntax conversion for setting an alias."""
@@ -431,11 +737,93 @@ def Let_to_c(self):
 
     return out
 
+def Let_decl_c(self):
+    """Declaration of a constant list defined in another translation unit."""
+    var = self.const
+    return f"extern {_TYPES_TRANSLATION[var.varType]} {var.name}[{len(var.val)}];"
+
 def Set_to_c(self):
     """Syntax conversion for setting creg """
-    value = resolve_arg(self.value)
-    size = self.value[1][1] - self.value[1][0] + 1
-    return f"memcpy({resolve_arg(self.variable)}, {value}, {size});"
+    (var, (varStart, _)), (val, (valStart, valEnd)) = self.variable, self.value
+    size = valEnd - valStart + 1
+    if not packed(var) and not packed(val):
+        if isinstance(val, Bitstring):
+            # Constant bits are copied from an array initialised once
+            return (f"{{\nstatic const int _bits[] = {resolve_arg(self.value)};\n"
+                    f"memcpy({resolve_arg(self.variable)}, _bits, sizeof(_bits));\n}}")
+        return f"memcpy({resolve_arg(self.variable)}, {resolve_arg(self.value)}, sizeof(int)*{size});"
+
+    if isinstance(val, Bitstring):
+        # Constant bits are set a word at a time
+        bits = val.val[valStart:valEnd+1]
+        outStr = []
+        for offset in range(0, size, CWORD_BITS):
+            chunk = bits[offset:offset+CWORD_BITS]
+            word = sum(1 << i for i, bit in enumerate(chunk) if bit == "1")
+            outStr.append(f"setWord({var.name}, {varStart + offset}, {len(chunk)}, {word:#x}ULL);")
+        return "\n".join(outStr)
+    if packed(var) and packed(val):
+        return f"copyBits({var.name}, {varStart}, {val.name}, {valStart}, {size});"
+    if packed(var):
+        return f"for (int _i = 0; _i < {size}; _i++) setBit({var.name}, {varStart} + _i, {val.name}[{valStart} + _i]);"
+    return f"for (int _i = 0; _i < {size}; _i++) {var.name}[{varStart} + _i] = getBit({val.name}, {valStart} + _i);"
+
+def c_matrix(matrix):
+    """Syntax conversion for the real and imaginary parts of a dense matrix as nested array initialisers."""
+    part = lambda values: "{" + ", ".join("{" + ", ".join(f"{val:.17g}" for val in row) + "}"
+                                          for row in values) + "}"
+    return part(matrix.real), part(matrix.imag)
+
+def ApplyMatrix_to_c(self):
+    """Syntax conversion for applying a unitary computed at compile time."""
+    targets = [resolve_arg(qarg) for qarg in self.qargs]
+    if self.controls:
+        controls = ', '.join(resolve_arg(qarg) for qarg in self.controls)
+        prefix, ctrlArgs = "multiControlled", f"(int[]) {{{controls}}}, {self.nControls}, "
+    else:
+        prefix, ctrlArgs = "", ""
+    apply = lambda func: prefix + func[0].upper() + func[1:] if prefix else func
+
+    if self.literal is None:
+        real, imag = c_matrix(self.matrix)
+    if self.nQubits == 1:
+        matrix = self.literal.name if self.literal else f"(ComplexMatrix2) {{.real = {real}, .imag = {imag}}}"
+        return f"{apply('unitary')}(qreg, {ctrlArgs}{targets[0]}, {matrix});"
+    if self.nQubits == 2:
+        matrix = self.literal.name if self.literal else f"(ComplexMatrix4) {{.real = {real}, .imag = {imag}}}"
+        return f"{apply('twoQubitUnitary')}(qreg, {ctrlArgs}{', '.join(targets)}, {matrix});"
+    if self.literal:
+        dim = 2**self.nQubits
+        matrix = (f"bindArraysToStackComplexMatrixN({self.nQubits}, {self.literal.name}_real, {self.literal.name}_imag, "
+                  f"(qreal*[{dim}]) {{NULL}}, (qreal*[{dim}]) {{NULL}})")
+    else:
+        matrix = f"getStaticComplexMatrixN({self.nQubits}, ({real}), ({imag}))"
+    return (f"{{\n"
+            f"{INDENT}int _targs[{self.nQubits}] = {{{', '.join(targets)}}};\n"
+            f"{INDENT}ComplexMatrixN _u = {matrix};\n"
+            f"{INDENT}{apply('multiQubitUnitary')}(qreg, {ctrlArgs}_targs, {self.nQubits}, _u);\n"
+            f"}}")
+
+def MatrixLiteral_to_c(self):
+    """Syntax conversion for declaring a shared unitary computed at compile time."""
+    real, imag = c_matrix(self.matrix)
+    if self.nQubits == 1:
+        return f"ComplexMatrix2 {self.name} = {{.real = {real}, .imag = {imag}}};"
+    if self.nQubits == 2:
+        return f"ComplexMatrix4 {self.name} = {{.real = {real}, .imag = {imag}}};"
+    dim = 2**self.nQubits
+    return (f"qreal {self.name}_real[{dim}][{dim}] = {real};\n"
+            f"qreal {self.name}_imag[{dim}][{dim}] = {imag};")
+
+def MatrixLiteral_decl_c(self):
+    """Declaration of a shared unitary defined in another translation unit."""
+    if self.nQubits == 1:
+        return f"extern ComplexMatrix2 {self.name};"
+    if self.nQubits == 2:
+        return f"extern ComplexMatrix4 {self.name};"
+    dim = 2**self.nQubits
+    return (f"extern qreal {self.name}_real[{dim}][{dim}];\n"
+            f"extern qreal {self.name}_imag[{dim}][{dim}];")
 
 def CBlock_to_c(self):
     """Syntax conversion for classical block."""
@@ -473,6 +861,8 @@ def Measure_to_c(self):
     parg = self.pargs
     qarg = self.qargs
     qargRef = resolve_arg(qarg)
+    if packed(parg[0]):
+        return f"setBit({parg[0].name}, {resolve_index(parg[1])}, measure(qreg, {qargRef}));"
     pargRef = resolve_arg(parg)
     return f"{pargRef} = measure(qreg, {qargRef});"
 
@@ -489,22 +879,27 @@ def While_to_c(self):
 
 def CreateGate_to_c(self):
     """Syntax conversion for declaring a gate."""
+    const = lambda arg: "" if arg.name in self.reboundArgs else "const "
     printQargs = ""
     printPargs = ""
     printSpargs = ""
     if self.qargs:
-        printQargs = "Qureg qreg, " + ", ".join(f"const int {qarg.name}" if qarg.size == 1
+        printQargs = "Qureg qreg, " + ", ".join(f"{const(qarg)}int {qarg.name}" if qarg.size == 1
                                                 else f"const int* {qarg.name}" for qarg in self.qargs)
     if self.pargs:
         printPargs = ", ".join(f"{parg.varType} {parg.name}" for parg in self.pargs)
     if self.spargs:
-        printSpargs = ", ".join(f"const int {sparg.name}" for sparg in self.spargs)
+        printSpargs = ", ".join(f"{const(sparg)}int {sparg.name}" for sparg in self.spargs)
 
     printArgs = ", ".join(args for args in (printQargs, printPargs, printSpargs) if args).rstrip(", ")
     returnType = _TYPES_TRANSLATION[self.returnType]
     outStr = f"{returnType} {self.name}({printArgs}) "
     return outStr
 
+def CreateGate_decl_c(self):
+    """Prototype of a gate defined in another translation unit."""
+    return CreateGate_to_c(self).rstrip() + ";"
+
 def Loop_to_c(self):
     """Syntax conversion for declaring a loop (inclusive)."""
     resolve = lambda b: resolve_maths(self, b)
@@ -518,11 +913,12 @@ def Loop_to_c(self):
         except ValueError:
             neg[i] = False
 
-    var = (f"int {var} = {init}" for var, init in zip(self.var, start))
-    term = (f"{var} <= {term}" if not inv else f"{var} >= {term}" for var, term, inv in zip(self.var, end, neg))
+    var = (f"{var} = {init}" for var, init in zip(self.var, start))
+    term = (f"{var} <= {term}" if not inv else f"{var} >= {term}" for var, term, inv in zip(self.var, end, neg)
+            if var not in self.induction)
     incr = (f"{var} += {incr}"   for var, incr  in zip(self.var, step))
 
-    return f"for ( {', '.join(var)}; {' && '.join(term)}; {', '.join(incr)} )"
+    return f"for ( int {', '.join(var)}; {' && '.join(term)}; {', '.join(incr)} )"
 
 def NestLoop_to_c(self):
     """Syntax conversion for implicit loop (exclusive)."""
@@ -531,7 +927,7 @@ def NestLoop_to_c(self):
     end = map(resolve, self.end)
     step = map(resolve, self.step)
 
-    var = (f"int {var} = {init}" for var, init in zip(self.var, start))
-    term = (f"{var} <= {term}"    for var, term in zip(self.var, end))
+    var = (f"{var} = {init}" for var, init in zip(self.var, start))
+    term = (f"{var} <= {term}"    for var, term in zip(self.var, end) if var not in self.induction)
     incr = (f"{var} += {incr}"     for var, incr  in zip(self.var, step))
-    return f"for ( {', '.join(var)}; {' && '.join(term)}; {', '.join(incr)} )"
+    return f"for ( int {', '.join(var)}; {' && '.join(term)}; {', '.join(incr)} )"
@@ -1,57 +1,74 @@
 """
 Module to supply functions to write Python from given QASM types
 """
-from QASMParser.parser.types import (TensorNetwork, ClassicalRegister, QuantumRegister, DeferredQuantumRegister, DeferredClassicalRegister,
+from QASMParser.parser.types import (TensorNetwork, ClassicalRegister, LocalClassicalRegister, QuantumRegister, DeferredQuantumRegister, DeferredClassicalRegister,
                                      Let, Argument, CallGate, Comment, Measure, IfBlock, While, Gate, Circuit,
                                      Procedure, Opaque, CBlock, Loop, NestLoop, Reset, Output, InitEnv, Return,
                                      Include, Alias, SetAlias, MathsBlock, Constant,
                                      MathOp, Register, Dealloc, DeferredAlias, InlineAlias,
-                                     Next, Cycle, Finish, FinishTarget, CycleTarget, SubBlock, TheEnd)
+                                     Next, Cycle, Finish, FinishTarget, CycleTarget, SubBlock, TheEnd, TailCall,
+                                     ApplyMatrix, MatrixLiteral, SampleShots, BatchReset)
 from QASMParser.parser.tokens import (Binary, Function)
 from QASMParser.parser.filehandle import (NullBlock)
 
-def set_lang():
+def to_lang_table():
     """
-    Assign all methods for converting into Python
+    Functions converting each type into Python.
 
-    :returns: None
-    :rtype: None
+    :returns: Function translating nodes of each class
+    :rtype: dict
     """
-    TensorNetwork.to_lang = TensorNetwork_to_Python
-    ClassicalRegister.to_lang = ClassicalRegister_to_Python
-    DeferredClassicalRegister.to_lang = ClassicalRegister_to_Python
-    QuantumRegister.to_lang = QuantumRegister_to_Python
-    Let.to_lang = Let_to_Python
-    Argument.to_lang = Argument_to_Python
-    CallGate.to_lang = CallGate_to_Python
-    Comment.to_lang = Comment_to_Python
-    Measure.to_lang = Measure_to_Python
-    IfBlock.to_lang = IfBlock_to_Python
-    While.to_lang = While_to_Python
-    Gate.to_lang = CreateGate_to_Python
-    Circuit.to_lang = CreateGate_to_Python
-    Procedure.to_lang = CreateGate_to_Python
-    Opaque.to_lang = CreateGate_to_Python
-    CBlock.to_lang = CBlock_to_Python
-    Loop.to_lang = Loop_to_Python
-    NestLoop.to_lang = NestLoop_to_Python
-    Reset.to_lang = Reset_to_Python
-    Output.to_lang = Output_to_Python
-    InitEnv.to_lang = init_env
-    Return.to_lang = Return_to_Python
-    Include.to_lang = Include_to_Python
-    Alias.to_lang = Alias_to_Python
-    DeferredAlias.to_lang = Alias_to_Python
-    Dealloc.to_lang = lambda: ""
-    SetAlias.to_lang = SetAlias_to_Python
-    MathsBlock.to_lang = resolve_maths
-    Next.to_lang = Next_to_Python
-    Cycle.to_lang = Cycle_to_Python
-    CycleTarget.to_lang = CycleTarget_to_Python
-    Finish.to_lang = Finish_to_Python
-    FinishTarget.to_lang = FinishTarget_to_Python
-    TheEnd.to_lang = TheEnd_to_Python
-    init_core_QASM_gates()
+    return {
+        TensorNetwork: TensorNetwork_to_Python,
+        ClassicalRegister: ClassicalRegister_to_Python,
+        DeferredClassicalRegister: ClassicalRegister_to_Python,
+        LocalClassicalRegister: ClassicalRegister_to_Python,
+        QuantumRegister: QuantumRegister_to_Python,
+        Let: Let_to_Python,
+        Argument: Argument_to_Python,
+        CallGate: CallGate_to_Python,
+        Comment: Comment_to_Python,
+        Measure: Measure_to_Python,
+        IfBlock: IfBlock_to_Python,
+        While: While_to_Python,
+        Gate: CreateGate_to_Python,
+        Circuit: CreateGate_to_Python,
+        Procedure: CreateGate_to_Python,
+        Opaque: CreateGate_to_Python,
+        CBlock: CBlock_to_Python,
+        Loop: Loop_to_Python,
+        NestLoop: NestLoop_to_Python,
+        Reset: Reset_to_Python,
+        Output: Output_to_Python,
+        InitEnv: init_env,
+        Return: Return_to_Python,
+        Include: Include_to_Python,
+        Alias: Alias_to_Python,
+        DeferredAlias: Alias_to_Python,
+        Dealloc: lambda self: "",
+        SetAlias: SetAlias_to_Python,
+        MathsBlock: resolve_maths,
+        Next: Next_to_Python,
+        Cycle: Cycle_to_Python,
+        CycleTarget: CycleTarget_to_Python,
+        Finish: Finish_to_Python,
+        FinishTarget: FinishTarget_to_Python,
+        TheEnd: TheEnd_to_Python,
+        TailCall: TailCall_to_Python,
+        SampleShots: SampleShots_to_Python,
+        BatchReset: BatchReset_to_Python,
+        ApplyMatrix: ApplyMatrix_to_Python,
+        MatrixLiteral: MatrixLiteral_to_Python
+    }
+
+def children_table():
+    """
+    Functions giving the code written in the block of each type, where it is not its own code.
+
+    :returns: Function returning the children of nodes of each class
+    :rtype: dict
+    """
+    return {Loop: Loop_code_Python}
 
 # Several details pertaining to the language in question
 HOIST_FUNCS = False    # Move functions to front of program
@@ -60,34 +77,35 @@ HOIST_VARS = False     # Move variables to front of program
 BARECODE = False      # Can code be bare or does it need to be in function
 BLOCKOPEN = ":"       # Block delimiters
 BLOCKCLOSE = "\n"       #  ""      ""
+BLOCKEMPTY = "pass"   # Statement for a block with no code
 INDENT = "    "       # Standard indent depth
+EXTENSION = ".py"     # Extension of output files
 
-def init_core_QASM_gates():
-    """ Set up the core gates in python """
-    unitary = Gate.internalGates["U"]
-    controlledNot = Gate.internalGates["CX"]
-    unitaryInverse = Gate.internalGates["_inv_U"]
-    unitaryControl = Gate.internalGates["_ctrl_U"]
-
-    controlledNot.set_code([CBlock(
-        None,
-        """controlledNot(qreg, a, b)""".splitlines())])
-    unitary.set_code([CBlock(
-        None,
-        """rotateZ(qreg,a,lambda)
-rotateX(qreg,a,theta)
-rotateZ(qreg,a,phi)""".splitlines())])
+def core_gate_code():
+    """ Code of the core gates in python
 
-    unitaryInverse.set_code([CBlock(
-        None,
-        """rotateZ(qreg,a,-lambda)
+    :returns: Body of each core gate by name
+    :rtype: dict
+    """
+    return {
+        "CX": [CBlock(
+            None,
+            """controlledNot(qreg, a, b)""".splitlines())],
+        "U": [CBlock(
+            None,
+            """rotateZ(qreg,a,lambda)
+rotateX(qreg,a,theta)
+rotateZ(qreg,a,phi)""".splitlines())],
+        "_inv_U": [CBlock(
+            None,
+            """rotateZ(qreg,a,-phi)
 rotateX(qreg,a,-theta)
-rotateZ(qreg,a,-phi)""".splitlines())])
+rotateZ(qreg,a,-lambda)""".splitlines())],
 
-    # C, not python : Will not work!
-    unitaryControl.set_code([CBlock(
-        None,
-        """Complex _alpha, _beta;
+        # C, not python : Will not work!
+        "_ctrl_U": [CBlock(
+            None,
+            """Complex _alpha, _beta;
 getComplexPairFromRotation(lambda, (Vector) {0, 0, 1}, &_alpha, &_beta);
 ComplexMatrix2 _rot = {
         .real = {{_alpha.real, -_beta.real}, {_beta.real, _alpha.real}}
@@ -105,7 +123,8 @@ ComplexMatrix2 _rot = {
         .real = {{_alpha.real, -_beta.real}, {_beta.real, _alpha.real}}
         .imag = {{_alpha.imag, _beta.imag} {_beta.imag, -_alpha.imag}};
 multiControlledUnitary(qreg, _ctrls, _nCtrls, a_index, _rot);
-""".splitlines())])
+""".splitlines())]
+    }
 
 def Maths_to_Python(parent, maths: MathsBlock):
     """Resolve mathematical operations into C.
@@ -130,7 +149,10 @@ def Maths_to_Python(parent, maths: MathsBlock):
                     else:
                         raise OSError
                     continue
-                operand = resolve_maths(parent, operand)
+                if isinstance(operand, MathsBlock): # Bracket nested operations to preserve precedence
+                    operand = f"({resolve_maths(parent, operand)})"
+                else:
+                    operand = resolve_maths(parent, operand)
                 if operator == "nop":
                     outStr += f"{operand}"
                 elif operator in identOp:
@@ -370,10 +392,25 @@ def TheEnd_to_Python(self):
         return f"quit()"
     return "return"
 
+def TailCall_to_Python(self):
+    """Syntax conversion for restarting a gate with the arguments of a call to itself."""
+    call = self.call
+    gate = self.parent
+    values = [*(resolve_arg(qarg) for qarg in call.qargs),
+              *(resolve_maths(call.parent, parg) for parg in call.pargs),
+              *(resolve_maths(call.parent, sparg) for sparg in call.spargs)]
+    names = [arg.name for arg in (*gate.qargs, *gate.pargs, *gate.spargs)]
+    changed = [(name, value) for name, value in zip(names, values) if value != name]
+    outStr = ""
+    if changed:
+        outStr = (", ".join(name for name, _ in changed) + " = " +
+                  ", ".join(value for _, value in changed) + "\n")
+    return outStr + "continue"
+
 class Try(SubBlock):
-    def __init__(self, parent, block):
+    def __init__(self, parent, block, code):
         SubBlock.__init__(self, parent, NullBlock(block))
-        self._code = parent.code
+        self._code = code
 
     def to_lang(self):
         return "try"
@@ -390,41 +427,46 @@ class Except(SubBlock):
 def Loop_to_Python(self):
     """Syntax conversion for declaring a loop (inclusive)."""
     resolve = lambda b: resolve_maths(self, b)
-    start = map(resolve, self.start)
-    end = map(resolve, self.end)
-    step = map(resolve, self.step)
-
-    if self.finish or self.cycle:
+    start = list(map(resolve, self.start))
+    step = list(map(resolve, self.step))
+    end = []
+    # Stop one past the inclusive end in the direction of the step
+    for term, incr in zip(map(resolve, self.end), step):
+        try:
+            end.append(f"{term}-1" if int(incr.replace(" ", "")) < 0 else f"{term}+1")
+        except ValueError:
+            end.append(f"{term}+1")
 
+    if len(self.var) == 1:
+        return f"for {''.join(self.var)} in range({''.join(start)}, {''.join(end)}, {''.join(step)})"
 
-        for i in range(len(self.code)-1, 0, -1):
-            if not isinstance(self._code[i-1], (Next, CycleTarget, FinishTarget)):
-                break
-
-        nonBlock = self.code[i:]
-        del self._code[i:]
-        self._code = [Try(self, self.currentFile), Except(self, self.currentFile, nonBlock)]
+    ranges = [f"range({init}, {term}, {incr})" for init, term, incr in zip(start, end, step)]
 
 
-    if len(self.var) == 1:
-        return f"for {''.join(self.var)} in range({''.join(start)}, {''.join(end)}+1, {''.join(step)})"
+    return f"for {', '.join(self.var)} in zip({', '.join(ranges)})"
 
-    ranges = [f"range({init}, {term}+1, {incr})" for init, term, incr in zip(start, end, step)]
+def Loop_code_Python(self):
+    """Body of a loop, wrapped to catch the skips of cycle and finish if it has any."""
+    if not (getattr(self, "finish", False) or getattr(self, "cycle", False)):
+        return self.code
 
+    for i in range(len(self.code)-1, 0, -1):
+        if not isinstance(self.code[i-1], (Next, CycleTarget, FinishTarget)):
+            break
 
-    return f"for {', '.join(self.var)} in zip({', '.join(ranges)})"
+    return [Try(self, self.currentFile, self.code[:i]), Except(self, self.currentFile, self.code[i:])]
 
 def NestLoop_to_Python(self):
-    """Syntax conversion for declaring a loop (exclusive)."""
+    """Syntax conversion for declaring a loop (inclusive)."""
     resolve = lambda b: resolve_maths(self, b)
     start = map(resolve, self.start)
     end = map(resolve, self.end)
     step = map(resolve, self.step)
 
     if len(self.var) == 1:
-        return f"for {''.join(self.var)} in range({''.join(start)}, {''.join(end)}, {''.join(step)})"
+        return f"for {''.join(self.var)} in range({''.join(start)}, {''.join(end)}+1, {''.join(step)})"
 
-    ranges = [f"range({init}, {term}, {incr})" for init, term, incr in zip(start, end, step)]
+    ranges = [f"range({init}, {term}+1, {incr})" for init, term, incr in zip(start, end, step)]
     return f"for {', '.join(self.var)} in zip({', '.join(ranges)})"
 
 
@@ -453,6 +495,31 @@ def CallGate_to_Python(self):
     outString = f"{printGate}({printArgs})"
     return outString
 
+def python_matrix(matrix):
+    """Syntax conversion for a dense matrix as nested lists of complex numbers."""
+    return "[" + ", ".join("[" + ", ".join(repr(complex(val)) for val in row) + "]" for row in matrix) + "]"
+
+def MatrixLiteral_to_Python(self):
+    """Syntax conversion for declaring a shared unitary computed at compile time."""
+    return f"{self.name} = {python_matrix(self.matrix)}"
+
+def ApplyMatrix_to_Python(self):
+    """Syntax conversion for applying a unitary computed at compile time."""
+    targets = [resolve_arg(qarg) for qarg in self.qargs]
+    if self.controls:
+        controls = ', '.join(resolve_arg(qarg) for qarg in self.controls)
+        prefix, ctrlArgs = "multiControlled", f"[{controls}], {self.nControls}, "
+    else:
+        prefix, ctrlArgs = "", ""
+    apply = lambda func: prefix + func[0].upper() + func[1:] if prefix else func
+
+    matrix = self.literal.name if self.literal else python_matrix(self.matrix)
+    if self.nQubits == 1:
+        return f"{apply('unitary')}(qreg, {ctrlArgs}{targets[0]}, {matrix})"
+    if self.nQubits == 2:
+        return f"{apply('twoQubitUnitary')}(qreg, {ctrlArgs}{', '.join(targets)}, {matrix})"
+    return f"{apply('multiQubitUnitary')}(qreg, {ctrlArgs}[{', '.join(targets)}], {self.nQubits}, {matrix})"
+
 def Measure_to_Python(self):
     """Syntax conversion for a measurement."""
     parg = self.pargs
@@ -464,16 +531,53 @@ def Measure_to_Python(self):
 def Reset_to_Python(self):
     """Syntax conversion for resetting quantum state to zero."""
     qarg = self.qargs
-    qargRef = self.resolve_arg(qarg)
-    return f'''_a = measure(qreg, {qargRef})
-if (_a) pauliX(qreg, {qargRef})
-del _a
+    qargRef = resolve_arg(qarg)
+    return f'''if measure(qreg, {qargRef}):
+    pauliX(qreg, {qargRef})'''
+
+def BatchReset_to_Python(self):
+    """Syntax conversion for resetting several qubits to zero at once."""
+    if self.whole:
+        return "initZeroState(qreg)"
+
+    qargRefs = []
+    for reg, index in self.qargs:
+        if isinstance(index, tuple) and not (isinstance(reg, Argument) and reg.size == 1):
+            start, end = map(resolve_index, index)
+            qargRefs.append(f"*{resolve_arg([reg, (start, f'{end}+1')])}")
+        else:
+            qargRefs.append(resolve_arg([reg, index[0] if isinstance(index, tuple) else index]))
+    # Qubits found in a basis state need no collapse, and the others collapse to an outcome drawn from the
+    # probability already known rather than being measured afresh
+    return f'''from random import random
+for _qubit in [{', '.join(qargRefs)}]:
+    _prob = calcProbOfOutcome(qreg, _qubit, 1)
+    if _prob > 1 - 1e-12:
+        pauliX(qreg, _qubit)
+    elif _prob > 1e-12:
+        _outcome = int(random() < _prob)
+        collapseToOutcome(qreg, _qubit, _outcome)
+        if _outcome:
+            pauliX(qreg, _qubit)'''
+
+def SampleShots_to_Python(self):
+    """Syntax conversion for sampling shots from the final state."""
+    qargRefs = ", ".join(resolve_arg(qarg) for qarg in self.qargs)
+    return f'''from random import choices
+_shotQubits = [{qargRefs}]
+_nStates = 2**qreg.numQubitsRepresented
+_shotCounts = {{}}
+for _state in choices(range(_nStates), weights=[getProbAmp(qreg, _i) for _i in range(_nStates)], k={self.shots}):
+    _outcome = tuple((_state >> _qubit) & 1 for _qubit in _shotQubits)
+    _shotCounts[_outcome] = _shotCounts.get(_outcome, 0) + 1
+for _outcome, _count in sorted(_shotCounts.items()):
+    print(*_outcome, ":", _count)
 '''
 
-
-def UseTN():
-    CallGate.to_lang = CallGateTN_to_Python
-#    Reset.to_lang = ResetTN_to_Python
+def tn_table():
+    """ Functions replacing those of to_lang_table for tensor network simulation """
+    return {CallGate: CallGateTN_to_Python}
+#            Reset: ResetTN_to_Python
 INCLUDE_TN = python_include("TNPy")
 
 def CallGateTN_to_Python(self):
@@ -0,0 +1,195 @@
+"""
+Module to schedule, run and time the optimisation passes applied between parsing and translation
+"""
+import time
+from QASMParser.parser.types import (Include)
+from QASMParser.optimise.constfold import (fold_constants)
+from QASMParser.optimise.specialise import (specialise_gates)
+from QASMParser.optimise.recursion import (eliminate_recursion)
+from QASMParser.optimise.lightcone import (prune_light_cone)
+from QASMParser.optimise.idle import (prune_idle_qubits)
+from QASMParser.optimise.peephole import (optimise_gates)
+from QASMParser.optimise.precompute import (precompute_gates)
+from QASMParser.optimise.control import (native_controls)
+from QASMParser.optimise.fusion import (fuse_gates)
+from QASMParser.optimise.reuse import (reuse_qubits)
+from QASMParser.optimise.resets import (optimise_resets)
+from QASMParser.optimise.shots import (sample_shots)
+from QASMParser.optimise.sets import (coalesce_sets)
+from QASMParser.optimise.loops import (optimise_loops)
+from QASMParser.optimise.codesize import (fit_code_size)
+from .errors import (remapWarning, resetsWarning, shotsWarning, passCycleWarning, passNameWarning,
+                     passDupWarning)
+
+class Pass:
+    """ Optimisation pass known to the manager
+
+    :param name: Name of the pass, as used by after and in reports
+    :param run: Function applying the pass in place to a ProgFile (and its argument if any), returning a report
+    :param level: Lowest optimisation level which enables the pass, None if it must be requested explicitly
+    :param default: Argument the pass is given when enabled by level, None if it takes none
+    :param after: Names of passes which must run first if they run at all
+    :param partitionWarning: Printed instead of running the pass when partitioning, None if the pass is compatible
+    """
+    def __init__(self, name, run, level=None, default=None, after=(), partitionWarning=None):
+        self.name = name
+        self.run = run
+        self.level = level
+        self.default = default
+        self.after = tuple(after)
+        self.partitionWarning = partitionWarning
+
+PASSES = {}
+
+def register_pass(name, run, level=None, default=None, after=(), partitionWarning=None):
+    """ Add a pass to the registry
+
+    :param name: Name of the pass
+    :param run: Function applying the pass, see Pass
+    :param level: Lowest optimisation level which enables the pass
+    :param default: Argument the pass is given when enabled by level
+    :param after: Names of passes which must run first
+    :param partitionWarning: Warning printed instead of running the pass when partitioning
+    :returns: The pass registered
+    :rtype: Pass
+    """
+    if name in PASSES:
+        raise ValueError(passDupWarning.format(name))
+    PASSES[name] = Pass(name, run, level, default, after, partitionWarning)
+    return PASSES[name]
+
+def _order_qubits(codeObj, nRanks):
+    """ Run qubit ordering, which needs the code graph dependencies only when requested """
+    from QASMParser.optimise.locality import (order_qubits)
+    return order_qubits(codeObj, nRanks)
+
+register_pass("fold-constants", fold_constants, level=1)
+register_pass("specialise", specialise_gates, level=2, after=("fold-constants",))
+register_pass("eliminate-recursion", eliminate_recursion, level=2, default=0, after=("specialise",))
+register_pass("light-cone", prune_light_cone, level=2, after=("fold-constants", "eliminate-recursion"))
+register_pass("prune-qubits", prune_idle_qubits, level=3, after=("light-cone",),
+              partitionWarning=remapWarning.format("Idle qubit pruning"))
+register_pass("peephole", optimise_gates, level=1, after=("specialise", "light-cone", "prune-qubits"))
+register_pass("precompute", precompute_gates, level=2, default=2, after=("peephole",))
+register_pass("native-control", native_controls, level=2, after=("precompute",))
+register_pass("fuse", fuse_gates, level=3, default=3, after=("peephole", "native-control"))
+register_pass("reuse-qubits", reuse_qubits, level=3, after=("prune-qubits", "fuse"),
+              partitionWarning=remapWarning.format("Qubit reuse"))
+register_pass("ranks", _order_qubits, after=("reuse-qubits",),
+              partitionWarning=remapWarning.format("Qubit ordering"))
+register_pass("optimise-resets", optimise_resets, level=2, after=("reuse-qubits", "ranks"),
+              partitionWarning=resetsWarning)
+register_pass("shots", sample_shots, after=("optimise-resets",), partitionWarning=shotsWarning)
+register_pass("coalesce-sets", coalesce_sets, level=1, after=("fold-constants",))
+register_pass("code-size", fit_code_size,
+              after=("fold-constants", "specialise", "eliminate-recursion", "peephole", "precompute",
+                     "native-control", "fuse", "optimise-resets", "shots", "coalesce-sets"))
+register_pass("optimise-loops", optimise_loops, level=1,
+              after=("fold-constants", "specialise", "eliminate-recursion", "peephole", "precompute",
+                     "native-control", "fuse", "optimise-resets", "shots", "coalesce-sets", "code-size"))
+
+def count_nodes(code):
+    """ Count the lines of code, including those of circuit bodies, included files and child blocks """
+    count = 0
+    for line in code:
+        count += 1
+        if isinstance(line, Include):
+            count += count_nodes(line.raw_code)
+        elif isinstance(getattr(line, "code", None), list):
+            count += count_nodes(line.code)
+    return count
+
+class PassRecord:
+    """ Outcome of one pass """
+    def __init__(self, name, report=None, seconds=0., before=0, after=0, skipped=None):
+        self.name = name
+        self.report = report
+        self.seconds = seconds
+        self.before = before
+        self.after = after
+        self.skipped = skipped
+
+class PassManagerReport:
+    """ Record of the passes run, each with its own report, wall time and change in node count """
+    def __init__(self, level):
+        self.level = level
+        self.records = []
+
+    seconds = property(lambda self: sum(record.seconds for record in self.records))
+
+    def __str__(self):
+        lines = [str(record.report) if record.skipped is None else record.skipped for record in self.records]
+        ran = [record for record in self.records if record.skipped is None]
+        if ran:
+            width = max(len(record.name) for record in ran)
+            lines.append(f"Passes: {len(ran)} run at -O{self.level} in {self.seconds*1000:.1f} ms")
+            lines += [f"  {record.name:<{width}} {record.seconds*1000:9.1f} ms  "
+                      f"{record.before:7d} -> {record.after:7d} nodes ({record.after - record.before:+d})"
+                      for record in ran]
+        return "\n".join(lines)
+
+class PassManager:
+    """ Select and order the passes to run on a program
+
+    A pass runs if the optimisation level enables it or it is requested explicitly. The passes run in an order
+    consistent with their after dependencies, ties going to the order in which they were registered.
+
+    :param level: Optimisation level, from 0 (only passes requested) to MAX_OPTIMISE_LEVEL
+    :param requested: Arguments of the passes requested explicitly by name, None for passes taking no argument
+    :param partition: Whether the program will be partitioned
+    """
+    def __init__(self, level=0, requested=None, partition=False):
+        self.level = level
+        self.requested = dict(requested) if requested else {}
+        self.partition = partition
+        for name in self.requested:
+            if name not in PASSES:
+                raise ValueError(passNameWarning.format(name))
+
+    def selected(self):
+        """ Arguments of the passes to run, by name """
+        selected = {name: optPass.default for name, optPass in PASSES.items()
+                    if optPass.level is not None and optPass.level <= self.level}
+        selected.update(self.requested)
+        return selected
+
+    def schedule(self):
+        """ Order the passes to run so that each runs after those it depends on
+
+        :returns: Passes to run, in order
+        :rtype: list
+        """
+        selected = self.selected()
+        names = [name for name in PASSES if name in selected]
+        done = set()
+        order = []
+        while names:
+            ready = next((name for name in names
+                          if all(dep in done or dep not in selected for dep in PASSES[name].after)), None)
+            if ready is None:
+                raise ValueError(passCycleWarning.format(", ".join(names)))
+            names.remove(ready)
+            done.add(ready)
+            order.append(PASSES[ready])
+        return order
+
+    def run(self, codeObj):
+        """ Apply the selected passes in place to codeObj
+
+        :param codeObj: ProgFile to optimise
+        :returns: Report of each pass and its cost
+        :rtype: PassManagerReport
+        """
+        report = PassManagerReport(self.level)
+        selected = self.selected()
+        for optPass in self.schedule():
+            if self.partition and optPass.partitionWarning is not None:
+                report.records.append(PassRecord(optPass.name, skipped=optPass.partitionWarning))
+                continue
+            args = () if selected[optPass.name] is None else (selected[optPass.name],)
+            before = count_nodes(codeObj.code)
+            start = time.perf_counter()
+            passReport = optPass.run(codeObj, *args)
+            seconds = time.perf_counter() - start
+            report.records.append(PassRecord(optPass.name, passReport, seconds, before, count_nodes(codeObj.code)))
+        return report
@@ -2,45 +2,142 @@
 Extend the ProgFile to transpile code
 """
 
-from importlib import import_module
+import io
+import re
 import sys
+import hashlib
 import os.path
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from QASMParser.parser.types import (Comment, Include, Gate, Opaque, Verbatim, InitEnv, QuantumRegister, Let, CBlock)
+from QASMParser.parser.types import (Comment, Include, Gate, Opaque, Verbatim, InitEnv, QuantumRegister, Let, CBlock,
+                                     MatrixLiteral)
 
-from .errors import(langNotDefWarning, langMismatchWarning)
+from .backend import (Backend)
+from .errors import(langMismatchWarning, splitLangWarning, splitOutputWarning)
 
+# Held while the count of declared qubits is restored around the declaration of the state register
+_declareLock = threading.Lock()
+
+# Characters of output held in memory before they are written to the output file
+BUFFER_SIZE = 1 << 20
+
+class Emitter:
+    """ Buffered writer of indented lines of output
+
+    Lines are gathered into chunks of about bufferSize characters, each written with a single call, so that the
+    output is streamed to the file with few writes whatever its size.
+
+    :param outputFile: File-like object to write to
+    :param indent: Indentation of one level of depth
+    :param bufferSize: Characters held before writing them out
+    """
+    def __init__(self, outputFile, indent, bufferSize=BUFFER_SIZE):
+        self.outputFile = outputFile
+        self.indent = indent
+        self.bufferSize = bufferSize
+        self.depth = -1
+        self._chunk = []
+        self._size = 0
+
+    def writeln(self, writeIn):
+        """ Write each line of writeIn indented to the current depth
+
+        :param writeIn: String of one or more lines, without their final newline
+        """
+        prefix = self.depth*self.indent
+        for toWrite in writeIn.splitlines():
+            line = prefix + toWrite + "\n"
+            self._chunk.append(line)
+            self._size += len(line)
+        if self._size >= self.bufferSize:
+            self.flush()
+
+    def write(self, text):
+        """ Write text which is already indented and ends in a newline
+
+        :param text: Lines to write
+        """
+        self._chunk.append(text)
+        self._size += len(text)
+        if self._size >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        """ Write out the lines held """
+        if self._chunk:
+            self.outputFile.write("".join(self._chunk))
+            self._chunk = []
+            self._size = 0
 
 def to_lang(codeObj, filename=None, langOut="C", **options):
     """
-    Translate file into provided language.
+    Translate file into provided language or languages.
     If filename is provided write translation to file.
     Replace included files with their in language equivalents for module support.
 
-    :param filename: output file to write
+    :param filename: output file to write, with the extension of each language if there are several
     :param module: whether to compile
     :param includes: dictionary of substitutions for included files
-    :param langOut: output language
+    :param langOut: output language, or list of output languages all written from the same code
     :param verbose: whether to provide original QASM alongside
+    :param threads: number of threads translating hoisted circuit definitions in parallel
+    :param cache: CodeCache of translated circuit definitions to reuse, ignored if verbose
+    :param split: number of files of circuit definitions to split the translation into, written with a header,
+                  the main program and a Makefile to the directory filename
+    :returns: None
+    :rtype: None
+    """
+    langs = [langOut] if isinstance(langOut, str) else list(langOut)
+    backends = [Backend(lang) for lang in langs]
+
+    for backend in backends:
+        if codeObj.classLang is not None and codeObj.classLang != backend.name:
+            raise NotImplementedError(langMismatchWarning.format(codeObj.classLang, backend.name))
+        if options.get("split") and not backend.splittable:
+            raise NotImplementedError(splitLangWarning.format(backend.name))
+
+    if options.get("split") and (not filename or len(backends) > 1):
+        raise IOError(splitOutputWarning)
+
+    # The code and the set up of the registers are shared by every language
+    code = list(expand_includes(codeObj.code, options.get("includes", {})))
+    setup = fix_qureg(codeObj)
+
+    for backend in backends:
+        outputName = filename
+        if filename and len(backends) > 1:
+            outputName = os.path.splitext(filename)[0] + backend.lang.EXTENSION
+        with backend.active():
+            write_lang(codeObj, code, setup, outputName, backend, options)
+
+def write_lang(codeObj, code, setup, filename, backend, options):
+    """
+    Write the translation of the code of codeObj into the language of backend.
+
+    :param codeObj: ProgFile being translated
+    :param code: code of codeObj with included files expanded
+    :param setup: code setting up the environment and registers at the start of the main program
+    :param filename: output file to write, stdout if None
+    :param backend: active backend of the output language
     :returns: None
     :rtype: None
     """
-    includes = options.get("includes", {})
+    lang = backend.lang
+    if codeObj.useTN:
+        backend.use_tn()
 
-    try:
-        lang = import_module(f"QASMToQuEST.langs.{langOut}")
-        lang.set_lang()
-    except ImportError:
-        raise NotImplementedError(langNotDefWarning.format(langOut))
-
-    indent = lang.INDENT
-    if codeObj.classLang is not None and codeObj.classLang != langOut:
-        raise NotImplementedError(langMismatchWarning.format(codeObj.classLang, langOut))
-
-    def print_code(codeObj, code, outputFile):
-        nonlocal depth
-        depth += 1
+    # The original lines written alongside in verbose mode are not part of the key of a cached definition
+    cache = None if options["verbose"] else options.get("cache")
+
+    def print_code(codeObj, code, emitter, cached=True):
+        writeln = emitter.writeln
+        emitter.depth += 1
         for line in code:
+            if cached and cache is not None and isinstance(line, Gate) and cache.cacheable(line):
+                emitter.write(gate_text(line, emitter.depth))
+                continue
+
             # Verbose -- Print original
             if options["verbose"] and hasattr(line, 'original') and not isinstance(line, Comment):
                 writeln(Comment(codeObj, line.original).to_lang() + "\n")
@@ -50,7 +147,7 @@ def to_lang(codeObj, filename=None, langOut="C", **options):
 
             if hasattr(line, "loops") and line.loops: # Handle loops
                 writeln(line.loops.to_lang() + lang.BLOCKOPEN)
-                print_code(codeObj, line.loops.code, outputFile)
+                print_code(codeObj, backend.code_of(line.loops), emitter)
                 writeln(lang.BLOCKCLOSE)
 
             elif isinstance(line, CBlock): # Handle verbatim language blocks
@@ -58,91 +155,249 @@ def to_lang(codeObj, filename=None, langOut="C", **options):
 
             elif hasattr(line, "code"): # Print children
                 writeln(line.to_lang() + lang.BLOCKOPEN)
-                print_code(codeObj, line.code, outputFile)
+                children = backend.code_of(line)
+                if lang.BLOCKEMPTY and all(isinstance(child, Comment) for child in children):
+                    print_code(codeObj, [CBlock(codeObj, [lang.BLOCKEMPTY])], emitter)
+                print_code(codeObj, children, emitter)
                 writeln(lang.BLOCKCLOSE)
 
             elif issubclass(type(line), Verbatim):
                 if lang.BLOCKCLOSE and lang.BLOCKCLOSE in line.line:
-                    depth -= 1
+                    emitter.depth -= 1
                 writeln(line.to_lang())
                 if lang.BLOCKOPEN and lang.BLOCKOPEN in line.line:
-                    depth += 1
+                    emitter.depth += 1
 
             else: # Print codeObj
                 writeln(line.to_lang())
 
-        depth -= 1
+        emitter.depth -= 1
+
+    def translate_gate(gate, depth=0):
+        """ Translation of a single circuit definition written at depth, possibly in a worker thread """
+        text = io.StringIO()
+        gateEmitter = Emitter(text, lang.INDENT)
+        gateEmitter.depth = depth - 1
+        with backend.active():
+            print_code(codeObj, [gate], gateEmitter, cached=False)
+        gateEmitter.flush()
+        return text.getvalue()
+
+    def gate_text(gate, depth=0):
+        """ Translation of a circuit definition, reused from the cache if it is unchanged """
+        if cache is not None and cache.cacheable(gate):
+            return cache.fetch(codeObj, gate, backend, depth, lambda: translate_gate(gate, depth))
+        return translate_gate(gate, depth)
+
+    def gate_texts(gates):
+        """ Translations of circuit definitions in order, in several threads if requested """
+        threads = options.get("threads", 1)
+        if threads > 1 and len(gates) > 1:
+            with ThreadPoolExecutor(threads) as pool:
+                yield from pool.map(gate_text, gates)
+        else:
+            yield from map(gate_text, gates)
+
+    def render(lines):
+        """ Text of lines written at the top level """
+        text = io.StringIO()
+        unitEmitter = Emitter(text, lang.INDENT)
+        print_code(codeObj, lines, unitEmitter)
+        unitEmitter.flush()
+        return text.getvalue()
+
+    def write_units(directory, name, nUnits):
+        """ Write the translation to directory as a header declaring everything defined at file scope, nUnits
+        files of circuit definitions, a file of the main program and a Makefile building them in parallel.
+        Files whose text is unchanged are not rewritten, so that make only rebuilds what changed.
+        """
+        os.makedirs(directory, exist_ok=True)
+        comments = render([Comment(codeObj, line) for line in codeObj.currentFile.header])
+        include = lang.inc(f"{name}.h")
+
+        # The mappings of the registers are defined at file scope of the main program and declared in the header
+        mappings, mainSetup = [], []
+        for line in setup:
+            if isinstance(line, Let) and line.const.varType == "const listint":
+                if mainSetup and isinstance(mainSetup[-1], Comment):
+                    mappings.append(mainSetup.pop())
+                mappings.append(line)
+            else:
+                mainSetup.append(line)
+
+        # Circuits of included pre-transpiled sources are defined in the main program but called from any unit
+        external = [line for imported in hoistedIncludes for line in expand_includes(imported.raw_code, {})
+                    if isinstance(line, Gate)]
+        mainProg = Opaque(codeObj, funcName, returnType="int")
+        mainProg.set_code(mainSetup + codeToWrite)
+        declared = external + matrices + gates + ([mainProg] if options["module"] else [])
+
+        guard = re.sub(r"\W", "_", name).upper() + "_H"
+        header = [comments, f"#ifndef {guard}\n#define {guard}\n"]
+        header += [line + "\n" for line in lang.UNIT_HEADER]
+        if codeObj.useTN:
+            header.append(lang.INCLUDE_TN + "\n")
+        header += [backend.declare(line) + "\n" for line in declared]
+        header += [render([line]) if isinstance(line, Comment) else backend.declare(line) + "\n"
+                   for line in mappings]
+        header.append("#endif\n")
+        files = {f"{name}.h": "".join(header)}
+
+        texts = list(gate_texts(gates))
+        units = balance_units([gate.name for gate in gates], [len(text) for text in texts],
+                              max(1, min(nUnits, len(gates))))
+        unitNames = [f"{name}_gates{index}.c" for index in range(len(units))]
+        for unitName, unit in zip(unitNames, units):
+            files[unitName] = comments + include + "\n" + "".join(texts[index] for index in unit)
+
+        files[f"{name}.c"] = (comments + include + "\n" + render(list(reversed(hoistedIncludes))) +
+                              render(matrices) + render(mappings) + render([mainProg]))
+
+        objects = " ".join(os.path.splitext(unitName)[0] + ".o" for unitName in unitNames + [f"{name}.c"])
+        files["Makefile"] = lang.MAKEFILE.format(
+            name=name, reqasm=lang.REQASM_DIR, objects=objects,
+            target=f"lib{name}.a" if options["module"] else name,
+            link=lang.MAKEFILE_ARCHIVE if options["module"] else lang.MAKEFILE_LINK)
+
+        for fileName, text in files.items():
+            write_if_changed(os.path.join(directory, fileName), text)
+
+        # Remove units left from an earlier translation into more units
+        stale = re.compile(re.escape(name) + r"_gates\d+\.c")
+        for fileName in os.listdir(directory):
+            if stale.fullmatch(fileName) and fileName not in files:
+                os.remove(os.path.join(directory, fileName))
+
+    # Name of the function of the main program
+    if options["module"]:
+        if filename:
+            funcName = os.path.splitext(os.path.basename(os.path.normpath(filename)))[0]
+        else:
+            funcName = "module"
+    else:
+        funcName = "main"
+
+    # Sort the code into what is hoisted and what is left in the main program in a single pass
+    hoistedIncludes, matrices, gates, codeToWrite = [], [], [], []
+    quantumRegisters = {id(reg) for reg in codeObj.quantumRegisters}
+    internals = list(Gate.internalGates.values()) if options["include_internals"] else []
+    for line in internals + code:
+        if lang.HOIST_INCLUDES and isinstance(line, Include):
+            hoistedIncludes.append(line)
+        elif lang.HOIST_FUNCS and isinstance(line, MatrixLiteral):
+            matrices.append(line)
+        elif lang.HOIST_FUNCS and isinstance(line, Gate):
+            gates.append(line)
+        elif id(line) not in quantumRegisters:
+            codeToWrite.append(line)
+
+    if options.get("split"):
+        write_units(filename, os.path.basename(os.path.normpath(filename)), options["split"])
+        return
 
     if filename:
         outputFile = open(filename, 'w')
     else:
         outputFile = sys.stdout
 
-    # Create copy to work with
-    codeToWrite = codeObj.code[:]
-    depth = -1
-
-    writeln = lambda writeIn: [outputFile.write(depth*indent + toWrite + "\n")
-                               for toWrite in writeIn.splitlines()]
+    emitter = Emitter(outputFile, lang.INDENT)
+    writeln = emitter.writeln
 
-    for line in codeObj.currentFile.header:
-        writeln(Comment(codeObj, line).to_lang())
+    # Write out what was translated even if the translation fails part way
+    try:
+        for line in codeObj.currentFile.header:
+            writeln(Comment(codeObj, line).to_lang())
 
-    # If our language needs to add things to the header
-    if options["module"]:
-        if filename:
-            funcName = os.path.splitext(os.path.basename(filename))[0]
-        else:
-            funcName = "module"
-    else:
-        funcName = "main"
-        if hasattr(lang, 'HEADER'):
+        if not options["module"] and hasattr(lang, 'HEADER'):
             if isinstance(lang.HEADER, (list, tuple)):
                 for line in lang.HEADER:
                     writeln(line)
             elif isinstance(lang.HEADER, str):
                 writeln(lang.HEADER)
 
-    incs = (x for x in codeToWrite if isinstance(x, Include))
-    for include in incs:
-        target = codeToWrite.index(include)
-        if include.filename in includes:
-            codeToWrite[target].set_import(includes[include.filename])
-        else:
-            codeToWrite[target:target+1] = include.raw_code
-
-    if lang.HOIST_INCLUDES:
-        codeToWrite = sorted(codeToWrite, key=lambda x: isinstance(x, Include))
-        while isinstance(codeToWrite[-1], Include):
-            print_code(codeObj, [codeToWrite.pop()], outputFile)
+        print_code(codeObj, reversed(hoistedIncludes), emitter)
 
-    if codeObj.useTN:
-        lang.UseTN()
-        writeln(lang.INCLUDE_TN)
-
-    if options["include_internals"]:
-        codeToWrite = list(Gate.internalGates.values()) + codeToWrite
+        if codeObj.useTN:
+            writeln(lang.INCLUDE_TN)
 
-    if lang.HOIST_FUNCS:
-        codeToWrite = sorted(codeToWrite, key=lambda x: issubclass(type(x), Gate))
-        gate = []
-        while codeToWrite and issubclass(type(codeToWrite[-1]), Gate):
-            gate.append(codeToWrite.pop())
-        print_code(codeObj, reversed(gate), outputFile)
+        # Shared matrices may be used by hoisted functions so must be declared first
+        print_code(codeObj, matrices, emitter)
 
-    # Hoist qregs
-    codeToWrite = [line for line in codeToWrite if line not in codeObj.quantumRegisters]
-    codeToWrite = fix_qureg(codeObj) + codeToWrite
+        # Circuit definitions are independent of each other so may be translated in parallel
+        if options.get("threads", 1) > 1 and len(gates) > 1:
+            for text in gate_texts(gates):
+                emitter.write(text)
+        else:
+            print_code(codeObj, gates, emitter)
 
-    if any([not isinstance(line, Comment) for line in codeToWrite]):
+        # Hoist qregs
         mainProg = Opaque(codeObj, funcName, returnType="int")
-        mainProg.set_code(codeToWrite)
+        mainProg.set_code(setup + codeToWrite)
 
-    print_code(codeObj, [mainProg], outputFile)
+        print_code(codeObj, [mainProg], emitter)
+    finally:
+        emitter.flush()
 
     if filename:
         outputFile.close()
 
+def balance_units(names, sizes, nUnits, slack=1.25):
+    """ Assign circuit definitions to units of similar total size
+
+    Each definition goes to the unit picked by a hash of its name, or if that unit would then hold more than slack
+    times the mean size, to the next unit with room. A definition which changes therefore only moves itself
+    (and rarely its neighbours), so that the other units keep their text.
+
+    :param names: Name of each definition
+    :param sizes: Size of the text of each definition
+    :param nUnits: Number of units
+    :param slack: Most a unit may hold, as a multiple of the mean
+    :returns: Indices of the definitions in each unit, in their original order
+    :rtype: list
+    """
+    capacity = slack * sum(sizes) / nUnits
+    units = [[] for _ in range(nUnits)]
+    load = [0]*nUnits
+    for index, (name, size) in enumerate(zip(names, sizes)):
+        first = int(hashlib.sha256(name.encode()).hexdigest(), 16) % nUnits
+        unit = next((unit % nUnits for unit in range(first, first + nUnits) if load[unit % nUnits] + size <= capacity),
+                    min(range(nUnits), key=load.__getitem__))
+        units[unit].append(index)
+        load[unit] += size
+    return units
+
+def write_if_changed(path, text):
+    """ Write text to path unless it already holds exactly that, so that its timestamp is kept
+
+    :returns: Whether the file was written
+    :rtype: bool
+    """
+    try:
+        with open(path) as existing:
+            if existing.read() == text:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path, "w") as output:
+        output.write(text)
+    return True
+
+def expand_includes(code, includes):
+    """ Yield the lines of code with each included file replaced by its code or, if it has a pre-transpiled
+    substitute, by an import of that
+
+    :param code: Lines of code
+    :param includes: dictionary of substitutions for included files
+    """
+    for line in code:
+        if not isinstance(line, Include):
+            yield line
+        elif line.filename in includes:
+            line.set_import(includes[line.filename])
+            yield line
+        else:
+            yield from expand_includes(line.raw_code, includes)
+
 def fix_qureg(codeObj):
     """ Fix quantum registers to align with QuEST style """
     code = [InitEnv(codeObj)]
@@ -151,7 +406,14 @@ def fix_qureg(codeObj):
         code += [Let(codeObj, (reg.name, "const listint"), (reg.mapping, None))]
 
     if not codeObj.useTN:
-        code += [QuantumRegister(codeObj, "qreg", QuantumRegister.numQubits + QuantumRegister.numGateQubits)]
+        nQubits = QuantumRegister.numPhysicalQubits
+        if nQubits is None:
+            nQubits = QuantumRegister.numQubits + QuantumRegister.numGateQubits
+        # The register of the whole state is not a new qreg so must not count towards the qubits declared
+        with _declareLock:
+            nDeclared = QuantumRegister.numQubits
+            code += [QuantumRegister(codeObj, "qreg", nQubits)]
+            QuantumRegister.numQubits = nDeclared
     else:
         for reg in codeObj.quantumRegisters:
             code += [Comment(codeObj, f'{reg.name}[{reg.start}:{reg.end-1}] => {", ".join(map(str, reg.TNMapping))}')]
@@ -161,11 +423,6 @@ def fix_qureg(codeObj):
 
 def run(codeObj):
     """ Run constructed code in Python """
-    try:
-        lang = import_module(f"QASMToQuEST.langs.Python")
-        lang.set_lang()
-    except ImportError:
-        raise NotImplementedError(langNotDefWarning.format(lang))
-
-    for line in codeObj.code:
-        exec(line.to_lang())
+    with Backend("Python").active():
+        for line in codeObj.code:
+            exec(line.to_lang())
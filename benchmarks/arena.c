@@ -0,0 +1,85 @@
+// Microbenchmark of the allocation of the registers of a circuit called in a loop with sizes only known at run time:
+// malloc and free on every call against the arena of reqasm.c
+// Build against QuEST as for a generated program, e.g.
+//   gcc -O2 -I<QuEST>/include -I. benchmarks/arena.c -L<QuEST> -lQuEST -lm
+# include "reqasm.h"
+# include "reqasm.c"
+# include <time.h>
+
+# define NREPS 2000000
+
+// Registers escape through here so that their allocation is not optimised away
+int* volatile escape[4];
+
+static double elapsed(const clock_t start) {
+  return (double) (clock() - start) / CLOCKS_PER_SEC;
+}
+
+// Body of the circuit: measure into tmp, then copy out the parity
+static int body(int* tmp, int* anc, int* par, int* out, const int nBits, const int rep) {
+  tmp[rep % nBits] = 1;
+  anc[0] = tmp[0];
+  par[0] = tmp[nBits - 1] ^ anc[0];
+  out[0] = par[0];
+  escape[0] = tmp;
+  escape[1] = anc;
+  escape[2] = par;
+  escape[3] = out;
+  return out[0];
+}
+
+static int heapCircuit(const int nBits, const int rep) {
+  int* tmp = malloc(sizeof(int)*(nBits));
+  for (int i = 0; i < nBits; i++) tmp[i] = 0;
+  int* anc = malloc(sizeof(int)*(nBits / 2 + 1));
+  for (int i = 0; i < nBits / 2 + 1; i++) anc[i] = 0;
+  int* par = malloc(sizeof(int)*(2));
+  for (int i = 0; i < 2; i++) par[i] = 0;
+  int* out = malloc(sizeof(int)*(1));
+  for (int i = 0; i < 1; i++) out[i] = 0;
+  const int result = body(tmp, anc, par, out, nBits, rep);
+  free(tmp);
+  free(anc);
+  free(par);
+  free(out);
+  return result;
+}
+
+static int arenaCircuit(const int nBits, const int rep) {
+  const arenaMark _arenaMark = markArena();
+  int* tmp = arenaAlloc(sizeof(int)*(nBits));
+  int* anc = arenaAlloc(sizeof(int)*(nBits / 2 + 1));
+  int* par = arenaAlloc(sizeof(int)*(2));
+  int* out = arenaAlloc(sizeof(int)*(1));
+  const int result = body(tmp, anc, par, out, nBits, rep);
+  resetArena(_arenaMark);
+  return result;
+}
+
+static void bench(const int maxBits) {
+  long long int sink = 0;
+  clock_t start;
+  double heapTime, arenaTime;
+
+  // Sizes change from call to call, as for a circuit called with its size from a loop variable
+  start = clock();
+  for (int rep = 0; rep < NREPS; rep++) sink += heapCircuit(1 + rep % maxBits, rep);
+  heapTime = elapsed(start);
+  start = clock();
+  for (int rep = 0; rep < NREPS; rep++) sink += arenaCircuit(1 + rep % maxBits, rep);
+  arenaTime = elapsed(start);
+
+  printf("up to %5d bits  malloc %8.4f s  arena %8.4f s  speedup %6.2fx\n",
+         maxBits, heapTime, arenaTime, heapTime / arenaTime);
+  // Keep the results live
+  if (sink == 42) printf("\n");
+}
+
+int main(void) {
+  const int sizes[] = {8, 64, 256, 1024, 4096};
+  printf("%d calls of a circuit with four registers\n", NREPS);
+  for (int i = 0; i < (int) (sizeof(sizes) / sizeof(sizes[0])); i++) {
+    bench(sizes[i]);
+  }
+  return 0;
+}
@@ -0,0 +1,109 @@
+// Microbenchmark of the classical register layouts of reqasm.c: one int per bit against bits packed into words
+// Build against QuEST as for a generated program, e.g.
+//   gcc -O2 -I<QuEST>/include -I. benchmarks/cregs.c -L<QuEST> -lQuEST -lm
+# include "reqasm.h"
+# include "reqasm.c"
+# include <time.h>
+
+# define NREPS 200000
+
+static double elapsed(const clock_t start) {
+  return (double) (clock() - start) / CLOCKS_PER_SEC;
+}
+
+static void bench(const int nBits) {
+  int* ints = malloc(sizeof(int) * nBits);
+  int* intsCopy = malloc(sizeof(int) * nBits);
+  cword* words = calloc(CWORDS(nBits), sizeof(cword));
+  cword* wordsCopy = calloc(CWORDS(nBits), sizeof(cword));
+  const int nDec = nBits < 31 ? nBits : 31;
+  long long int sink = 0;
+  clock_t start;
+  double intTime[4], wordTime[4];
+
+  for (int i = 0; i < nBits; i++) {
+    ints[i] = rand() & 1;
+    setBit(words, i, ints[i]);
+  }
+
+  // Write every bit, as measurement into a register does
+  start = clock();
+  for (int rep = 0; rep < NREPS; rep++) {
+    for (int i = 0; i < nBits; i++) ints[i] = (rep >> (i % 8)) & 1;
+    sink += ints[rep % nBits];
+  }
+  intTime[0] = elapsed(start);
+  start = clock();
+  for (int rep = 0; rep < NREPS; rep++) {
+    for (int i = 0; i < nBits; i++) setBit(words, i, (rep >> (i % 8)) & 1);
+    sink += getBit(words, rep % nBits);
+  }
+  wordTime[0] = elapsed(start);
+
+  // Value of the register in a condition
+  start = clock();
+  for (int rep = 0; rep < NREPS; rep++) {
+    ints[rep % nBits] ^= 1;
+    sink += decOf(ints, nDec) + orOf(ints, nBits);
+  }
+  intTime[1] = elapsed(start);
+  start = clock();
+  for (int rep = 0; rep < NREPS; rep++) {
+    setBit(words, rep % nBits, !getBit(words, rep % nBits));
+    sink += wordOf(words, 0, nDec) + orOfWords(words, 0, nBits);
+  }
+  wordTime[1] = elapsed(start);
+
+  // Parity and count of set bits
+  start = clock();
+  for (int rep = 0; rep < NREPS; rep++) {
+    ints[rep % nBits] ^= 1;
+    sink += xorOf(ints, nBits) + countOf(ints, nBits);
+  }
+  intTime[2] = elapsed(start);
+  start = clock();
+  for (int rep = 0; rep < NREPS; rep++) {
+    setBit(words, rep % nBits, !getBit(words, rep % nBits));
+    sink += xorOfWords(words, 0, nBits) + popcountOf(words, 0, nBits);
+  }
+  wordTime[2] = elapsed(start);
+
+  // Copy and compare, as set and == between registers do
+  start = clock();
+  for (int rep = 0; rep < NREPS; rep++) {
+    ints[rep % nBits] ^= 1;
+    memcpy(intsCopy, ints, sizeof(int) * nBits);
+    sink += memcmp(intsCopy, ints, sizeof(int) * nBits);
+  }
+  intTime[3] = elapsed(start);
+  start = clock();
+  for (int rep = 0; rep < NREPS; rep++) {
+    setBit(words, rep % nBits, !getBit(words, rep % nBits));
+    copyBits(wordsCopy, 0, words, 0, nBits);
+    sink += compareBits(wordsCopy, 0, words, 0, nBits);
+  }
+  wordTime[3] = elapsed(start);
+
+  const char* names[4] = {"write bits", "decOf/orOf", "xorOf/countOf", "copy/compare"};
+  for (int i = 0; i < 4; i++) {
+    printf("%5d bits %-14s int %8.4f s  packed %8.4f s  speedup %6.2fx\n",
+           nBits, names[i], intTime[i], wordTime[i], intTime[i] / wordTime[i]);
+  }
+  // Keep the results live
+  if (sink == 42) printf("\n");
+
+  free(ints);
+  free(intsCopy);
+  free(words);
+  free(wordsCopy);
+}
+
+int main(void) {
+  const int sizes[] = {8, 64, 256, 1024};
+  srand(0);
+  printf("%d repetitions of each operation\n", NREPS);
+  for (int i = 0; i < (int) (sizeof(sizes) / sizeof(sizes[0])); i++) {
+    bench(sizes[i]);
+  }
+  return 0;
+}
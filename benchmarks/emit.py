@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark of translation output on a circuit of many lines, e.g. from the root of this repository
+  python benchmarks/emit.py 1000000
+The program is parsed once at a small size and its gate calls repeated, so that only to_lang is timed
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from QASMParser.parser.parser import (ProgFile)
+from QASMParser.parser.coregates import setup_QASM_gates
+from QASMToQuEST.printer import (to_lang)
+
+SEED = """OPENQASM 2.0;
+qreg q[16];
+qreg r[16];
+creg c[16];
+gate bell a, b {
+  U(pi/2, 0, pi) a;
+  CX a, b;
+}
+U(pi/2, 0, pi) q[0];
+CX q[0], q[1];
+U(0.1, 0.2, 0.3) r[2];
+bell q[3], r[4];
+measure q[5] -> c[5];
+"""
+
+def main():
+    """ Time the translation of a circuit of N lines to each language """
+    parser = argparse.ArgumentParser(description="Time the translation of a circuit of many lines")
+    parser.add_argument("lines", nargs="?", type=int, default=10**6, help="Number of lines of the main program")
+    parser.add_argument("-l", "--language", nargs="+", default=["C", "Python"], help="Output languages")
+    args = parser.parse_args()
+
+    setup_QASM_gates()
+    with tempfile.TemporaryDirectory() as tmpDir:
+        source = os.path.join(tmpDir, "seed.qasm")
+        with open(source, "w") as seedFile:
+            seedFile.write(SEED)
+        prog = ProgFile(source)
+
+        body = [line for line in prog.code if hasattr(line, "qargs")]
+        rest = [line for line in prog.code if not hasattr(line, "qargs")]
+        prog._code = rest + body * (args.lines // len(body))
+        print(f"{len(prog.code)} lines")
+
+        for lang in args.language:
+            output = os.path.join(tmpDir, "out." + {"C": "c", "Python": "py"}.get(lang, lang))
+            start = time.perf_counter()
+            to_lang(prog, output, lang, include_internals=False, includes={}, module=False, verbose=False)
+            seconds = time.perf_counter() - start
+            size = os.path.getsize(output)
+            print(f"{lang:>8}: {seconds:8.2f} s, {len(prog.code)/seconds:10.0f} lines/s, "
+                  f"{size/2**20:8.1f} MiB written")
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"Peak resident memory: {peak/2**10:.1f} MiB")
+
+if __name__ == "__main__":
+    main()
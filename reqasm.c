@@ -5,6 +5,7 @@
 # include <stdio.h>
 # include <stdlib.h>
 # include <string.h>
+# include <time.h>
 
 void U(Qureg qreg, const int a, const float theta, const float phi, const float lambda) {
 
@@ -74,7 +75,7 @@ _Bool xorOfBits(const bitstr bits) {
 _Bool andOfBits(const bitstr bits) {
   _Bool test = 1;
   for (int j = 0; j < bits.nBits; j++) {
-    if (bits.val[j]) {
+    if (!bits.val[j]) {
       test = 0;
       goto endAND;
     }
@@ -84,23 +85,135 @@ _Bool andOfBits(const bitstr bits) {
 }
 
 _Bool orOf(int* a, const int nBits) {
-  bitstr temp = toBitstr(a, nBits);
-  return orOfBits(temp);
+  for (int j = 0; j < nBits; j++) {
+    if (a[j]) return 1;
+  }
+  return 0;
 }
 
 _Bool xorOf(int* a, const int nBits) {
-  bitstr temp = toBitstr(a, nBits);
-  return xorOfBits(temp);
+  return countOf(a, nBits) % 2;
 }
 
 _Bool andOf(int* a, const int nBits) {
-  bitstr temp = toBitstr(a, nBits);
-  return andOfBits(temp);
+  for (int j = 0; j < nBits; j++) {
+    if (!a[j]) return 0;
+  }
+  return 1;
+}
+
+int countOf(int* a, const int nBits) {
+  int sum = 0;
+  for (int j = 0; j < nBits; j++) {
+    sum += a[j];
+  }
+  return sum;
 }
 
 int decOf(int* a, const int nBits) {
-  bitstr temp = toBitstr(a, nBits);
-  return decOfBits(temp);
+  int sum = 0;
+  for (int j = nBits - 1; j >= 0; j--) {
+    sum = 2*sum + a[j];
+  }
+  return sum;
+}
+
+cword wordOf(const cword* reg, const int start, const int nBits) {
+  const int word = start / CWORD_BITS, shift = start % CWORD_BITS;
+  cword val = reg[word] >> shift;
+  if (shift && shift + nBits > CWORD_BITS) {
+    val |= reg[word + 1] << (CWORD_BITS - shift);
+  }
+  return val & CMASK(nBits);
+}
+
+void setWord(cword* reg, const int start, const int nBits, cword val) {
+  const int word = start / CWORD_BITS, shift = start % CWORD_BITS;
+  const cword mask = CMASK(nBits);
+  val &= mask;
+  reg[word] = (reg[word] & ~(mask << shift)) | (val << shift);
+  if (shift && shift + nBits > CWORD_BITS) {
+    reg[word + 1] = (reg[word + 1] & ~(mask >> (CWORD_BITS - shift))) | (val >> (CWORD_BITS - shift));
+  }
+}
+
+void copyBits(cword* dst, const int dstStart, const cword* src, const int srcStart, const int nBits) {
+  if (dstStart % CWORD_BITS == 0 && srcStart % CWORD_BITS == 0) {
+    const int nWords = nBits / CWORD_BITS, tail = nBits % CWORD_BITS;
+    // Read the partial last word before the move, which overwrites it when the destination overlaps the source
+    const cword last = tail ? wordOf(src, srcStart + nWords * CWORD_BITS, tail) : 0;
+    memmove(&dst[dstStart / CWORD_BITS], &src[srcStart / CWORD_BITS], sizeof(cword) * nWords);
+    if (tail) setWord(dst, dstStart + nWords * CWORD_BITS, tail, last);
+    return;
+  }
+  // Copy backwards when the destination overlaps the end of the source
+  if (dst == src && dstStart > srcStart) {
+    for (int done = nBits; done > 0; done -= CWORD_BITS) {
+      const int chunk = done < CWORD_BITS ? done : CWORD_BITS;
+      setWord(dst, dstStart + done - chunk, chunk, wordOf(src, srcStart + done - chunk, chunk));
+    }
+    return;
+  }
+  for (int done = 0; done < nBits; done += CWORD_BITS) {
+    const int chunk = nBits - done < CWORD_BITS ? nBits - done : CWORD_BITS;
+    setWord(dst, dstStart + done, chunk, wordOf(src, srcStart + done, chunk));
+  }
+}
+
+static inline int popcountWord(cword val) {
+#if defined(__GNUC__)
+  return __builtin_popcountll(val);
+#else
+  int count = 0;
+  for (; val; val &= val - 1) count++;
+  return count;
+#endif
+}
+
+_Bool orOfWords(const cword* reg, const int start, const int nBits) {
+  for (int done = 0; done < nBits; done += CWORD_BITS) {
+    const int chunk = nBits - done < CWORD_BITS ? nBits - done : CWORD_BITS;
+    if (wordOf(reg, start + done, chunk)) return 1;
+  }
+  return 0;
+}
+
+_Bool xorOfWords(const cword* reg, const int start, const int nBits) {
+  return popcountOf(reg, start, nBits) % 2;
+}
+
+_Bool andOfWords(const cword* reg, const int start, const int nBits) {
+  for (int done = 0; done < nBits; done += CWORD_BITS) {
+    const int chunk = nBits - done < CWORD_BITS ? nBits - done : CWORD_BITS;
+    if (wordOf(reg, start + done, chunk) != CMASK(chunk)) return 0;
+  }
+  return 1;
+}
+
+int popcountOf(const cword* reg, const int start, const int nBits) {
+  int count = 0;
+  for (int done = 0; done < nBits; done += CWORD_BITS) {
+    const int chunk = nBits - done < CWORD_BITS ? nBits - done : CWORD_BITS;
+    count += popcountWord(wordOf(reg, start + done, chunk));
+  }
+  return count;
+}
+
+int compareBits(const cword* a, const int aStart, const cword* b, const int bStart, const int nBits) {
+  // Compares as unsigned integers with the highest bit most significant
+  for (int done = nBits; done > 0; done -= CWORD_BITS) {
+    const int chunk = done < CWORD_BITS ? done : CWORD_BITS;
+    const cword x = wordOf(a, aStart + done - chunk, chunk), y = wordOf(b, bStart + done - chunk, chunk);
+    if (x != y) return (x > y) - (x < y);
+  }
+  return 0;
+}
+
+int compareWord(const cword* reg, const int start, const int nBits, const cword val) {
+  // Any bit set above the first word makes the register the greater
+  if (nBits > CWORD_BITS && orOfWords(reg, start + CWORD_BITS, nBits - CWORD_BITS)) return 1;
+  const cword low = wordOf(reg, start, nBits < CWORD_BITS ? nBits : CWORD_BITS);
+  return (low > val) - (low < val);
 }
 
 int fllog(const int a, const int c) {
@@ -132,3 +245,143 @@ void setArr(const int n, int* inArr, int* outArr) {
 	outArr[i] = inArr[i];
     }
 }
+
+// Size of the first block of the arena, later blocks double
+# define ARENA_BLOCK 65536
+// Alignment of each allocation from the arena
+# define ARENA_ALIGN 16
+
+typedef struct arenaBlock
+{
+  char* data;
+  size_t size;
+} arenaBlock;
+
+// Blocks are kept once allocated, those past the top block being empty
+static arenaBlock* arenaBlocks = NULL;
+static int nArenaBlocks = 0;
+static arenaMark arenaTop = {-1, 0};
+
+arenaMark markArena(void) {
+  return arenaTop;
+}
+
+void* arenaAlloc(const size_t bytes) {
+  const size_t size = (bytes + ARENA_ALIGN - 1) / ARENA_ALIGN * ARENA_ALIGN;
+  if (arenaTop.block < 0 || arenaTop.top + size > arenaBlocks[arenaTop.block].size) {
+    const int next = arenaTop.block + 1;
+    if (next == nArenaBlocks) {
+      arenaBlocks = realloc(arenaBlocks, sizeof(arenaBlock) * (nArenaBlocks + 1));
+      if (arenaBlocks == NULL) {
+        perror("Failed to grow arena");
+        exit(-1);
+      }
+      arenaBlocks[next].data = NULL;
+      arenaBlocks[next].size = 0;
+      nArenaBlocks++;
+    }
+    if (arenaBlocks[next].size < size) {
+      size_t blockSize = next > 0 ? 2 * arenaBlocks[next - 1].size : ARENA_BLOCK;
+      if (blockSize < size) blockSize = size;
+      free(arenaBlocks[next].data);
+      arenaBlocks[next].data = malloc(blockSize);
+      if (arenaBlocks[next].data == NULL) {
+        perror("Failed to grow arena");
+        exit(-1);
+      }
+      arenaBlocks[next].size = blockSize;
+    }
+    arenaTop.block = next;
+    arenaTop.top = 0;
+  }
+  void* ptr = arenaBlocks[arenaTop.block].data + arenaTop.top;
+  arenaTop.top += size;
+  memset(ptr, 0, bytes);
+  return ptr;
+}
+
+void resetArena(const arenaMark mark) {
+  arenaTop = mark;
+}
+
+// Probability below which a qubit is taken to be in a basis state
+# define RESET_TOL 1e-12
+
+void resetQubits(Qureg qreg, const int* qubits, const int nQubits) {
+  for (int i = 0; i < nQubits; i++) {
+    const qreal prob = calcProbOfOutcome(qreg, qubits[i], 1);
+    if (prob > 1 - RESET_TOL) {
+      pauliX(qreg, qubits[i]);
+    } else if (prob > RESET_TOL) {
+      // The outcome is drawn from the probability already known rather than measured afresh
+      const int outcome = (qreal) rand() / ((qreal) RAND_MAX + 1) < prob;
+      collapseToOutcome(qreg, qubits[i], outcome);
+      if (outcome) pauliX(qreg, qubits[i]);
+    }
+  }
+}
+
+static int compareDraws(const void* a, const void* b) {
+  const qreal x = *(const qreal*) a, y = *(const qreal*) b;
+  return (x > y) - (x < y);
+}
+
+static int compareOutcomes(const void* a, const void* b) {
+  const unsigned long long int x = *(const unsigned long long int*) a, y = *(const unsigned long long int*) b;
+  return (x > y) - (x < y);
+}
+
+void seedShots(void) {
+  srand(time(NULL));
+}
+
+void sampleStates(Qureg qreg, const int nShots, long long int* states) {
+  // Sorted draws let a single pass over the amplitudes assign every shot its basis state
+  qreal* draws = malloc(sizeof(qreal) * nShots);
+  for (int i = 0; i < nShots; i++) {
+    draws[i] = (qreal) rand() / ((qreal) RAND_MAX + 1);
+  }
+  qsort(draws, nShots, sizeof(qreal), compareDraws);
+
+  const long long int nStates = 1LL << qreg.numQubitsRepresented;
+  qreal total = 0;
+  long long int last = 0;
+  int shot = 0;
+  for (long long int state = 0; state < nStates && shot < nShots; state++) {
+    const qreal prob = getProbAmp(qreg, state);
+    if (prob <= 0) continue;
+    total += prob;
+    last = state;
+    while (shot < nShots && draws[shot] < total) {
+      states[shot++] = state;
+    }
+  }
+  // Rounding may leave the total just short of one
+  while (shot < nShots) {
+    states[shot++] = last;
+  }
+  free(draws);
+}
+
+void printOutcomes(const long long int* states, const int nShots, const int* qubits, const int nBits) {
+  // The first bit is the most significant so outcomes sort in the order they are printed
+  unsigned long long int* outcomes = malloc(sizeof(unsigned long long int) * nShots);
+  for (int i = 0; i < nShots; i++) {
+    outcomes[i] = 0;
+    for (int j = 0; j < nBits; j++) {
+      outcomes[i] |= ((states[i] >> qubits[j]) & 1ULL) << (nBits - 1 - j);
+    }
+  }
+  qsort(outcomes, nShots, sizeof(unsigned long long int), compareOutcomes);
+
+  for (int i = 0; i < nShots;) {
+    int j = i;
+    while (j < nShots && outcomes[j] == outcomes[i]) j++;
+    for (int k = 0; k < nBits; k++) {
+      printf("%d ", (int) ((outcomes[i] >> (nBits - 1 - k)) & 1));
+    }
+    printf(": %d\n", j - i);
+    i = j;
+  }
+  free(outcomes);
+}
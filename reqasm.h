@@ -4,6 +4,8 @@
 #define REQASM_H
 
 #include "QuEST.h"
+#include <stddef.h>
+#include <stdint.h>
 
 typedef struct bitstr
 {
@@ -12,9 +14,9 @@ typedef struct bitstr
   int  nBits;
 } bitstr;
 
-const qreal pi = 3.141592653589;
-const _Bool T  = 1;
-const _Bool F  = 0;
+static const qreal pi = 3.141592653589;
+static const _Bool T  = 1;
+static const _Bool F  = 0;
 
 // Basic gates
 void U(Qureg qreg, int a, float theta, float phi, float lambda);
@@ -36,14 +38,64 @@ int ceillog(int c, int a);
 int powrem(int a, int c);
 
 void setArr(int n, int* inArr, int* outArr);
+int countOf(int *bits, int nBits);
+int decOf(int *bits, int nBits);
 
-ComplexMatrix2 uPauliX = {
+// Packed classical registers, bit i is held in bit i % CWORD_BITS of word i / CWORD_BITS
+typedef uint64_t cword;
+# define CWORD_BITS 64
+# define CWORDS(nBits) (((nBits) + CWORD_BITS - 1) / CWORD_BITS)
+# define CMASK(nBits) ((nBits) >= CWORD_BITS ? ~(cword) 0 : ((cword) 1 << (nBits)) - 1)
+
+static inline int getBit(const cword* reg, const int i) {
+  return (reg[i / CWORD_BITS] >> (i % CWORD_BITS)) & 1;
+}
+
+static inline void setBit(cword* reg, const int i, const int val) {
+  const cword bit = (cword) 1 << (i % CWORD_BITS);
+  reg[i / CWORD_BITS] = (reg[i / CWORD_BITS] & ~bit) | (-(cword) (val != 0) & bit);
+}
+
+// Word-wide access to nBits (at most CWORD_BITS) bits from start
+cword wordOf(const cword* reg, int start, int nBits);
+void setWord(cword* reg, int start, int nBits, cword val);
+
+void copyBits(cword* dst, int dstStart, const cword* src, int srcStart, int nBits);
+_Bool orOfWords (const cword* reg, int start, int nBits);
+_Bool xorOfWords(const cword* reg, int start, int nBits);
+_Bool andOfWords(const cword* reg, int start, int nBits);
+int popcountOf(const cword* reg, int start, int nBits);
+int compareBits(const cword* a, int aStart, const cword* b, int bStart, int nBits);
+int compareWord(const cword* reg, int start, int nBits, cword val);
+
+// Bump arena for the registers of circuits whose size is only known at run time.
+// A circuit marks the arena on entry and resets it to the mark on exit, so memory is only taken from the system
+// when the arena first grows, not on every call
+typedef struct arenaMark
+{
+  int block;
+  size_t top;
+} arenaMark;
+
+arenaMark markArena(void);
+void* arenaAlloc(size_t bytes);
+void resetArena(arenaMark mark);
+
+// Reset of several qubits, skipping the collapse of those in a basis state
+void resetQubits(Qureg qreg, const int* qubits, int nQubits);
+
+// Shot sampling from a single simulation, drawing from rand() once it is seeded by seedShots or the caller
+void seedShots(void);
+void sampleStates(Qureg qreg, int nShots, long long int* states);
+void printOutcomes(const long long int* states, int nShots, const int* qubits, int nBits);
+
+static ComplexMatrix2 uPauliX = {
 			  .r0c0 = {0.,0.},
 			  .r1c0 = {1.,0.},
 			  .r0c1 = {1.,0.},
 			  .r1c1 = {0.,0.}
 };
-ComplexMatrix2 uHadamard = {
+static ComplexMatrix2 uHadamard = {
 			    .r0c0 = {.real=1/sqrt(2), .imag=0},
 			    .r0c1 = {.real=1/sqrt(2), .imag=0},
 			    .r1c0 = {.real=1/sqrt(2), .imag=0},
@@ -0,0 +1,228 @@
+"""
+Helpers for the tests: parse small programs and simulate the main program of the parsed (and optimised) tree
+"""
+import gc
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# pylint: disable=wrong-import-position
+from QASMParser.parser.parser import (ProgFile)
+from QASMParser.parser.coregates import (setup_QASM_gates)
+from QASMParser.parser.types import (Gate, CallGate, Comment, Include, Let, Register, Output, InitEnv, Dealloc,
+                                     QuantumRegister, ApplyMatrix, MatrixLiteral, Measure, Reset, BatchReset)
+from QASMParser.optimise.stream import (resolve_call, qubit_keys)
+from QASMParser.optimise.unitary import (apply, phase_of, clear_cache)
+
+# Probabilities are compared to this many decimal places
+PLACES = 9
+
+HEADER = 'OPENQASM 2.0;\ninclude "qelib1.inc";\n'
+
+def parse(body, header=HEADER):
+    """ Parse a program from its text
+
+    The qubit counts kept by QuantumRegister are reset first, as each test parses a fresh program.
+
+    :param body: Text of the program after its header
+    :param header: Version line and includes
+    :returns: Parsed program
+    :rtype: ProgFile
+    """
+    if "U" not in Gate.internalGates:
+        setup_QASM_gates()
+    QuantumRegister.numQubits = 0
+    QuantumRegister.numGateQubits = 0
+    QuantumRegister.numPhysicalQubits = None
+    # Programs of earlier tests (and the unitaries cached for their circuits) hold their files open until
+    # collected, which counts towards the depth of includes
+    clear_cache()
+    gc.collect()
+    directory = tempfile.mkdtemp()
+    # Files held by earlier programs count as open includes, so every program and its qelib1.inc get their own name
+    stem = os.path.basename(directory)
+    filename = stem + ".qasm"
+    cwd = os.getcwd()
+    try:
+        shutil.copy(os.path.join(ROOT, "examples", "qelib1.inc"), os.path.join(directory, stem + ".inc"))
+        with open(os.path.join(directory, filename), "w") as source:
+            source.write(header.replace("qelib1.inc", stem + ".inc") + body)
+        # Includes are resolved from the working directory
+        os.chdir(directory)
+        return ProgFile(filename)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+def num_physical():
+    """ Number of qubits in the simulated state """
+    if QuantumRegister.numPhysicalQubits is not None:
+        return QuantumRegister.numPhysicalQubits
+    return QuantumRegister.numQubits + QuantumRegister.numGateQubits
+
+class Branch:
+    """ One outcome of the measurements so far: an unnormalised state, whose squared norm is its probability, and
+    the bits measured into each classical register """
+    def __init__(self, state, bits):
+        self.state = state
+        self.bits = bits
+
+class Simulator:
+    """ Simulate the main program of a parsed tree qubit by qubit on its physical indices
+
+    Supports straight-line programs of gate calls with constant parameters, precomputed matrices, measurements,
+    resets and outputs, which is all the passes under test produce from the programs of the tests.
+
+    :param codeObj: Program to simulate
+    :param operator: Initial state (or states, as columns), the zero state if None
+    """
+    def __init__(self, codeObj, operator=None):
+        self.codeObj = codeObj
+        self.nQubits = num_physical()
+        if operator is None:
+            operator = np.zeros((2**self.nQubits, 1), dtype=complex)
+            operator[0, 0] = 1
+        cregs = {reg.name: [0]*reg.size for reg in codeObj.code
+                 if isinstance(reg, Register) and not isinstance(reg, QuantumRegister)}
+        self.branches = [Branch(operator, cregs)]
+        self.run(codeObj.code)
+
+    def run(self, code):
+        """ Apply each line of code to every branch """
+        for line in code:
+            if isinstance(line, (Comment, Gate, Let, Register, Output, InitEnv, Dealloc, MatrixLiteral)):
+                continue
+            if isinstance(line, Include):
+                self.run(line.raw_code)
+            elif isinstance(line, (CallGate, ApplyMatrix)):
+                self.gate(line)
+            elif isinstance(line, Measure):
+                for (reg, index), (creg, bindex) in self.unroll(line, line.qargs, line.pargs):
+                    bits = range(creg.size) if bindex is None else self.indices(creg, bindex)
+                    for qubit, bit in zip(self.qubits(reg, index), bits):
+                        self.measure(qubit, creg.name, bit)
+            elif isinstance(line, Reset):
+                for (reg, index), in self.unroll(line, line.qargs):
+                    for qubit in self.qubits(reg, index):
+                        self.reset(qubit)
+            elif isinstance(line, BatchReset):
+                if line.whole:
+                    for branch in self.branches:
+                        norm = np.linalg.norm(branch.state, axis=0)
+                        branch.state = np.zeros_like(branch.state)
+                        branch.state[0] = norm
+                    continue
+                for reg, index in line.qargs:
+                    for qubit in self.qubits(reg, index):
+                        self.reset(qubit)
+            else:
+                raise NotImplementedError(type(line).__name__)
+
+    @staticmethod
+    def unroll(line, *args):
+        """ Arguments of line for each pass of its implicit loop, with the loop variable replaced by its value
+
+        :param line: Line whose arguments are unrolled
+        :param args: [register, index] arguments of line
+        :returns: Tuples of the arguments for each pass
+        :rtype: list
+        """
+        loops = getattr(line, "loops", None)
+        if not loops:
+            return [args]
+        if len(loops.var) != 1:
+            raise NotImplementedError(loops.var)
+        var = loops.var[0]
+        return [tuple([reg, value if index == var else index] for reg, index in args)
+                for value in range(loops.start[0], loops.end[0] + 1, loops.step[0])]
+
+    def indices(self, reg, index):
+        """ Indices of reg addressed by index """
+        if index is None:
+            return list(range(reg.size))
+        _, targets = qubit_keys(self.codeObj, reg, index, set())
+        if targets is None:
+            raise NotImplementedError(index)
+        return [target for _, target in targets]
+
+    def qubits(self, reg, index):
+        """ Physical indices of the qubits of reg addressed by index """
+        return [reg.mapping[target] for target in self.indices(reg, index)]
+
+    def gate(self, line):
+        """ Apply a gate call, repeated over the qubits of its implicit loops """
+        matrix = resolve_call(self.codeObj, line, set()).matrix
+        if matrix is None:
+            raise NotImplementedError(getattr(line, "name", line))
+        qargs = line.qargs + line.controls if isinstance(line, ApplyMatrix) else line.qargs
+        args = [self.qubits(reg, index) for reg, index in qargs]
+        for repeat in range(max(len(qubits) for qubits in args)):
+            qubits = [qubits[repeat] if len(qubits) > 1 else qubits[0] for qubits in args]
+            for branch in self.branches:
+                branch.state = apply(branch.state, matrix, qubits, self.nQubits)
+
+    def project(self, state, qubit, outcome):
+        """ Part of state in which qubit has the given outcome """
+        mask = ((np.arange(len(state)) >> qubit) & 1) == outcome
+        return state * mask[:, None]
+
+    def split(self, qubit):
+        """ Replace each branch by its parts with qubit 0 and 1, dropping parts which cannot happen
+
+        :returns: (branch, outcome) pairs
+        :rtype: list
+        """
+        parts = []
+        for branch in self.branches:
+            for outcome in (0, 1):
+                state = self.project(branch.state, qubit, outcome)
+                if np.linalg.norm(state) > 10**-PLACES:
+                    parts.append((Branch(state, {name: list(bits) for name, bits in branch.bits.items()}), outcome))
+        self.branches = [branch for branch, _ in parts]
+        return parts
+
+    def measure(self, qubit, creg, bit):
+        """ Measure qubit into bit of creg """
+        for branch, outcome in self.split(qubit):
+            branch.bits[creg][bit] = outcome
+
+    def reset(self, qubit):
+        """ Reset qubit to zero """
+        flip = np.array([[0, 1], [1, 0]], dtype=complex)
+        for branch, outcome in self.split(qubit):
+            if outcome:
+                branch.state = apply(branch.state, flip, [qubit], self.nQubits)
+
+    def outcomes(self):
+        """ Probability of each value of the classical registers
+
+        :returns: Probability keyed by a tuple of (register name, bits) pairs
+        :rtype: dict
+        """
+        probs = {}
+        for branch in self.branches:
+            key = tuple(sorted((name, tuple(bits)) for name, bits in branch.bits.items()))
+            probs[key] = probs.get(key, 0) + np.linalg.norm(branch.state)**2
+        return {key: round(prob, PLACES) for key, prob in probs.items() if round(prob, PLACES)}
+
+def unitary(codeObj):
+    """ Unitary of a program without measurements over the physical qubits """
+    simulator = Simulator(codeObj, np.eye(2**num_physical(), dtype=complex))
+    if len(simulator.branches) != 1:
+        raise NotImplementedError("Measurement")
+    return simulator.branches[0].state
+
+def outcomes(codeObj):
+    """ Probability of each value of the classical registers at the end of the program, see Simulator.outcomes """
+    return Simulator(codeObj).outcomes()
+
+def same_unitary(first, second):
+    """ Check whether two unitaries are equal up to global phase """
+    return first.shape == second.shape and phase_of(first, second) is not None
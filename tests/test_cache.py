@@ -0,0 +1,58 @@
+"""
+Regression tests of the codegen cache shared between runs on different programs
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The circuit g is identical in both programs but for the rotation it applies, and in the second a precomputed
+# literal is declared before the one of g
+FIRST = """OPENQASM 2.0;
+include "qelib1.inc";
+gate g a { rz(0.1) a; }
+qreg q[1];
+g q[0];
+"""
+
+SECOND = """OPENQASM 2.0;
+include "qelib1.inc";
+gate k a { rx(0.7) a; }
+gate g a { rz(0.2) a; }
+qreg q[1];
+k q[0];
+g q[0];
+"""
+
+class TestCodeCache(unittest.TestCase):
+    """ Programs translated back to back through one cache directory """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        shutil.copy(os.path.join(ROOT, "examples", "qelib1.inc"), self.directory)
+        for name, text in (("first.qasm", FIRST), ("second.qasm", SECOND)):
+            with open(os.path.join(self.directory, name), "w") as source:
+                source.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def translate(self, source, output, *flags):
+        """ Translate source to C in the test directory and return the output """
+        subprocess.run([sys.executable, os.path.join(ROOT, "QASMToQuEST.py"), *flags, "-o", output, source],
+                       cwd=self.directory, check=True, stdout=subprocess.DEVNULL)
+        with open(os.path.join(self.directory, output)) as outFile:
+            return outFile.read()
+
+    def test_precomputed_literals(self):
+        """ A cached circuit applying a precomputed unitary is not reused for a different unitary """
+        self.translate("first.qasm", "first.c", "-O2", "--cache", "cache")
+        cached = self.translate("second.qasm", "cached.c", "-O2", "--cache", "cache")
+        fresh = self.translate("second.qasm", "fresh.c", "-O2")
+        self.assertEqual(cached, fresh)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+"""
+Tests of constant folding
+"""
+import unittest
+
+from simulate import (parse)
+from QASMParser.parser.types import (CallGate)
+from QASMParser.optimise.constfold import (fold_constants, evaluate, NotConstant)
+
+REQASM = 'REQASM 1.0;\ninclude "qelib1.inc";\n'
+
+class TestConstantFolding(unittest.TestCase):
+    """ Folding of maths known at compile time """
+    def test_negative_div(self):
+        """ div rounds differently in C and Python so a negative operand is never folded """
+        prog = parse("qreg q[3];\nval a = -3;\nval c = a div 2;\nx q[c + 2];\nz q[a + 4];\n", header=REQASM)
+        fold_constants(prog)
+        calls = {line.name: line for line in prog.code if isinstance(line, CallGate)}
+        self.assertNotIsInstance(calls["x"].qargs[0][1], int)
+        self.assertEqual(calls["z"].qargs[0][1], 1)
+        with self.assertRaises(NotConstant):
+            evaluate(prog, prog.get_objs("Copy")["c"].val)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Tests of the classical registers packed into words in the C backend
+"""
+import os
+import random
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROGRAM = """OPENQASM 2.0;
+include "qelib1.inc";
+qreg q[2];
+creg c[2];
+creg w[70];
+x q[1];
+measure q -> c;
+measure q[1] -> w[65];
+if (c == 2) x q[0];
+if (w == 5) x q[1];
+"""
+
+# Registers of four words are enough for every alignment of a run of up to two words
+NBITS = 256
+RUNS = [(start, nBits) for start in (0, 1, 31, 63, 64, 65, 100) for nBits in (1, 2, 63, 64, 65, 100, 128)
+        if start + nBits <= NBITS]
+
+HARNESS = """#include <stdio.h>
+#include "reqasm.c"
+static const cword src[4] = {%(src)s};
+static const cword init[4] = {%(init)s};
+static const int runs[][2] = {%(runs)s};
+int main() {
+  for (unsigned long i = 0; i < sizeof(runs) / sizeof(runs[0]); i++) {
+    const int start = runs[i][0], nBits = runs[i][1];
+    cword dst[4], self[4];
+    memcpy(dst, init, sizeof(dst));
+    memcpy(self, src, sizeof(self));
+    printf("%%llu %%d %%d\\n", (unsigned long long) wordOf(src, start, nBits < 64 ? nBits : 64),
+           popcountOf(src, start, nBits), compareWord(src, start, nBits, %(value)s));
+    for (int at = 0; at + nBits <= 256; at += 37) {
+      memcpy(dst, init, sizeof(dst));
+      copyBits(dst, at, src, start, nBits);
+      memcpy(self, src, sizeof(self));
+      copyBits(self, at, self, start, nBits);
+      printf("%%d", getBit(dst, 0));
+      for (int word = 0; word < 4; word++) printf(" %%llu %%llu", (unsigned long long) dst[word],
+                                                  (unsigned long long) self[word]);
+      printf("\\n");
+    }
+  }
+  return 0;
+}
+"""
+
+def compile_c(directory, source, output):
+    """ Compile source against QuEST, found through CPPFLAGS and LDFLAGS as for a translated program
+
+    :returns: Whether it compiled
+    :rtype: bool
+    """
+    compiler = os.environ.get("CC", "cc")
+    if shutil.which(compiler) is None:
+        return False
+    command = [compiler, *shlex.split(os.environ.get("CPPFLAGS", "")), "-I", ROOT, source, "-o", output,
+               *shlex.split(os.environ.get("LDFLAGS", "")), "-lQuEST", "-lm"]
+    return subprocess.run(command, cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+
+def bits_of(value, start, nBits):
+    """ nBits bits of the integer value from bit start """
+    return (value >> start) & ((1 << nBits) - 1)
+
+def copy_bits(dst, dstStart, src, srcStart, nBits):
+    """ dst with nBits bits from srcStart of src written from dstStart """
+    mask = ((1 << nBits) - 1) << dstStart
+    return (dst & ~mask) | (bits_of(src, srcStart, nBits) << dstStart)
+
+class TestPackedRegisters(unittest.TestCase):
+    """ Translation of registers to words and the word operations of reqasm.c """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_translation(self):
+        """ Registers are declared as words, set bit by bit and compared a word at a time """
+        shutil.copy(os.path.join(ROOT, "examples", "qelib1.inc"), self.directory)
+        with open(os.path.join(self.directory, "cregs.qasm"), "w") as source:
+            source.write(PROGRAM)
+        subprocess.run([sys.executable, os.path.join(ROOT, "QASMToQuEST.py"), "-o", "cregs.c", "cregs.qasm"],
+                       cwd=self.directory, check=True, stdout=subprocess.DEVNULL)
+        with open(os.path.join(self.directory, "cregs.c")) as outFile:
+            code = outFile.read()
+        for expected in ("cword c[1] = {0};", "cword w[2] = {0};", "setBit(c, _c_loop, measure(qreg, q[_c_loop]));",
+                         "setBit(w, 65, measure(qreg, q[1]));", "if (wordOf(c, 0, 2) == 2)",
+                         "if (compareWord(w, 0, 70, 5) == 0)"):
+            self.assertIn(expected, code)
+
+    def test_word_operations(self):
+        """ Reads, copies (including within a register) and comparisons agree with integer arithmetic """
+        rand = random.Random(1)
+        src, init = rand.getrandbits(NBITS), rand.getrandbits(NBITS)
+        value = rand.getrandbits(64)
+        words = lambda reg: ", ".join(f"{bits_of(reg, 64*word, 64)}ULL" for word in range(NBITS // 64))
+        with open(os.path.join(self.directory, "words.c"), "w") as source:
+            source.write(HARNESS % {"src": words(src), "init": words(init), "value": f"{value}ULL",
+                                    "runs": ", ".join(f"{{{start}, {nBits}}}" for start, nBits in RUNS)})
+        if not compile_c(self.directory, "words.c", "words"):
+            self.skipTest("QuEST is not available to compile against")
+        output = subprocess.run([os.path.join(self.directory, "words")], check=True, stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout.splitlines()
+
+        expected = []
+        for start, nBits in RUNS:
+            run = bits_of(src, start, nBits)
+            compare = 1 if run >> 64 else (bits_of(run, 0, 64) > value) - (bits_of(run, 0, 64) < value)
+            expected.append(f"{bits_of(run, 0, 64)} {bin(run).count('1')} {compare}")
+            for at in range(0, NBITS - nBits + 1, 37):
+                dst, own = copy_bits(init, at, src, start, nBits), copy_bits(src, at, src, start, nBits)
+                expected.append(" ".join([str(dst & 1)] + [f"{bits_of(dst, 64*word, 64)} {bits_of(own, 64*word, 64)}"
+                                                          for word in range(NBITS // 64)]))
+        self.assertEqual(output, expected)
+
+if __name__ == "__main__":
+    unittest.main()
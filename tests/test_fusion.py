@@ -0,0 +1,33 @@
+"""
+Tests of gate fusion
+"""
+import unittest
+
+from simulate import (parse, unitary, same_unitary)
+from QASMParser.optimise.fusion import (fuse_gates)
+
+PROGRAM = """qreg q[3];
+h q[0];
+cx q[0], q[1];
+t q[1];
+cx q[1], q[2];
+h q[2];
+rx(0.3) q[0];
+cx q[2], q[0];
+ry(0.7) q[1];
+"""
+
+class TestFusion(unittest.TestCase):
+    """ Fusion of runs of gates into unitaries on a few qubits """
+    def test_preserves_unitary(self):
+        """ Fused programs apply the same unitary, for each size of fused unitary """
+        expected = unitary(parse(PROGRAM))
+        for maxQubits in (1, 2, 3):
+            with self.subTest(maxQubits=maxQubits):
+                prog = parse(PROGRAM)
+                report = fuse_gates(prog, maxQubits)
+                self.assertTrue(same_unitary(unitary(prog), expected))
+                self.assertLessEqual(report.after, report.before)
+
+if __name__ == "__main__":
+    unittest.main()
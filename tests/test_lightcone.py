@@ -0,0 +1,45 @@
+"""
+Tests of light-cone pruning
+"""
+import unittest
+
+from simulate import (parse, outcomes)
+from QASMParser.optimise.lightcone import (prune_light_cone)
+
+PROGRAM = """qreg q[4];
+creg c[2];
+h q[0];
+cx q[0], q[1];
+h q[2];
+cx q[2], q[3];
+ry(0.4) q[1];
+measure q[0] -> c[0];
+measure q[1] -> c[1];
+x q[0];
+h q[3];
+"""
+
+class TestLightCone(unittest.TestCase):
+    """ Pruning of gates which cannot affect a measurement """
+    def test_preserves_outcomes(self):
+        """ Gates on unmeasured qubits or after the last measurement are pruned without changing the outcomes """
+        expected = outcomes(parse(PROGRAM))
+        prog = parse(PROGRAM)
+        report = prune_light_cone(prog)
+        self.assertEqual(outcomes(prog), expected)
+        self.assertEqual(report.pruned, 4)
+        self.assertEqual(report.untouched, ["q[2]", "q[3]"])
+        self.assertEqual((report.measurements, report.resets), (2, 0))
+
+    def test_resets(self):
+        """ Resets are counted apart from measurements and do not make a program without measurements prunable """
+        prog = parse("qreg q[2];\nh q[0];\nh q[1];\nreset q[0];\n")
+        report = prune_light_cone(prog)
+        self.assertEqual((report.measurements, report.resets, report.pruned), (0, 1, 0))
+        prog = parse("qreg q[3];\ncreg c[1];\nh q[0];\nh q[1];\nx q[2];\nreset q[0];\nmeasure q[1] -> c[0];\n")
+        report = prune_light_cone(prog)
+        self.assertEqual((report.measurements, report.resets, report.pruned), (1, 1, 1))
+        self.assertIn("1 measurements and 1 resets", str(report))
+
+if __name__ == "__main__":
+    unittest.main()
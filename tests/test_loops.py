@@ -0,0 +1,44 @@
+"""
+Tests of loop optimisation
+"""
+import unittest
+
+from simulate import (parse)
+from QASMParser.parser.types import (Loop, Let, CallGate, Constant)
+from QASMParser.optimise.loops import (optimise_loops)
+
+OMEQASM = 'OMEQASM 2.0;\ninclude "qelib1.inc";\n'
+
+PROGRAM = """circuit test[n] a[n] {
+  for i in [1:n-1] {
+    for j in [1:n-1] {
+      CX a[i], a[i+1];
+    }
+  }
+}
+qreg q[4];
+test[4] q;
+"""
+
+class TestLoopOptimisation(unittest.TestCase):
+    """ Hoisting and strength reduction of the maths of nested loops """
+    def test_nested_index(self):
+        """ An index of an inner loop affine in the outer variable is stepped by the outer loop, not copied """
+        prog = parse(PROGRAM, header=OMEQASM)
+        optimise_loops(prog)
+        circuit = next(line for line in prog.code if getattr(line, "name", None) == "test")
+        lets = [line for line in circuit.code if isinstance(line, Let)]
+        outer = next(line for line in circuit.code if isinstance(line, Loop))
+        inner = next(line for line in outer.code if isinstance(line, Loop))
+        # Only n-1 is hoisted, and nothing is declared per run of the inner loop
+        self.assertEqual(len(lets), 1)
+        self.assertFalse([line for line in outer.code if isinstance(line, Let)])
+        self.assertEqual(outer.var[1:], outer.induction)
+        self.assertEqual(len(outer.induction), 1)
+        call = next(line for line in inner.code if isinstance(line, CallGate))
+        index = call.qargs[1][1]
+        self.assertIsInstance(index, Constant)
+        self.assertEqual(index.name, outer.induction[0])
+
+if __name__ == "__main__":
+    unittest.main()
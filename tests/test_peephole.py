@@ -0,0 +1,36 @@
+"""
+Tests of peephole optimisation
+"""
+import unittest
+
+from simulate import (parse, unitary, same_unitary)
+from QASMParser.parser.types import (CallGate)
+from QASMParser.optimise.peephole import (optimise_gates)
+
+PROGRAM = """qreg q[2];
+h q[0];
+h q[0];
+t q[1];
+s q[1];
+cx q[0], q[1];
+cx q[0], q[1];
+rz(0.3) q[0];
+x q[1];
+rz(0) q[1];
+cx q[1], q[0];
+u3(0.2, 0.1, 0.4) q[0];
+"""
+
+class TestPeephole(unittest.TestCase):
+    """ Cancellation and merging of neighbouring gates """
+    def test_preserves_unitary(self):
+        """ The optimised program applies the same unitary with fewer gate calls """
+        expected = unitary(parse(PROGRAM))
+        prog = parse(PROGRAM)
+        optimise_gates(prog)
+        self.assertTrue(same_unitary(unitary(prog), expected))
+        # The pairs of H and CX cancel, and the runs either side of the last CX merge
+        self.assertEqual(sum(isinstance(line, CallGate) for line in prog.code), 4)
+
+if __name__ == "__main__":
+    unittest.main()
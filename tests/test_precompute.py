@@ -0,0 +1,44 @@
+"""
+Tests of unitary precomputation
+"""
+import unittest
+
+from simulate import (parse, unitary, same_unitary)
+from QASMParser.parser.types import (CallGate, ApplyMatrix)
+from QASMParser.optimise.peephole import (optimise_gates)
+from QASMParser.optimise.precompute import (precompute_gates)
+
+PROGRAM = """qreg q[2];
+h q[0];
+t q[0];
+U(0.1, 0.2, 0.3) q[1];
+cx q[0], q[1];
+s q[1];
+h q[1];
+rz(0.4) q[1];
+"""
+
+class TestPrecompute(unittest.TestCase):
+    """ Replacement of gate calls by their precomputed unitary """
+    def test_preserves_unitary(self):
+        """ Every call but CX is replaced, by literals applying the same unitary """
+        expected = unitary(parse(PROGRAM))
+        prog = parse(PROGRAM)
+        precompute_gates(prog)
+        self.assertTrue(same_unitary(unitary(prog), expected))
+        calls = [line.name for line in prog.code if isinstance(line, CallGate)]
+        self.assertEqual(calls, ["cx"])
+
+    def test_after_peephole(self):
+        """ The Us the peephole pass merges runs into are precomputed as well, as at -O2 """
+        expected = unitary(parse(PROGRAM))
+        prog = parse(PROGRAM)
+        optimise_gates(prog)
+        precompute_gates(prog)
+        self.assertTrue(same_unitary(unitary(prog), expected))
+        self.assertFalse([line for line in prog.code if isinstance(line, CallGate) and line.name == "U"])
+        # One run on q[0] and two on q[1], either side of the CX
+        self.assertEqual(sum(isinstance(line, ApplyMatrix) for line in prog.code), 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+"""
+Tests of reset optimisation
+"""
+import unittest
+
+from simulate import (parse, outcomes)
+from QASMParser.parser.types import (Reset, BatchReset)
+from QASMParser.optimise.resets import (optimise_resets)
+
+PROGRAM = """qreg q[3];
+creg c[3];
+reset q[0];
+h q[1];
+x q[2];
+reset q[1];
+reset q[2];
+h q[0];
+ry(0.3) q[2];
+measure q -> c;
+"""
+
+class TestResets(unittest.TestCase):
+    """ Elision and batching of resets """
+    def test_preserves_outcomes(self):
+        """ The reset of a fresh qubit is elided and the others batched without changing the outcomes """
+        expected = outcomes(parse(PROGRAM))
+        prog = parse(PROGRAM)
+        report = optimise_resets(prog)
+        self.assertEqual(outcomes(prog), expected)
+        self.assertEqual(report.elided, 1)
+        self.assertFalse([line for line in prog.code if isinstance(line, Reset) and not isinstance(line, BatchReset)])
+        self.assertEqual(sum(isinstance(line, BatchReset) for line in prog.code), 1)
+
+    def test_reinitialise(self):
+        """ Resets of every qubit which may not be zero reinitialise the state """
+        body = "qreg q[2];\ncreg c[2];\nh q[0];\ncx q[0], q[1];\nreset q[0];\nreset q[1];\nx q[1];\nmeasure q -> c;\n"
+        expected = outcomes(parse(body))
+        prog = parse(body)
+        report = optimise_resets(prog)
+        self.assertEqual(outcomes(prog), expected)
+        self.assertEqual(report.reinitialised, 1)
+
+if __name__ == "__main__":
+    unittest.main()
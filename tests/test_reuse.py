@@ -0,0 +1,33 @@
+"""
+Tests of qubit reuse
+"""
+import unittest
+
+from simulate import (parse, outcomes, num_physical)
+from QASMParser.optimise.reuse import (reuse_qubits)
+
+class TestReuse(unittest.TestCase):
+    """ Mapping of qubits with disjoint lifetimes onto shared indices """
+    def test_after_reset(self):
+        """ A register which has been reset shares its qubits with a later one without changing the outcomes """
+        body = ("qreg a[2];\nqreg b[2];\ncreg c[2];\nh a[0];\ncx a[0], a[1];\nreset a;\n"
+                "h b[0];\ncx b[0], b[1];\nmeasure b -> c;\n")
+        expected = outcomes(parse(body))
+        prog = parse(body)
+        reuse_qubits(prog)
+        self.assertEqual(num_physical(), 2)
+        self.assertEqual(outcomes(prog), expected)
+
+    def test_after_measurement(self):
+        """ A measured register shares its qubits with a fresh one, which is reset first, keeping the statistics of
+        both """
+        body = ("qreg a[2];\nqreg b[2];\ncreg c[2];\ncreg d[2];\nh a[0];\nry(0.6) a[1];\nmeasure a -> c;\n"
+                "x b[0];\nh b[1];\nmeasure b -> d;\n")
+        expected = outcomes(parse(body))
+        prog = parse(body)
+        reuse_qubits(prog)
+        self.assertEqual(num_physical(), 2)
+        self.assertEqual(outcomes(prog), expected)
+
+if __name__ == "__main__":
+    unittest.main()